@@ -0,0 +1,322 @@
+"""
+Front end that routes every evaluation to the backend predicted to be fastest on this machine.
+
+The first use on a host runs a short calibration: every backend of benchmark.BACKENDS that imports here
+loads and evaluates a small grid of synthetic datasets (sizes x boxes per image), each backend in its own
+spawned process. The timings are saved in a local cache file, keyed by host and by the build of the
+backends, so a rebuilt extension or another machine sharing the file gets its own calibration. Each call
+then estimates the size and per-image density of its input from a few samples of the files and picks the
+backend whose interpolated timing is lowest.
+
+    from auto_evaluate import evaluate
+    tp_ids, fp_ids, fn_ids = evaluate('ground_truths.json', 'predictions.json')
+
+    python auto_evaluate.py --calibrate --force    # recalibrate this host
+    python auto_evaluate.py ground_truths.json predictions.json
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import platform
+import re
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from benchmark import BACKENDS, run_case, write_dataset
+from common.binary_annotations import is_binary_annotation_file, open_binary_columns
+
+CACHE_VERSION = 1
+CACHE_ENV = 'COCO_EVAL_CALIBRATION'
+DEFAULT_CACHE = Path.home() / '.cache' / 'coco_evaluators' / 'calibration.json'
+
+# Calibration grid: total objects of a dataset, objects per image
+CALIBRATION_SIZES = (1000, 10000, 50000)
+CALIBRATION_BOXES_PER_IMAGE = (10, 1000)
+
+SAMPLE_BYTES = 1 << 18
+_IMAGE_ID = re.compile(rb'"image_id"\s*:\s*(-?\d+)')
+
+
+class InputProfile(NamedTuple):
+    """
+    Attributes:
+        boxes (float): ground truths and predictions together.
+        boxes_per_image (float): ground truths and predictions of one image together.
+    """
+    boxes: float
+    boxes_per_image: float
+
+
+def _file_profile(path: str) -> Tuple[float, float]:
+    """
+    (boxes, boxes per image) of one file: exact for binary files; for json files, estimated from three
+    windows (head, middle, tail) unless the file is small enough to be scanned whole.
+    """
+    if is_binary_annotation_file(path):
+        image_ids = np.frombuffer(open_binary_columns(path).image_ids, dtype=np.int32)
+        if len(image_ids) == 0:
+            return 0.0, 0.0
+        return float(len(image_ids)), len(image_ids) / len(np.unique(image_ids))
+
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        if size <= 3 * SAMPLE_BYTES:
+            windows = [f.read()]
+        else:
+            windows = []
+            for offset in (0, (size - SAMPLE_BYTES) // 2, size - SAMPLE_BYTES):
+                f.seek(offset)
+                windows.append(f.read(SAMPLE_BYTES))
+
+    ids_per_window = [_IMAGE_ID.findall(window) for window in windows]
+    found = sum(len(ids) for ids in ids_per_window)
+    if found == 0:
+        return 0.0, 0.0
+    boxes = found * size / sum(len(window) for window in windows)
+    densities = [len(ids) / len(set(ids)) for ids in ids_per_window if ids]
+    return boxes, float(np.median(densities))
+
+
+def profile_inputs(ground_truth_json: str, predictions_json: str) -> InputProfile:
+    gt_boxes, gt_density = _file_profile(ground_truth_json)
+    pred_boxes, pred_density = _file_profile(predictions_json)
+    return InputProfile(gt_boxes + pred_boxes, gt_density + pred_density)
+
+
+def host_key() -> str:
+    """
+    Host and build the timings hold for: machine, cpus, Python, and the modification times of the backend
+    modules and extensions, so rebuilding one invalidates the calibration.
+    """
+    root = Path(__file__).resolve().parent
+    build = hashlib.sha1()
+    for path in sorted(root.glob('v*_*/*')):
+        if path.suffix in ('.so', '.pyd', '.py', '.pyx'):
+            build.update(f'{path.name}:{path.stat().st_mtime_ns}'.encode())
+    return '|'.join((platform.node(), platform.machine(), str(os.cpu_count()), platform.python_version(),
+                     build.hexdigest()[:12]))
+
+
+def _calibrate_backend(backend: str, datasets: List[Dict], warmup: int, repeats: int,
+                       max_case_seconds: float) -> Dict:
+    """
+    Times one backend on the calibration datasets, in the current (spawned) process. Along each density,
+    a case whose extrapolation from the smaller sizes exceeds max_case_seconds is not run and keeps that
+    extrapolation instead: the growth measured between the last two sizes, quadratic after a single one.
+    """
+    cases = []
+    measured = {}  # boxes_per_image level -> [(boxes, seconds)] of the cases run at that density
+    for dataset in sorted(datasets, key=lambda d: (d['boxes_per_image_level'], d['boxes'])):
+        level = dataset['boxes_per_image_level']
+        case = {'boxes': dataset['boxes'], 'boxes_per_image': dataset['boxes_per_image'], 'level': level}
+        runs = measured.setdefault(level, [])
+        if runs:
+            exponent = 2.0
+            if len(runs) > 1:
+                (boxes_0, seconds_0), (boxes_1, seconds_1) = runs[-2:]
+                exponent = math.log(seconds_1 / seconds_0) / math.log(boxes_1 / boxes_0)
+            boxes, seconds = runs[-1]
+            estimate = seconds * (dataset['boxes'] / boxes) ** min(max(exponent, 1.0), 2.0)
+            if estimate > max_case_seconds:
+                case.update(seconds=estimate, extrapolated=True)
+                cases.append(case)
+                continue
+
+        result = run_case(backend, dataset['gt_json'], dataset['pred_json'], None, warmup, repeats)
+        if 'error' in result:
+            return {'error': result['error']}
+        seconds = result['load_s']['median'] + result['evaluate_s']['median']
+        case.update(seconds=seconds, extrapolated=False)
+        cases.append(case)
+        runs.append((dataset['boxes'], seconds))
+    return {'cases': cases}
+
+
+def _interpolate(x: float, xs: Sequence[float], ys: Sequence[float]) -> float:
+    """
+    Piecewise-linear function through (xs, ys), xs increasing, continued by its end segments.
+    """
+    if len(xs) == 1:
+        return ys[0]
+    i = min(max(int(np.searchsorted(xs, x)) - 1, 0), len(xs) - 2)
+    slope = (ys[i + 1] - ys[i]) / (xs[i + 1] - xs[i]) if xs[i + 1] != xs[i] else 0.0
+    return ys[i] + slope * (x - xs[i])
+
+
+class BackendSelector:
+    """
+    Calibrates the backends of this host once, caches the timings, and predicts the fastest backend for an
+    input from them.
+
+    Args:
+        cache_path: json file of the timings, shared by any number of hosts. Defaults to the
+            COCO_EVAL_CALIBRATION environment variable, then ~/.cache/coco_evaluators/calibration.json.
+        backends: names of benchmark.BACKENDS to consider, all of them by default.
+        data_dir: where the calibration datasets are generated, once.
+    """
+
+    def __init__(self, cache_path: Optional[str] = None, backends: Optional[Sequence[str]] = None,
+                 data_dir: Optional[str] = None):
+        self.cache_path = Path(cache_path or os.environ.get(CACHE_ENV) or DEFAULT_CACHE)
+        self.backends = list(backends or BACKENDS)
+        self.data_dir = Path(data_dir or Path(tempfile.gettempdir()) / 'coco_calibration')
+        self._calibration: Optional[Dict] = None
+
+    @property
+    def calibration(self) -> Dict:
+        """
+        Timings of this host, first calibrating the backends the cache has no timings of for the current build.
+        """
+        if self._calibration is None:
+            self._calibration = self._read_cache().get(host_key(), {'backends': {}, 'unavailable': {}})
+            known = {**self._calibration['backends'], **self._calibration['unavailable']}
+            missing = [backend for backend in self.backends if backend not in known]
+            if missing:
+                self.calibrate(missing)
+        return self._calibration
+
+    def calibrate(self, backends: Optional[Sequence[str]] = None, warmup: int = 1, repeats: int = 3,
+                  max_case_seconds: float = 2.0) -> Dict:
+        """
+        Calibrates backends of this host (all the selector considers by default) and saves their timings in the
+        cache file, replacing earlier timings of the same backends.
+        """
+        datasets = []
+        for level, boxes_per_image in enumerate(CALIBRATION_BOXES_PER_IMAGE):
+            for size in CALIBRATION_SIZES:
+                name = f'n{size}_bpi{boxes_per_image}_c1_s0'
+                gt_json, pred_json = write_dataset(self.data_dir / name, size, boxes_per_image, num_categories=1)
+                profile = profile_inputs(gt_json, pred_json)
+                datasets.append({'gt_json': gt_json, 'pred_json': pred_json, 'boxes': profile.boxes,
+                                 'boxes_per_image': profile.boxes_per_image, 'boxes_per_image_level': level})
+
+        cache = self._read_cache()
+        calibration = cache.get(host_key(), {'backends': {}, 'unavailable': {}})
+        calibration['created'] = time.time()
+        # A fresh process per backend keeps thread settings and imports from leaking between them
+        for backend in backends or self.backends:
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                result = executor.submit(_calibrate_backend, backend, datasets, warmup, repeats,
+                                         max_case_seconds).result()
+            calibration['backends'].pop(backend, None)
+            calibration['unavailable'].pop(backend, None)
+            if 'error' in result:
+                calibration['unavailable'][backend] = result['error']
+            else:
+                calibration['backends'][backend] = result['cases']
+
+        cache[host_key()] = calibration
+        self._write_cache(cache)
+        self._calibration = calibration
+        return calibration
+
+    def predict(self, profile: InputProfile) -> Dict[str, float]:
+        """
+        Predicted seconds of every calibrated backend for an input: log-log interpolation over the sizes of
+        the two densities around the input's, then between those densities.
+        """
+        log_boxes = math.log(max(profile.boxes, 1.0))
+        log_density = math.log(max(profile.boxes_per_image, 1.0))
+        predictions = {}
+        for backend, cases in self.calibration['backends'].items():
+            if backend not in self.backends:
+                continue
+            densities, log_seconds = [], []
+            for level in sorted({case['level'] for case in cases}):
+                level_cases = sorted((case for case in cases if case['level'] == level), key=lambda c: c['boxes'])
+                densities.append(math.log(max(np.mean([c['boxes_per_image'] for c in level_cases]), 1.0)))
+                log_seconds.append(_interpolate(log_boxes, [math.log(max(c['boxes'], 1.0)) for c in level_cases],
+                                                [math.log(max(c['seconds'], 1e-9)) for c in level_cases]))
+            # Densities outside the calibrated range take the nearest one rather than an extrapolation
+            clamped = min(max(log_density, densities[0]), densities[-1])
+            predictions[backend] = math.exp(_interpolate(clamped, densities, log_seconds))
+        return predictions
+
+    def choose(self, ground_truth_json: str, predictions_json: str) -> str:
+        predictions = self.predict(profile_inputs(ground_truth_json, predictions_json))
+        if not predictions:
+            raise RuntimeError(f'No backend could be calibrated: {self.calibration["unavailable"]}')
+        return min(predictions, key=predictions.get)
+
+    def evaluate(self, ground_truth_json: str, predictions_json: str) -> Tuple[List[int], List[int], List[int]]:
+        """
+        tp prediction ids, fp prediction ids and fn ground truth ids, from the backend predicted fastest.
+        """
+        factory, _ = BACKENDS[self.choose(ground_truth_json, predictions_json)]
+        ids = factory(None)(ground_truth_json, predictions_json)()
+        return tuple(ids_list.tolist() if isinstance(ids_list, np.ndarray) else list(ids_list) for ids_list in ids)
+
+    def _read_cache(self) -> Dict:
+        try:
+            cache = json.loads(self.cache_path.read_text())
+        except (OSError, ValueError):
+            return {}
+        if cache.get('version') != CACHE_VERSION:
+            return {}
+        return cache.get('hosts', {})
+
+    def _write_cache(self, hosts: Dict):
+        # Written to a temporary file first, so hosts sharing the file never read a partial one
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.cache_path.with_name(f'{self.cache_path.name}.{os.getpid()}.tmp')
+        tmp_path.write_text(json.dumps({'version': CACHE_VERSION, 'hosts': hosts}, indent=2))
+        os.replace(tmp_path, self.cache_path)
+
+
+_selectors: Dict[Optional[str], BackendSelector] = {}
+
+
+def evaluate(ground_truth_json: str, predictions_json: str,
+             cache_path: Optional[str] = None) -> Tuple[List[int], List[int], List[int]]:
+    """
+    Evaluates with the backend predicted fastest for this input on this host, calibrating on first use.
+    """
+    if cache_path not in _selectors:
+        _selectors[cache_path] = BackendSelector(cache_path)
+    return _selectors[cache_path].evaluate(ground_truth_json, predictions_json)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='*', help='ground truth and prediction files to evaluate')
+    parser.add_argument('--calibrate', action='store_true', help='calibrate this host if it is not yet')
+    parser.add_argument('--force', action='store_true', help='calibrate again even if the cache has timings')
+    parser.add_argument('--cache', help=f'calibration file, default: ${CACHE_ENV} or {DEFAULT_CACHE}')
+    parser.add_argument('--backends', nargs='+', choices=list(BACKENDS), help='backends to consider')
+    args = parser.parse_args(argv)
+    if args.files and len(args.files) != 2:
+        parser.error('expected a ground truth and a prediction file')
+
+    selector = BackendSelector(args.cache, args.backends)
+    if args.force:
+        selector.calibrate()
+    calibration = selector.calibration
+    if args.calibrate or args.force:
+        for backend, error in calibration['unavailable'].items():
+            print(f'{backend:<28} | unavailable: {error}')
+
+    if args.files:
+        profile = profile_inputs(*args.files)
+        predictions = selector.predict(profile)
+        for backend, seconds in sorted(predictions.items(), key=lambda item: item[1]):
+            print(f'{backend:<28} | predicted {seconds:.5f}s')
+        t1 = time.perf_counter()
+        tp_ids, fp_ids, fn_ids = selector.evaluate(*args.files)
+        t2 = time.perf_counter()
+        print(f'{len(tp_ids)} TP, {len(fp_ids)} FP, {len(fn_ids)} FN in {t2 - t1:.5f}s '
+              f'with {min(predictions, key=predictions.get)} '
+              f'(~{profile.boxes:.0f} boxes, ~{profile.boxes_per_image:.0f} per image)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
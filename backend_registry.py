@@ -0,0 +1,96 @@
+"""
+Registry of the evaluator backends, each imported on first use.
+
+Importing the registry imports none of the backends, so a job that only runs one of them pays only for that
+one: asking for a C++ backend never loads Numba, Taichi or the other extensions. A backend that cannot be
+imported here (a missing package, an extension that was never built) raises BackendUnavailable, saying
+what it needs.
+
+    from backend_registry import load_backend
+    CppEvaluator = load_backend('Simple C++')
+    tp_ids, fp_ids, fn_ids = CppEvaluator(gt_json, pred_json).evaluate()
+
+    python backend_registry.py    # lists the backends and whether they import here
+"""
+import importlib
+import sys
+from collections import namedtuple
+from types import ModuleType
+
+# typing is left out on purpose: importing it costs more than the rest of a cold start of the registry
+
+
+class BackendSpec(namedtuple('BackendSpec', ('module', 'entry_point', 'requires'))):
+    """
+    Attributes:
+        module (str): module of the backend.
+        entry_point (str): attribute of the module that load_backend returns: the evaluator class, or the
+            timing function of the backends without one.
+        requires (str): what has to be installed or built for the module to import.
+    """
+    __slots__ = ()
+
+
+class BackendUnavailable(ImportError):
+    pass
+
+
+REGISTRY: dict[str, BackendSpec] = {
+    'Simple Python': BackendSpec('v1_python.py_evaluator', 'Evaluator', 'the standard library only'),
+    'JIT': BackendSpec('v2_jit.jit_evaluator', 'measure_jit_evaluator_time', 'numpy and numba'),
+    'TaiChi': BackendSpec('v3_tai_chi.taichi_evaluator', 'measure_taichi_evaluator_time', 'numpy and taichi'),
+    'Basic Cython': BackendSpec('v4_cython.evaluator', 'Evaluator', 'the extension built by v4_cython/build.sh'),
+    'Parallel Cython': BackendSpec('v5_parallel_cython.evaluator', 'Evaluator',
+                                   'the extension built by v5_parallel_cython/build.sh'),
+    'Simple C++': BackendSpec('v6_cpp.cpp_evaluator', 'CppEvaluator', 'the extension built by v6_cpp/build.sh'),
+    'Parallel C++': BackendSpec('v7_cpp_parallel.parallel_cpp_evaluator', 'ParallelCppEvaluator',
+                                'the extension built by v7_cpp_parallel/build.sh'),
+    'Parallel C++ + shared mutex': BackendSpec('v8_cpp_parallel_shared_mutex.shared_mutex_parallel_evaluator',
+                                               'SharedMutexParallelCppEvaluator',
+                                               'the extension built by v8_cpp_parallel_shared_mutex/build.sh'),
+    'C++ + OpenMP': BackendSpec('v9_cpp_openmp.openmp_evaluator', 'OpenmpEvaluator',
+                                'the extension built by v9_cpp_openmp/build.sh'),
+    'NumPy': BackendSpec('v10_numpy.numpy_evaluator', 'NumpyEvaluator', 'numpy'),
+    'C++ engine': BackendSpec('v11_cpp_engine.engine_evaluator', 'EngineEvaluator',
+                              'the extension built by v11_cpp_engine/build.sh'),
+}
+
+_modules: dict[str, ModuleType] = {}
+
+
+def load_backend_module(name: str) -> ModuleType:
+    """
+    Imports the module of a backend, once.
+    """
+    if name not in REGISTRY:
+        raise KeyError(f'Unknown backend {name!r}, expected one of: {", ".join(REGISTRY)}')
+    if name not in _modules:
+        spec = REGISTRY[name]
+        try:
+            _modules[name] = importlib.import_module(spec.module)
+        except ImportError as error:
+            raise BackendUnavailable(f'{name} backend is not available ({error}); it needs {spec.requires}.') \
+                from error
+    return _modules[name]
+
+
+def load_backend(name: str) -> object:
+    """
+    Entry point of a backend, importing its module on the first call.
+    """
+    return getattr(load_backend_module(name), REGISTRY[name].entry_point)
+
+
+def main() -> int:
+    for name in REGISTRY:
+        try:
+            load_backend_module(name)
+            status = 'available'
+        except BackendUnavailable as error:
+            status = str(error)
+        print(f'{name:<28} | {status}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
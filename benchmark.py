@@ -0,0 +1,293 @@
+"""
+Benchmark harness: sweeps synthetic datasets and thread counts over every backend.
+
+Every run of a backend loads both files into a fresh evaluator (load time) and then calls evaluate on it
+(evaluate time); fresh instances keep the caching evaluators honest. Warm-up runs absorb JIT compilation.
+Each (backend, dataset, threads) case runs in its own spawned process, so peak RSS and thread settings
+do not leak between cases.
+
+    python benchmark.py --sizes 2000 20000 --boxes-per-image 50 2000 --threads 1 4 --output results.json
+    python benchmark.py --output new.json --baseline results.json  # exits with 1 on a regression
+
+Throughput is given in IoU pairs per second, counting the (ground truth, prediction) pairs that share an
+image and category, i.e. the pairs a plain nested loop would compare.
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from time import perf_counter
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from backend_registry import load_backend, load_backend_module
+from common.binary_annotations import load_columns
+from create_synthetic_coco import DatasetSpec, generate_dataset
+
+Evaluate = Callable[[], Tuple]
+Loader = Callable[[str, str], Evaluate]
+
+
+def _python_backend(threads: Optional[int]) -> Loader:
+    Evaluator = load_backend('Simple Python')
+    return lambda gt, pred: Evaluator(gt, pred).evaluate
+
+
+def _jit_backend(threads: Optional[int]) -> Loader:
+    jit_evaluator = load_backend_module('JIT')
+    import numba
+    if threads:
+        numba.set_num_threads(threads)
+
+    def load(gt, pred):
+        gt_boxes, pred_boxes = jit_evaluator.load_boxes_from_json(gt), jit_evaluator.load_boxes_from_json(pred)
+        return lambda: jit_evaluator.evaluate_parallel(gt_boxes, pred_boxes)
+    return load
+
+
+def _taichi_backend(threads: Optional[int]) -> Loader:
+    taichi_evaluator = load_backend_module('TaiChi')
+    if threads:
+        taichi_evaluator.init_taichi(cpu_max_num_threads=threads)
+
+    def load(gt, pred):
+        gt_boxes = taichi_evaluator.boxes_from_columns(load_columns(gt))
+        pred_boxes = taichi_evaluator.boxes_from_columns(load_columns(pred))
+        evaluator = taichi_evaluator.TaichiEvaluator()
+        return lambda: evaluator.evaluate(gt_boxes, pred_boxes)
+    return load
+
+
+def _cython_backend(threads: Optional[int]) -> Loader:
+    Evaluator = load_backend('Basic Cython')
+    return lambda gt, pred: Evaluator(gt, pred).evaluate
+
+
+def _parallel_cython_backend(threads: Optional[int]) -> Loader:
+    if threads:
+        os.environ['OMP_NUM_THREADS'] = str(threads)  # read once, when the OpenMP runtime starts
+    Evaluator = load_backend('Parallel Cython')
+    return lambda gt, pred: Evaluator(gt, pred).evaluate
+
+
+def _cpp_backend(threads: Optional[int]) -> Loader:
+    CppEvaluator = load_backend('Simple C++')
+    return lambda gt, pred: CppEvaluator(gt, pred).evaluate
+
+
+def _parallel_cpp_backend(threads: Optional[int]) -> Loader:
+    return _with_num_threads(load_backend('Parallel C++'), threads)
+
+
+def _shared_mutex_backend(threads: Optional[int]) -> Loader:
+    SharedMutexParallelCppEvaluator = load_backend('Parallel C++ + shared mutex')
+    return lambda gt, pred: SharedMutexParallelCppEvaluator(gt, pred).evaluate
+
+
+def _openmp_backend(threads: Optional[int]) -> Loader:
+    return _with_num_threads(load_backend('C++ + OpenMP'), threads)
+
+
+def _engine_backend(threads: Optional[int]) -> Loader:
+    return _with_num_threads(load_backend('C++ engine'), threads)
+
+
+def _numpy_backend(threads: Optional[int]) -> Loader:
+    NumpyEvaluator = load_backend('NumPy')
+    return lambda gt, pred: NumpyEvaluator(gt, pred).evaluate
+
+
+def _with_num_threads(evaluator_class, threads: Optional[int]) -> Loader:
+    def load(gt, pred):
+        evaluator = evaluator_class(gt, pred)
+        if threads:
+            evaluator.num_threads = threads
+        return evaluator.evaluate
+    return load
+
+
+# name -> (factory taking a thread count, whether the thread count is honoured)
+BACKENDS: Dict[str, Tuple[Callable[[Optional[int]], Loader], bool]] = {
+    'Simple Python': (_python_backend, False),
+    'JIT': (_jit_backend, True),
+    'TaiChi': (_taichi_backend, True),
+    'Basic Cython': (_cython_backend, False),
+    'Parallel Cython': (_parallel_cython_backend, True),
+    'Simple C++': (_cpp_backend, False),
+    'Parallel C++': (_parallel_cpp_backend, True),
+    'Parallel C++ + shared mutex': (_shared_mutex_backend, False),
+    'C++ + OpenMP': (_openmp_backend, True),
+    'NumPy': (_numpy_backend, False),
+    'C++ engine': (_engine_backend, True),
+}
+
+
+def write_dataset(directory: Path, num_boxes: int, boxes_per_image: int, num_categories: int,
+                  seed: int = 0) -> Tuple[str, str]:
+    """
+    Writes a synthetic ground truth / prediction pair of num_boxes objects, unless it exists. Like the small
+    and large jsons, 65% of the objects are true positives, 13% false positives and 22% false negatives.
+    """
+    gt_path, pred_path = directory / 'ground_truths.json', directory / 'predictions.json'
+    if gt_path.is_file() and pred_path.is_file():
+        return str(gt_path), str(pred_path)
+    spec = DatasetSpec(num_images=max(1, num_boxes // boxes_per_image), num_categories=num_categories,
+                       boxes_per_image=min(boxes_per_image, num_boxes), distribution='fixed', seed=seed)
+    return generate_dataset(str(directory), spec)
+
+
+def count_iou_pairs(gt_json: str, pred_json: str) -> int:
+    """
+    Number of (ground truth, prediction) pairs sharing an image and a category.
+    """
+    def group_counts(path):
+        columns = load_columns(path)
+        keys = (np.frombuffer(columns.image_ids, dtype=np.int32).astype(np.int64) << 32) | \
+            np.frombuffer(columns.category_ids, dtype=np.int32)
+        return np.unique(keys, return_counts=True)
+
+    gt_keys, gt_counts = group_counts(gt_json)
+    pred_keys, pred_counts = group_counts(pred_json)
+    _, gt_index, pred_index = np.intersect1d(gt_keys, pred_keys, assume_unique=True, return_indices=True)
+    return int(np.dot(gt_counts[gt_index].astype(np.int64), pred_counts[pred_index].astype(np.int64)))
+
+
+def run_case(backend: str, gt_json: str, pred_json: str, threads: Optional[int], warmup: int,
+             repeats: int) -> Dict:
+    """
+    Runs one case in the current process; meant to be the only case of a fresh process.
+    """
+    try:
+        factory, _ = BACKENDS[backend]
+        load = factory(threads)
+        load_times, evaluate_times = [], []
+        for run in range(warmup + repeats):
+            t1 = perf_counter()
+            evaluate = load(gt_json, pred_json)
+            t2 = perf_counter()
+            tp_ids, fp_ids, fn_ids = evaluate()
+            t3 = perf_counter()
+            if run >= warmup:
+                load_times.append(t2 - t1)
+                evaluate_times.append(t3 - t2)
+    except Exception as error:
+        return {'error': f'{type(error).__name__}: {error}'}
+
+    digest = hashlib.sha1()
+    for ids in (tp_ids, fp_ids, fn_ids):
+        digest.update(np.sort(np.asarray(ids, dtype=np.int64)).tobytes())
+    return {
+        'load_s': {'median': statistics.median(load_times), 'min': min(load_times)},
+        'evaluate_s': {'median': statistics.median(evaluate_times), 'min': min(evaluate_times),
+                       'runs': evaluate_times},
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'counts': {'tp': len(tp_ids), 'fp': len(fp_ids), 'fn': len(fn_ids)},
+        'digest': digest.hexdigest(),
+    }
+
+
+def run_isolated(*args) -> Dict:
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+        return executor.submit(run_case, *args).result()
+
+
+def case_key(result: Dict) -> Tuple:
+    return result['backend'], result['dataset']['name'], result['threads']
+
+
+def compare_to_baseline(results: List[Dict], baseline: List[Dict], tolerance: float) -> List[str]:
+    """
+    Cases whose median evaluate time grew by more than tolerance (a fraction) over the baseline run.
+    """
+    baseline_by_key = {case_key(result): result for result in baseline if 'evaluate_s' in result}
+    regressions = []
+    for result in results:
+        previous = baseline_by_key.get(case_key(result))
+        if previous is None or 'evaluate_s' not in result:
+            continue
+        before, after = previous['evaluate_s']['median'], result['evaluate_s']['median']
+        if after > before * (1 + tolerance):
+            regressions.append(f'{result["backend"]} | {result["dataset"]["name"]} | threads={result["threads"]}: '
+                               f'{before:.5f}s -> {after:.5f}s ({after / before:.2f}x)')
+    return regressions
+
+
+def format_result(result: Dict) -> str:
+    prefix = f'{result["backend"]:<28} | {result["dataset"]["name"]:<24} | threads={result["threads"]}'
+    if 'error' in result:
+        return f'{prefix} | {result["error"]}'
+    return (f'{prefix} | load {result["load_s"]["median"]:.5f}s | evaluate {result["evaluate_s"]["median"]:.5f}s | '
+            f'{result["iou_pairs_per_s"] / 1e6:.1f}M pairs/s | peak RSS {result["peak_rss_mb"]:.0f} MB')
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[2000, 20000], help='boxes per dataset')
+    parser.add_argument('--boxes-per-image', type=int, nargs='+', default=[2000])
+    parser.add_argument('--categories', type=int, nargs='+', default=[1])
+    parser.add_argument('--threads', type=int, nargs='+', default=[None],
+                        help='thread counts for the backends that take one, default: their own default')
+    parser.add_argument('--backends', nargs='+', default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', type=Path, default=Path(tempfile.gettempdir()) / 'coco_benchmark')
+    parser.add_argument('--output', type=Path, help='json file the results are written to')
+    parser.add_argument('--baseline', type=Path, help='results json of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='allowed slowdown over the baseline')
+    args = parser.parse_args(argv)
+
+    results = []
+    for size in args.sizes:
+        for boxes_per_image in args.boxes_per_image:
+            for categories in args.categories:
+                name = f'n{size}_bpi{boxes_per_image}_c{categories}_s{args.seed}'
+                gt_json, pred_json = write_dataset(args.data_dir / name, size, boxes_per_image, categories, args.seed)
+                dataset = {'name': name, 'size': size, 'boxes_per_image': boxes_per_image,
+                           'images': max(1, size // boxes_per_image), 'categories': categories,
+                           'iou_pairs': count_iou_pairs(gt_json, pred_json)}
+                digests = set()
+                for backend in args.backends:
+                    thread_counts = args.threads if BACKENDS[backend][1] else [None]
+                    for threads in thread_counts:
+                        result = {'backend': backend, 'dataset': dataset, 'threads': threads}
+                        result.update(run_isolated(backend, gt_json, pred_json, threads, args.warmup, args.repeats))
+                        if 'evaluate_s' in result:
+                            result['iou_pairs_per_s'] = dataset['iou_pairs'] / max(result['evaluate_s']['median'], 1e-9)
+                        results.append(result)
+                        print(format_result(result), flush=True)
+                        if 'digest' in result:
+                            digests.add(result['digest'])
+                if len(digests) > 1:
+                    print(f'WARNING: backends disagree on {name}', flush=True)
+
+    report = {
+        'machine': {'platform': platform.platform(), 'python': sys.version.split()[0],
+                    'cpu_count': os.cpu_count()},
+        'config': {key: (str(value) if isinstance(value, Path) else value) for key, value in vars(args).items()},
+        'results': results,
+    }
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+
+    if args.baseline:
+        regressions = compare_to_baseline(results, json.loads(args.baseline.read_text())['results'], args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            return 1
+        print(f'No regressions against {args.baseline}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
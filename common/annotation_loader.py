@@ -0,0 +1,228 @@
+"""
+Incremental loader for COCO-style annotation files.
+
+Only the ``annotations`` array of the document is read, one annotation at a time, and every
+annotation is written straight into compact columns. The full JSON document is never held in
+memory, which keeps the peak memory of multi-million-annotation files close to the size of the
+columns themselves.
+"""
+import json
+import re
+from array import array
+from typing import Iterator, TextIO
+
+CHUNK_SIZE = 1 << 20
+
+_NON_WHITESPACE = re.compile(r'[^ \t\n\r]')
+_STRUCTURAL = re.compile(r'["\[\]{}]')
+_STRING_SPECIAL = re.compile(r'["\\]')
+_ITEM_SEPARATOR = re.compile(r'[ \t\n\r]*([,\]])[ \t\n\r]*')
+_NUMBER_CONTINUATION = re.compile(r'[0-9.eE+-]')
+_decoder = json.JSONDecoder()
+
+
+class AnnotationColumns:
+    """
+    Columnar store of the annotations of one file.
+
+    Attributes:
+        annotation_ids (array): int32 annotation ids.
+        image_ids (array): int32 image ids.
+        category_ids (array): int32 category ids.
+        x1 (array): float32 left edge of the bounding-box.
+        y1 (array): float32 top edge of the bounding-box.
+        x2 (array): float32 right edge of the bounding-box (x1 + w).
+        y2 (array): float32 bottom edge of the bounding-box (y1 + h).
+
+    All columns support the buffer protocol, so ``np.frombuffer`` can view them without a copy.
+    """
+    __slots__ = ('annotation_ids', 'image_ids', 'category_ids', 'x1', 'y1', 'x2', 'y2')
+
+    def __init__(self):
+        self.annotation_ids = array('i')
+        self.image_ids = array('i')
+        self.category_ids = array('i')
+        self.x1 = array('f')
+        self.y1 = array('f')
+        self.x2 = array('f')
+        self.y2 = array('f')
+
+    def __len__(self):
+        return len(self.annotation_ids)
+
+    def append(self, annotation: dict):
+        x, y, w, h = annotation['bbox'][:4]
+        self.annotation_ids.append(annotation['annotation_id'])
+        self.image_ids.append(annotation['image_id'])
+        self.category_ids.append(annotation['category_id'])
+        self.x1.append(x)
+        self.y1.append(y)
+        self.x2.append(x + w)
+        self.y2.append(y + h)
+
+
+class _JsonStream:
+    """
+    Minimal pull reader over a text file that keeps only one chunk (plus the value being
+    decoded) in memory.
+    """
+
+    def __init__(self, file: TextIO, chunk_size: int):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """
+        Returns the next non-whitespace character without consuming it, or '' at the end of the file.
+        """
+        while True:
+            match = _NON_WHITESPACE.search(self.buffer, self.pos)
+            if match is not None:
+                self.pos = match.start()
+                return self.buffer[self.pos]
+            self.pos = len(self.buffer)
+            if not self._fill():
+                return ''
+
+    def expect(self, char: str):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Malformed annotation file: expected '{char}', found '{found}'.")
+        self.pos += 1
+
+    def decode(self):
+        """
+        Decodes the next complete JSON value.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number cut by the end of the buffer decodes to a prefix of itself ('12' of '12.5', '1.5' of
+            # '1.5e3'): read on while it ends there or right before a character that would continue it
+            if (end == len(self.buffer) or _NUMBER_CONTINUATION.match(self.buffer, end)) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def iter_array(self) -> Iterator:
+        """
+        Yields the items of the array that starts at the current position, one decoded item at a time.
+        """
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            # Fast path: decode the items that are complete in the current chunk back to back
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+                separator = _ITEM_SEPARATOR.match(self.buffer, end)
+            except json.JSONDecodeError:
+                separator = None
+            if separator is None or separator.end() == len(self.buffer):
+                value = self.decode()
+                yield value
+                if self.peek() != ',':
+                    self.expect(']')
+                    return
+                self.pos += 1
+                self.peek()
+                continue
+            self.pos = separator.end()
+            yield value
+            if separator.group(1) == ']':
+                return
+
+    def skip_value(self):
+        """
+        Skips the next JSON value without building it.
+        """
+        if self.peek() not in '[{':
+            self.decode()
+            return
+
+        depth = 0
+        while True:
+            match = _STRUCTURAL.search(self.buffer, self.pos)
+            if match is None:
+                self.pos = len(self.buffer)
+                if not self._fill():
+                    raise ValueError('Malformed annotation file: unexpected end of file.')
+                continue
+            self.pos = match.end()
+            char = match.group()
+            if char == '"':
+                self._skip_string_tail()
+            elif char in '[{':
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return
+
+    def _skip_string_tail(self):
+        while True:
+            match = _STRING_SPECIAL.search(self.buffer, self.pos)
+            if match is None or (match.group() == '\\' and match.end() == len(self.buffer)):
+                # Keep a trailing backslash so the escaped character is read together with it
+                self.pos = len(self.buffer) if match is None else match.start()
+                if not self._fill():
+                    raise ValueError('Malformed annotation file: unterminated string.')
+                continue
+            if match.group() == '"':
+                self.pos = match.end()
+                return
+            self.pos = match.end() + 1
+
+
+def iter_annotations(json_path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[dict]:
+    """
+    Yields the items of the top-level ``annotations`` array one by one. Other top-level keys are
+    skipped without being decoded.
+
+    Args:
+        json_path: path of a COCO-style json file.
+        chunk_size: number of characters read from the file at a time.
+    """
+    with open(json_path) as f:
+        stream = _JsonStream(f, chunk_size)
+        stream.expect('{')
+        while stream.peek() != '}':
+            key = stream.decode()
+            stream.expect(':')
+            if key == 'annotations':
+                yield from stream.iter_array()
+                return
+            stream.skip_value()
+            if stream.peek() == ',':
+                stream.pos += 1
+    raise KeyError('annotations')
+
+
+def load_annotation_columns(json_path: str, chunk_size: int = CHUNK_SIZE) -> AnnotationColumns:
+    """
+    Streams the annotations of a COCO-style json file into an AnnotationColumns store.
+    """
+    columns = AnnotationColumns()
+    for annotation in iter_annotations(json_path, chunk_size):
+        columns.append(annotation)
+    return columns
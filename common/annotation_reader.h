@@ -0,0 +1,513 @@
+#ifndef ANNOTATION_READER_H
+#define ANNOTATION_READER_H
+
+#include <algorithm>
+#include <cctype>
+#include <cstdlib>
+#include <cstring>
+#include <exception>
+#include <functional>
+#include <istream>
+#include <iterator>
+#include <memory>
+#include <stdexcept>
+#include <string>
+#include <thread>
+#include <vector>
+#include "binary_annotations.h"
+
+// One item of the "annotations" array of a COCO-style file
+struct AnnotationRecord {
+    int annotation_id = 0;
+    int image_id = 0;
+    int category_id = 0;
+    int bbox[4] = {0, 0, 0, 0};  // x, y, w, h
+};
+
+// Bytes of the annotations array every parsing thread gets at least, so small files stay on one thread
+static const std::size_t MIN_ANNOTATION_CHUNK_BYTES = 1 << 20;
+
+// Hand-written scanner over a json text held in memory. Only annotation_id, image_id, category_id and
+// bbox of the annotations are extracted, straight into AnnotationRecords; every other value is skipped
+// without being decoded. Errors report their byte offset in the whole document.
+class AnnotationScanner {
+public:
+    AnnotationScanner(const char* document, const char* begin, const char* end)
+        : document(document), pos(begin), end(end) {}
+
+    const char* position() const {
+        return pos;
+    }
+
+    // Top-level object: on_annotations is called with the scanner on every "annotations" array and must
+    // move it past the array; other values are skipped
+    template <typename OnAnnotations>
+    void scan_document(OnAnnotations on_annotations) {
+        expect('{');
+        if (consume('}')) {
+            return;
+        }
+        do {
+            const char* key_end;
+            const char* key = read_key(&key_end);
+            expect(':');
+            if (equals(key, key_end, "annotations") && peek() == '[') {
+                on_annotations(*this);
+            } else {
+                skip_value();
+            }
+        } while (consume(','));
+        expect('}');
+        skip_whitespace();
+        if (pos != end) {
+            fail("unexpected data after the document");
+        }
+    }
+
+    // Moves past the opening bracket of the array at the current position; false if the array is empty
+    bool enter_array() {
+        expect('[');
+        return !consume(']');
+    }
+
+    // Whole array of annotations at the current position
+    void read_annotations(std::vector<AnnotationRecord>& records) {
+        if (enter_array()) {
+            read_elements(records, nullptr);
+        }
+    }
+
+    // Array elements from the current position, which must be an element start, up to the closing bracket
+    // or, when given, up to stop. False when stop does not fall exactly on the start of an element.
+    bool read_elements(std::vector<AnnotationRecord>& records, const char* stop) {
+        while (true) {
+            records.push_back(read_annotation());
+            if (!consume(',')) {
+                break;
+            }
+            if (stop != nullptr) {
+                skip_whitespace();
+                if (pos >= stop) {
+                    return pos == stop;
+                }
+            }
+        }
+        expect(']');
+        return stop == nullptr;
+    }
+
+    [[noreturn]] void fail(const std::string& what) const {
+        throw std::runtime_error("Failed to parse JSON at byte " + std::to_string(pos - document) + ": " + what);
+    }
+
+private:
+    const char* document;
+    const char* pos;
+    const char* end;
+
+    static bool equals(const char* begin, const char* end, const char* name) {
+        std::size_t length = std::strlen(name);
+        return static_cast<std::size_t>(end - begin) == length && std::memcmp(begin, name, length) == 0;
+    }
+
+    void skip_whitespace() {
+        while (pos < end && (*pos == ' ' || *pos == '\n' || *pos == '\r' || *pos == '\t')) {
+            ++pos;
+        }
+    }
+
+    char peek() {
+        skip_whitespace();
+        if (pos == end) {
+            fail("unexpected end of input");
+        }
+        return *pos;
+    }
+
+    bool consume(char c) {
+        if (peek() != c) {
+            return false;
+        }
+        ++pos;
+        return true;
+    }
+
+    void expect(char c) {
+        if (!consume(c)) {
+            fail(std::string("expected '") + c + "'");
+        }
+    }
+
+    // Moves past the string whose opening quote is at pos; returns the start and end of its raw contents
+    const char* skip_string(const char** contents_end) {
+        const char* contents = ++pos;
+        while (pos < end && *pos != '"') {
+            pos += *pos == '\\' ? 2 : 1;
+        }
+        if (pos >= end) {
+            fail("unterminated string");
+        }
+        *contents_end = pos++;
+        return contents;
+    }
+
+    // Object key, compared raw: escapes are not decoded
+    const char* read_key(const char** key_end) {
+        if (peek() != '"') {
+            fail("expected an object key");
+        }
+        return skip_string(key_end);
+    }
+
+    // Moves past the value at the current position without extracting anything
+    void skip_value() {
+        const char* contents_end;
+        switch (peek()) {
+            case '"':
+                skip_string(&contents_end);
+                return;
+            case '{':
+                ++pos;
+                if (consume('}')) {
+                    return;
+                }
+                do {
+                    read_key(&contents_end);
+                    expect(':');
+                    skip_value();
+                } while (consume(','));
+                expect('}');
+                return;
+            case '[':
+                ++pos;
+                if (consume(']')) {
+                    return;
+                }
+                do {
+                    skip_value();
+                } while (consume(','));
+                expect(']');
+                return;
+            case 't':
+                skip_literal("true");
+                return;
+            case 'f':
+                skip_literal("false");
+                return;
+            case 'n':
+                skip_literal("null");
+                return;
+            default:
+                read_number();
+        }
+    }
+
+    void skip_literal(const char* literal) {
+        std::size_t length = std::strlen(literal);
+        if (static_cast<std::size_t>(end - pos) < length || std::memcmp(pos, literal, length) != 0) {
+            fail("invalid literal");
+        }
+        pos += length;
+    }
+
+    bool at_number() {
+        char c = peek();
+        return c == '-' || (c >= '0' && c <= '9');
+    }
+
+    // Number truncated to an int; plain integers are accumulated directly, anything else goes through strtod
+    int read_number() {
+        const char* start = pos;
+        if (pos < end && *pos == '-') {
+            ++pos;
+        }
+        const char* digits = pos;
+        long long value = 0;
+        while (pos < end && *pos >= '0' && *pos <= '9') {
+            value = value * 10 + (*pos++ - '0');
+        }
+        if (pos == digits) {
+            fail("invalid number");
+        }
+        if (pos == end || (*pos != '.' && *pos != 'e' && *pos != 'E')) {
+            return static_cast<int>(*start == '-' ? -value : value);
+        }
+
+        while (pos < end && (std::isdigit(static_cast<unsigned char>(*pos)) || *pos == '.' || *pos == 'e'
+                             || *pos == 'E' || *pos == '+' || *pos == '-')) {
+            ++pos;
+        }
+        char buffer[64];
+        std::size_t length = std::min<std::size_t>(pos - start, sizeof(buffer) - 1);
+        std::memcpy(buffer, start, length);
+        buffer[length] = '\0';
+        return static_cast<int>(std::strtod(buffer, nullptr));
+    }
+
+    // A number is stored in field; any other value is skipped and leaves it unchanged
+    void read_field(int& field) {
+        if (at_number()) {
+            field = read_number();
+        } else {
+            skip_value();
+        }
+    }
+
+    AnnotationRecord read_annotation() {
+        AnnotationRecord record;
+        expect('{');
+        if (consume('}')) {
+            return record;
+        }
+        do {
+            const char* key_end;
+            const char* key = read_key(&key_end);
+            expect(':');
+            if (equals(key, key_end, "annotation_id")) {
+                read_field(record.annotation_id);
+            } else if (equals(key, key_end, "image_id")) {
+                read_field(record.image_id);
+            } else if (equals(key, key_end, "category_id")) {
+                read_field(record.category_id);
+            } else if (equals(key, key_end, "bbox") && peek() == '[') {
+                read_bbox(record);
+            } else {
+                skip_value();
+            }
+        } while (consume(','));
+        expect('}');
+        return record;
+    }
+
+    // The first four numbers of the bbox array; other values are skipped
+    void read_bbox(AnnotationRecord& record) {
+        ++pos;
+        if (consume(']')) {
+            return;
+        }
+        int index = 0;
+        do {
+            if (index < 4 && at_number()) {
+                record.bbox[index++] = read_number();
+            } else {
+                skip_value();
+            }
+        } while (consume(','));
+        expect(']');
+    }
+};
+
+// Guessed start of an annotations array element at or after from: an object opening right after the
+// comma that follows the end of another object. Strings or nested arrays of objects can fool the guess,
+// so the parse of the chunk before it has to confirm it.
+inline const char* next_annotation_start(const char* from, const char* end) {
+    for (const char* p = from; p < end; ++p) {
+        if (*p != ',') {
+            continue;
+        }
+        const char* before = p;
+        while (before > from && std::isspace(static_cast<unsigned char>(before[-1]))) {
+            --before;
+        }
+        const char* after = p + 1;
+        while (after < end && std::isspace(static_cast<unsigned char>(*after))) {
+            ++after;
+        }
+        if (before > from && before[-1] == '}' && after < end && *after == '{') {
+            return after;
+        }
+    }
+    return end;
+}
+
+// Elements of the annotations array at the scanner position, leaving the scanner past the array.
+// Big arrays are cut into one chunk per thread at guessed element starts and every chunk is parsed on its
+// own thread. Each chunk has to end exactly on the start of the next one, and the last one on the end of
+// the array; otherwise, or on any error, the array is parsed again on one thread, which then reports the
+// actual error.
+inline void read_annotation_array(AnnotationScanner& scanner, const char* document, const char* end,
+                                  unsigned num_threads, std::vector<AnnotationRecord>& records) {
+    const char* array_begin = scanner.position();
+    std::size_t num_chunks = std::min<std::size_t>(num_threads, (end - array_begin) / MIN_ANNOTATION_CHUNK_BYTES);
+    if (num_chunks <= 1) {
+        scanner.read_annotations(records);
+        return;
+    }
+
+    // The end of the array is only known once it is parsed, so the guesses spread over the rest of the
+    // document; the annotations usually come last
+    std::vector<const char*> starts = {array_begin};
+    for (std::size_t c = 1; c < num_chunks; ++c) {
+        const char* guess = next_annotation_start(array_begin + (end - array_begin) * c / num_chunks, end);
+        if (guess < end && guess > starts.back()) {
+            starts.push_back(guess);
+        }
+    }
+
+    std::vector<std::vector<AnnotationRecord>> chunks(starts.size());
+    std::vector<char> valid(starts.size(), 0);
+    AnnotationScanner after_array = scanner;
+    auto parse_chunk = [&](std::size_t c) {
+        const char* stop = c + 1 < starts.size() ? starts[c + 1] : nullptr;
+        try {
+            AnnotationScanner chunk_scanner(document, starts[c], end);
+            if (c == 0) {
+                // The first chunk starts on the opening bracket, the others on an element
+                valid[c] = chunk_scanner.enter_array() && chunk_scanner.read_elements(chunks[c], stop);
+            } else {
+                valid[c] = chunk_scanner.read_elements(chunks[c], stop);
+            }
+            if (stop == nullptr) {
+                after_array = chunk_scanner;
+            }
+        } catch (const std::exception&) {
+            valid[c] = 0;
+        }
+    };
+    std::vector<std::thread> threads;
+    for (std::size_t c = 1; c < starts.size(); ++c) {
+        threads.emplace_back(parse_chunk, c);
+    }
+    parse_chunk(0);
+    for (auto& thread : threads) {
+        thread.join();
+    }
+
+    if (std::all_of(valid.begin(), valid.end(), [](char chunk_valid) { return chunk_valid != 0; })) {
+        for (const auto& chunk : chunks) {
+            records.insert(records.end(), chunk.begin(), chunk.end());
+        }
+        scanner = after_array;
+        return;
+    }
+    scanner.read_annotations(records);
+}
+
+// Annotations of a json document held in memory, in document order
+inline std::vector<AnnotationRecord> parse_annotations(const char* data, std::size_t size, unsigned num_threads = 1) {
+    std::vector<AnnotationRecord> records;
+    const char* end = data + size;
+    AnnotationScanner scanner(data, data, end);
+    scanner.scan_document([&](AnnotationScanner& array_scanner) {
+        read_annotation_array(array_scanner, data, end, num_threads, records);
+    });
+    return records;
+}
+
+// Hands every annotation of the "annotations" array of a COCO-style json document to the callback. The
+// whole stream is read into memory first; files are better read with LoadedAnnotations, which maps
+// them instead.
+inline void read_annotations(std::istream& input, std::function<void(const AnnotationRecord&)> on_annotation) {
+    std::string text((std::istreambuf_iterator<char>(input)), std::istreambuf_iterator<char>());
+    for (const auto& record : parse_annotations(text.data(), text.size())) {
+        on_annotation(record);
+    }
+}
+
+// Hands over annotations already in memory as rows of annotation_id, image_id, category_id, x, y, w, h,
+// e.g. the buffer of a C-contiguous (N, 7) int32 array.
+inline void read_annotation_rows(const int* rows, std::size_t num_rows, std::function<void(const AnnotationRecord&)> on_annotation) {
+    AnnotationRecord record;
+    for (std::size_t i = 0; i < num_rows; ++i) {
+        const int* row = rows + 7 * i;
+        record.annotation_id = row[0];
+        record.image_id = row[1];
+        record.category_id = row[2];
+        record.bbox[0] = row[3];
+        record.bbox[1] = row[4];
+        record.bbox[2] = row[5];
+        record.bbox[3] = row[6];
+        on_annotation(record);
+    }
+}
+
+// Annotations of either a binary annotation file or a json file, both read straight from a memory map.
+// A binary file stays mapped and its columns are handed over in place; the annotations array of a json
+// file is parsed into records, split across up to num_threads threads. A binary file whose source json
+// changed since the conversion, or that was written in an older format, is ignored in favour of that json.
+class LoadedAnnotations {
+public:
+    LoadedAnnotations(const std::string& path, unsigned num_threads) {
+        std::string json_path = path;
+        if (is_binary_annotation_file(path)) {
+            mapped.reset(new MappedAnnotations(path));
+            if (!mapped->use_source()) {
+                return;
+            }
+            json_path = mapped->source_path;
+            mapped.reset();
+        }
+        MappedFile json(json_path);
+        records = parse_annotations(json.bytes(), json.size, num_threads);
+    }
+
+    std::size_t size() const {
+        return mapped ? mapped->count : records.size();
+    }
+
+    // Hands every annotation to the callback, in file order
+    void for_each(const std::function<void(const AnnotationRecord&)>& on_annotation) const {
+        if (!mapped) {
+            for (const auto& record : records) {
+                on_annotation(record);
+            }
+            return;
+        }
+        AnnotationRecord record;
+        for (std::size_t i = 0; i < mapped->count; ++i) {
+            record.annotation_id = mapped->annotation_ids[i];
+            record.image_id = mapped->image_ids[i];
+            record.category_id = mapped->category_ids[i];
+            record.bbox[0] = static_cast<int>(mapped->x1[i]);
+            record.bbox[1] = static_cast<int>(mapped->y1[i]);
+            record.bbox[2] = static_cast<int>(mapped->w[i]);
+            record.bbox[3] = static_cast<int>(mapped->h[i]);
+            on_annotation(record);
+        }
+    }
+
+private:
+    std::unique_ptr<MappedAnnotations> mapped;
+    std::vector<AnnotationRecord> records;
+};
+
+inline unsigned hardware_threads() {
+    return std::max(std::thread::hardware_concurrency(), 1u);
+}
+
+inline void read_annotation_file(const std::string& path, std::function<void(const AnnotationRecord&)> on_annotation) {
+    LoadedAnnotations(path, hardware_threads()).for_each(on_annotation);
+}
+
+// Reads the ground truth and prediction files at the same time, each on half of the hardware threads,
+// then hands their annotations to the callbacks on the calling thread, ground truths first.
+inline void read_annotation_files(const std::string& ground_truth_path, const std::string& predictions_path,
+                                  std::function<void(const AnnotationRecord&)> on_ground_truth,
+                                  std::function<void(const AnnotationRecord&)> on_prediction) {
+    unsigned threads_per_file = std::max(hardware_threads() / 2, 1u);
+    std::unique_ptr<LoadedAnnotations> predictions;
+    std::exception_ptr predictions_error;
+    std::thread predictions_reader([&]() {
+        try {
+            predictions.reset(new LoadedAnnotations(predictions_path, threads_per_file));
+        } catch (...) {
+            predictions_error = std::current_exception();
+        }
+    });
+    std::unique_ptr<LoadedAnnotations> ground_truths;
+    try {
+        ground_truths.reset(new LoadedAnnotations(ground_truth_path, threads_per_file));
+    } catch (...) {
+        predictions_reader.join();
+        throw;
+    }
+    predictions_reader.join();
+    if (predictions_error) {
+        std::rethrow_exception(predictions_error);
+    }
+
+    ground_truths->for_each(on_ground_truth);
+    predictions->for_each(on_prediction);
+}
+
+#endif // ANNOTATION_READER_H
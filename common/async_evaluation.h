@@ -0,0 +1,24 @@
+#ifndef ASYNC_EVALUATION_H
+#define ASYNC_EVALUATION_H
+
+#include <pybind11/pybind11.h>
+
+namespace py = pybind11;
+
+// Submits self.<method>() to a concurrent.futures executor and returns its Future; asyncio code can
+// `await asyncio.wrap_future(future)`. The bound methods release the GIL, so the evaluations overlap
+// with each other and with the caller. Without an executor, one ThreadPoolExecutor shared by all the
+// instances of the class is created on first use.
+inline py::object submit_evaluation(py::object self, const char* method, py::object executor) {
+    if (executor.is_none()) {
+        py::object cls = py::type::of(self);
+        if (!py::hasattr(cls, "_async_executor")) {
+            py::object executor_type = py::module_::import("concurrent.futures").attr("ThreadPoolExecutor");
+            cls.attr("_async_executor") = executor_type(py::arg("thread_name_prefix") = "evaluate_async");
+        }
+        executor = cls.attr("_async_executor");
+    }
+    return executor.attr("submit")(self.attr(method));
+}
+
+#endif // ASYNC_EVALUATION_H
@@ -0,0 +1,55 @@
+"""
+Evaluation of many prediction sets against one resident ground truth.
+
+The ground truth is loaded and indexed once by the evaluator; every prediction set is then handed to
+``evaluate`` on a pool of workers. Prediction sets are pulled from the input lazily and at most
+``max_pending`` of them are in flight at any time, so a long checkpoint sweep runs in bounded memory.
+
+    evaluator = OpenmpEvaluator('ground_truths.json')
+    evaluator.num_threads = 1  # parallelism comes from the pool
+    for tp_ids, fp_ids, fn_ids in evaluate_many(evaluator.evaluate_predictions, prediction_files):
+        ...
+"""
+import os
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, Optional, TypeVar
+
+PredictionSet = TypeVar('PredictionSet')
+Result = TypeVar('Result')
+
+
+def evaluate_many(evaluate: Callable[[PredictionSet], Result], prediction_sets: Iterable[PredictionSet],
+                  max_workers: Optional[int] = None, max_pending: Optional[int] = None,
+                  executor: Optional[Executor] = None) -> Iterator[Result]:
+    """
+    Yields ``evaluate(prediction_set)`` for every prediction set, in input order.
+
+    Args:
+        evaluate: scores one prediction set, e.g. the ``evaluate_predictions`` method of an evaluator
+            built from the ground truth only. Native methods release the GIL, so threads run in parallel.
+        prediction_sets: list or iterator of prediction files (or arrays), consumed lazily.
+        max_workers: threads of the pool created when no executor is given, the cpu count by default.
+        max_pending: prediction sets submitted but not yet yielded, twice the workers by default.
+        executor: pool to use instead of a new thread pool, e.g. a ProcessPoolExecutor for backends that
+            hold the GIL (``evaluate`` then has to be picklable).
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    max_pending = max_pending or 2 * max_workers
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='evaluate_many')
+
+    pending = deque()
+    try:
+        for prediction_set in prediction_sets:
+            pending.append(executor.submit(evaluate, prediction_set))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+        if own_executor:
+            executor.shutdown(wait=True)
@@ -0,0 +1,165 @@
+#ifndef BINARY_ANNOTATIONS_H
+#define BINARY_ANNOTATIONS_H
+
+#include <cstdint>
+#include <cstring>
+#include <fstream>
+#include <stdexcept>
+#include <string>
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
+// Layout written by common/binary_annotations.py: a little-endian header
+// (magic, version, header_size, count, source_size, source_mtime_ns, source_path_length, source_path)
+// followed by int32 annotation_ids, image_ids, category_ids and float32 x1, y1, x2, y2, w, h columns.
+static const char BINARY_ANNOTATIONS_MAGIC[8] = {'C', 'O', 'C', 'O', 'B', 'O', 'X', '1'};
+static const uint32_t BINARY_ANNOTATIONS_VERSION = 2;
+static const std::size_t BINARY_ANNOTATIONS_HEADER_SIZE = 44;
+static const std::size_t BINARY_ANNOTATIONS_ROW_SIZE = 36;
+
+inline bool is_binary_annotation_file(const std::string& path) {
+    std::ifstream file(path, std::ios::binary);
+    char magic[8] = {0};
+    file.read(magic, sizeof(magic));
+    return file.gcount() == sizeof(magic) && std::memcmp(magic, BINARY_ANNOTATIONS_MAGIC, sizeof(magic)) == 0;
+}
+
+// Read-only memory map of a whole file. Its pages are read from the page cache on demand, so they are
+// neither copied into the process nor all resident at once.
+class MappedFile {
+public:
+    explicit MappedFile(const std::string& path) {
+        int fd = open(path.c_str(), O_RDONLY);
+        if (fd < 0) {
+            throw std::runtime_error("Failed to open " + path);
+        }
+        struct stat file_stat;
+        if (fstat(fd, &file_stat) != 0) {
+            close(fd);
+            throw std::runtime_error("Failed to open " + path);
+        }
+        size = static_cast<std::size_t>(file_stat.st_size);
+        if (size == 0) {
+            // mmap rejects a zero length: an empty file maps nothing
+            close(fd);
+            return;
+        }
+        data = mmap(nullptr, size, PROT_READ, MAP_PRIVATE, fd, 0);
+        close(fd);
+        if (data == MAP_FAILED) {
+            throw std::runtime_error("Failed to map " + path);
+        }
+    }
+
+    ~MappedFile() {
+        if (data != MAP_FAILED) {
+            munmap(data, size);
+        }
+    }
+
+    MappedFile(const MappedFile&) = delete;
+    MappedFile& operator=(const MappedFile&) = delete;
+
+    // Start of the mapping, nullptr for an empty file
+    const char* bytes() const {
+        return data == MAP_FAILED ? nullptr : static_cast<const char*>(data);
+    }
+
+    std::size_t size = 0;
+
+private:
+    void* data = MAP_FAILED;
+};
+
+// Read-only memory map of a binary annotation file. The column pointers point straight into the mapping,
+// which lives as long as this object. A file written in an older format only exposes its header: its
+// columns are left null and the json it was converted from has to be read instead.
+class MappedAnnotations {
+public:
+    explicit MappedAnnotations(const std::string& path) : file(path) {
+        if (file.size < BINARY_ANNOTATIONS_HEADER_SIZE) {
+            throw std::runtime_error(path + " is not a binary annotation file.");
+        }
+        const char* bytes = file.bytes();
+        uint32_t version, header_size, source_path_length;
+        uint64_t count64;
+        std::memcpy(&version, bytes + 8, sizeof(version));
+        std::memcpy(&header_size, bytes + 12, sizeof(header_size));
+        std::memcpy(&count64, bytes + 16, sizeof(count64));
+        std::memcpy(&source_size, bytes + 24, sizeof(source_size));
+        std::memcpy(&source_mtime_ns, bytes + 32, sizeof(source_mtime_ns));
+        std::memcpy(&source_path_length, bytes + 40, sizeof(source_path_length));
+        count = static_cast<std::size_t>(count64);
+
+        if (std::memcmp(bytes, BINARY_ANNOTATIONS_MAGIC, sizeof(BINARY_ANNOTATIONS_MAGIC)) != 0
+                || BINARY_ANNOTATIONS_HEADER_SIZE + source_path_length > file.size) {
+            throw std::runtime_error(path + " is not a valid binary annotation file.");
+        }
+        source_path.assign(bytes + BINARY_ANNOTATIONS_HEADER_SIZE, source_path_length);
+
+        if (version != BINARY_ANNOTATIONS_VERSION) {
+            // Every version starts with the same header, so the source json can still be found
+            struct stat source_stat;
+            if (source_path.empty() || stat(source_path.c_str(), &source_stat) != 0) {
+                throw std::runtime_error(path + " was written in an older binary format; convert it again with "
+                                         "python -m common.binary_annotations.");
+            }
+            outdated = true;
+            return;
+        }
+        if (header_size + BINARY_ANNOTATIONS_ROW_SIZE * count > file.size) {
+            throw std::runtime_error(path + " is not a valid binary annotation file.");
+        }
+
+        const char* columns = bytes + header_size;
+        annotation_ids = reinterpret_cast<const int32_t*>(columns);
+        image_ids = annotation_ids + count;
+        category_ids = image_ids + count;
+        x1 = reinterpret_cast<const float*>(category_ids + count);
+        y1 = x1 + count;
+        x2 = y1 + count;
+        y2 = x2 + count;
+        w = y2 + count;
+        h = w + count;
+    }
+
+    // True if the json the file was converted from has to be read instead of the columns: the file was
+    // written in an older format, or the json still exists and has been modified since the conversion
+    bool use_source() const {
+        if (outdated) {
+            return true;
+        }
+        struct stat source_stat;
+        if (source_path.empty() || stat(source_path.c_str(), &source_stat) != 0) {
+            return false;
+        }
+#ifdef __APPLE__
+        int64_t mtime_ns = static_cast<int64_t>(source_stat.st_mtimespec.tv_sec) * 1000000000 + source_stat.st_mtimespec.tv_nsec;
+#else
+        int64_t mtime_ns = static_cast<int64_t>(source_stat.st_mtim.tv_sec) * 1000000000 + source_stat.st_mtim.tv_nsec;
+#endif
+        return static_cast<uint64_t>(source_stat.st_size) != source_size || mtime_ns != source_mtime_ns;
+    }
+
+    std::size_t count = 0;
+    const int32_t* annotation_ids = nullptr;
+    const int32_t* image_ids = nullptr;
+    const int32_t* category_ids = nullptr;
+    const float* x1 = nullptr;
+    const float* y1 = nullptr;
+    const float* x2 = nullptr;
+    const float* y2 = nullptr;
+    const float* w = nullptr;
+    const float* h = nullptr;
+    std::string source_path;
+
+private:
+    MappedFile file;
+    bool outdated = false;
+    uint64_t source_size = 0;
+    int64_t source_mtime_ns = 0;
+};
+
+#endif // BINARY_ANNOTATIONS_H
@@ -0,0 +1,216 @@
+"""
+Compact binary columnar format for annotation sets.
+
+A converted file starts with a fixed header followed by nine little-endian columns of ``count``
+items each: the columns of AnnotationColumns, int32 annotation_ids, image_ids, category_ids and
+float32 x1, y1, x2, y2, then float32 w, h. The widths and heights are kept next to the corners so
+readers that truncate boxes to integer pixels, as the C++ backends do, truncate the same w and h as
+from the json: x2 - x1 in float32 is not always w. The header records the size, modification time
+and path of the source JSON, so a stale file is converted again before it is used.
+
+Usage:
+    python -m common.binary_annotations ground_truths.json [predictions.json ...]
+"""
+import mmap
+import os
+import struct
+import sys
+from array import array
+from pathlib import Path
+from typing import BinaryIO, Callable, Optional, Union
+
+from common.annotation_loader import AnnotationColumns, iter_annotations, load_annotation_columns
+
+MAGIC = b'COCOBOX1'
+VERSION = 2
+BINARY_SUFFIX = '.bin'
+
+# magic, version, header_size, count, source_size, source_mtime_ns, source_path_length
+_HEADER = struct.Struct('<8sIIQQqI')
+_COLUMNS = (
+    ('annotation_ids', 'i'), ('image_ids', 'i'), ('category_ids', 'i'),
+    ('x1', 'f'), ('y1', 'f'), ('x2', 'f'), ('y2', 'f'), ('w', 'f'), ('h', 'f'),
+)
+
+
+class _SizedAnnotationColumns(AnnotationColumns):
+    """
+    AnnotationColumns plus the w and h columns of the binary format, which only the conversion needs.
+    """
+    __slots__ = ('w', 'h')
+
+    def __init__(self):
+        super().__init__()
+        self.w = array('f')
+        self.h = array('f')
+
+    def append(self, annotation: dict):
+        super().append(annotation)
+        self.w.append(annotation['bbox'][2])
+        self.h.append(annotation['bbox'][3])
+
+
+class MappedAnnotationColumns:
+    """
+    Read-only view of a binary annotation file with the attributes of AnnotationColumns, plus w and h.
+    Every column is a memoryview straight into the memory-mapped file, nothing is copied.
+    """
+    __slots__ = ('annotation_ids', 'image_ids', 'category_ids', 'x1', 'y1', 'x2', 'y2', 'w', 'h', '_mmap')
+
+    def __init__(self, binary_path: str):
+        with open(binary_path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = _read_header(self._mmap)
+        if header is None:
+            raise ValueError(f'{binary_path} is not a binary annotation file.')
+        if header[1] != VERSION:
+            raise ValueError(f'{binary_path} was written in an older binary format; convert it again with '
+                             f'python -m common.binary_annotations.')
+        header_size, count = header[2], header[3]
+
+        buffer = memoryview(self._mmap)
+        offset = header_size
+        for name, typecode in _COLUMNS:
+            setattr(self, name, buffer[offset:offset + 4 * count].cast(typecode))
+            offset += 4 * count
+
+    def __len__(self):
+        return len(self.annotation_ids)
+
+
+def _read_header(data) -> Optional[tuple]:
+    """
+    Header of any version of the format; they all share its layout.
+    """
+    if len(data) < _HEADER.size or data[:len(MAGIC)] != MAGIC:
+        return None
+    return _HEADER.unpack_from(data)
+
+
+def _source_of(binary_path: str) -> Optional[tuple]:
+    """
+    Returns (source_path, source_size, source_mtime_ns, version) recorded in a binary file, or None.
+    """
+    with open(binary_path, 'rb') as f:
+        head = f.read(_HEADER.size)
+        header = _read_header(head)
+        if header is None:
+            return None
+        source_path = f.read(header[6]).decode('utf-8')
+    return source_path, header[4], header[5], header[1]
+
+
+def _is_stale(binary_path: str, source_path: str) -> bool:
+    if not Path(binary_path).is_file():
+        return True
+    recorded = _source_of(binary_path)
+    if recorded is None or recorded[3] != VERSION:
+        return True
+    stat = os.stat(source_path)
+    return (recorded[1], recorded[2]) != (stat.st_size, stat.st_mtime_ns)
+
+
+def is_binary_annotation_file(path: str) -> bool:
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def default_binary_path(json_path: str) -> str:
+    return str(Path(json_path).with_suffix(BINARY_SUFFIX))
+
+
+def convert_to_binary(json_path: str, binary_path: Optional[str] = None) -> str:
+    """
+    Converts a COCO-style json file into the binary columnar format.
+
+    Args:
+        json_path: path of the source json file.
+        binary_path: output path, defaults to the json path with a `.bin` suffix.
+
+    Returns:
+        str: path of the written binary file.
+    """
+    binary_path = binary_path or default_binary_path(json_path)
+    stat = os.stat(json_path)
+    columns = _SizedAnnotationColumns()
+    for annotation in iter_annotations(json_path):
+        columns.append(annotation)
+
+    def write_column(f, name, typecode):
+        column = getattr(columns, name)
+        if sys.byteorder != 'little':
+            column.byteswap()
+        column.tofile(f)
+
+    return write_binary_columns(binary_path, len(columns), write_column,
+                                str(Path(json_path).resolve()), stat.st_size, stat.st_mtime_ns)
+
+
+def write_binary_columns(binary_path: str, count: int, write_column: Callable[[BinaryIO, str, str], None],
+                         source_path: str = '', source_size: int = 0, source_mtime_ns: int = 0) -> str:
+    """
+    Writes a binary annotation file whose columns are produced by the caller, e.g. in chunks.
+
+    Args:
+        binary_path: output path.
+        count: number of annotations.
+        write_column: called once per column, in file order, with the open file, the column name and its
+            typecode ('i' or 'f'); it has to write exactly count little-endian items.
+        source_path, source_size, source_mtime_ns: json the file was converted from, if any. Files
+            without a source are never considered stale.
+
+    Returns:
+        str: path of the written binary file.
+    """
+    source = source_path.encode('utf-8')
+    header_size = _HEADER.size + len(source)
+    header_size += -header_size % 8
+
+    # Write next to the target and rename, so readers never map a half-written file
+    tmp_path = f'{binary_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, header_size, count, source_size, source_mtime_ns, len(source)))
+        f.write(source)
+        f.write(b'\0' * (header_size - _HEADER.size - len(source)))
+        for name, typecode in _COLUMNS:
+            start = f.tell()
+            write_column(f, name, typecode)
+            if f.tell() - start != 4 * count:
+                raise ValueError(f'Column {name} of {binary_path} does not hold {count} items.')
+    os.replace(tmp_path, binary_path)
+    return binary_path
+
+
+def ensure_binary(json_path: str, binary_path: Optional[str] = None) -> str:
+    """
+    Returns the binary file of a json file, converting it first if it is missing or older than the json.
+    """
+    binary_path = binary_path or default_binary_path(json_path)
+    if _is_stale(binary_path, json_path):
+        convert_to_binary(json_path, binary_path)
+    return binary_path
+
+
+def open_binary_columns(binary_path: str) -> MappedAnnotationColumns:
+    """
+    Memory-maps a binary annotation file. If the json it was converted from still exists and has changed
+    since, or the file was written in an older format, the file is converted again first.
+    """
+    recorded = _source_of(binary_path)
+    if recorded is not None and Path(recorded[0]).is_file():
+        ensure_binary(recorded[0], binary_path)
+    return MappedAnnotationColumns(binary_path)
+
+
+def load_columns(path: str) -> Union[AnnotationColumns, MappedAnnotationColumns]:
+    """
+    Loads the annotation columns of either a binary annotation file (memory-mapped) or a json file (streamed).
+    """
+    if is_binary_annotation_file(path):
+        return open_binary_columns(path)
+    return load_annotation_columns(path)
+
+
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        print(f'{path} -> {ensure_binary(path)}')
@@ -0,0 +1,102 @@
+#ifndef EVALUATION_STATS_H
+#define EVALUATION_STATS_H
+
+#include <chrono>
+#include <cstdint>
+#include <mutex>
+
+// Hot-path counts of a matching pass (see common/evaluation_stats.py for their meaning). The matching
+// loops count into a MatchCounters local to their thread and merge it once per chunk, so counting costs
+// a few adds on a stack object whether or not stats are collected.
+struct MatchCounters {
+    uint64_t queries = 0;
+    uint64_t filtered_pairs = 0;
+    uint64_t candidate_pairs = 0;
+    uint64_t iou_computations = 0;
+    uint64_t early_exits = 0;
+
+    MatchCounters& operator+=(const MatchCounters& other) {
+        queries += other.queries;
+        filtered_pairs += other.filtered_pairs;
+        candidate_pairs += other.candidate_pairs;
+        iou_computations += other.iou_computations;
+        early_exits += other.early_exits;
+        return *this;
+    }
+};
+
+// Counters and phase timings accumulated over the lifetime of an evaluator. Collection is off unless
+// enabled at construction; then nothing is timed and merging the counters is a single branch.
+class EvaluationStats {
+public:
+    bool enabled = false;
+    MatchCounters counters;
+    double parse_seconds = 0;
+    double index_seconds = 0;
+    double match_seconds = 0;
+    double collect_seconds = 0;
+
+    // Safe to call from several threads at once
+    void add(const MatchCounters& counts) {
+        if (enabled) {
+            std::lock_guard<std::mutex> lock(mtx);
+            counters += counts;
+        }
+    }
+
+    void add_seconds(double EvaluationStats::*phase, double seconds) {
+        std::lock_guard<std::mutex> lock(mtx);
+        this->*phase += seconds;
+    }
+
+    // Consistent copy of the values, for readers running alongside evaluations
+    EvaluationStats snapshot() const {
+        std::lock_guard<std::mutex> lock(mtx);
+        EvaluationStats copy;
+        copy.enabled = enabled;
+        copy.counters = counters;
+        copy.parse_seconds = parse_seconds;
+        copy.index_seconds = index_seconds;
+        copy.match_seconds = match_seconds;
+        copy.collect_seconds = collect_seconds;
+        return copy;
+    }
+
+    EvaluationStats() = default;
+    EvaluationStats(const EvaluationStats&) = delete;
+    EvaluationStats& operator=(const EvaluationStats&) = delete;
+    EvaluationStats(EvaluationStats&& other) noexcept
+        : enabled(other.enabled), counters(other.counters), parse_seconds(other.parse_seconds),
+          index_seconds(other.index_seconds), match_seconds(other.match_seconds),
+          collect_seconds(other.collect_seconds) {}
+
+private:
+    mutable std::mutex mtx;
+};
+
+// Adds the lifetime of the scope to one phase of the stats, when they are collected
+class PhaseTimer {
+public:
+    PhaseTimer(EvaluationStats& stats, double EvaluationStats::*phase) : stats(stats), phase(phase) {
+        if (stats.enabled) {
+            start = std::chrono::steady_clock::now();
+        }
+    }
+
+    ~PhaseTimer() {
+        if (stats.enabled) {
+            std::chrono::duration<double> elapsed = std::chrono::steady_clock::now() - start;
+            stats.add_seconds(phase, elapsed.count());
+        }
+    }
+
+    PhaseTimer(const PhaseTimer&) = delete;
+    PhaseTimer& operator=(const PhaseTimer&) = delete;
+
+private:
+    EvaluationStats& stats;
+    double EvaluationStats::*phase;
+    std::chrono::steady_clock::time_point start;
+};
+
+#endif // EVALUATION_STATS_H
@@ -0,0 +1,71 @@
+"""
+Hot-path counters and phase timings of an evaluation.
+
+Every evaluator takes ``collect_stats=True`` and then exposes an EvaluationStats as ``evaluator.stats``
+(None when collection is off), accumulated over the lifetime of the evaluator:
+
+    evaluator = CppEvaluator(gt_json, pred_json, collect_stats=True)
+    evaluator.evaluate()
+    print(evaluator.stats)
+
+Counters:
+    queries: boxes looked up in the other set.
+    filtered_pairs: pairs skipped because their image_id or category_id differ. Only the backends that
+        scan every box do this; the grouped ones never meet such a pair.
+    candidate_pairs: same-group pairs reached by the candidate search (after any spatial pruning).
+    iou_computations: candidate pairs whose IoU was computed.
+    early_exits: queries that stopped at their first match.
+
+Phases, in seconds: parse (reading the annotations), index (grouping, sorting, grids), match (the IoU
+search) and collect (turning the per-box results into id lists).
+"""
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Dict, Iterator
+
+COUNTERS = ('queries', 'filtered_pairs', 'candidate_pairs', 'iou_computations', 'early_exits')
+PHASES = ('parse', 'index', 'match', 'collect')
+
+
+class EvaluationStats:
+    __slots__ = COUNTERS + tuple(f'{phase}_seconds' for phase in PHASES)
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            setattr(self, name, values.pop(name, 0))
+        if values:
+            raise TypeError(f'Unknown stats: {", ".join(values)}')
+
+    def add(self, **counts: int):
+        for name, count in counts.items():
+            setattr(self, name, getattr(self, name) + count)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Adds the time spent in the with block to the total of the phase.
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            attribute = f'{name}_seconds'
+            setattr(self, attribute, getattr(self, attribute) + perf_counter() - start)
+
+    def as_dict(self) -> Dict[str, float]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f'EvaluationStats({", ".join(f"{name}={value!r}" for name, value in self.as_dict().items())})'
+
+
+@contextmanager
+def phase(stats, name: str) -> Iterator[None]:
+    """
+    stats.phase(name) when stats are collected, a no-op when stats is None.
+    """
+    if stats is None:
+        yield
+    else:
+        with stats.phase(name):
+            yield
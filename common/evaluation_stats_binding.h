@@ -0,0 +1,33 @@
+#ifndef EVALUATION_STATS_BINDING_H
+#define EVALUATION_STATS_BINDING_H
+
+#include <pybind11/pybind11.h>
+#include "evaluation_stats.h"
+
+namespace py = pybind11;
+
+// Snapshot of the stats as a common.evaluation_stats.EvaluationStats, or None when they are not
+// collected. Falls back to a dict when the common package is not importable.
+inline py::object stats_to_python(const EvaluationStats& stats) {
+    EvaluationStats values = stats.snapshot();
+    if (!values.enabled) {
+        return py::none();
+    }
+    py::dict fields;
+    fields["queries"] = values.counters.queries;
+    fields["filtered_pairs"] = values.counters.filtered_pairs;
+    fields["candidate_pairs"] = values.counters.candidate_pairs;
+    fields["iou_computations"] = values.counters.iou_computations;
+    fields["early_exits"] = values.counters.early_exits;
+    fields["parse_seconds"] = values.parse_seconds;
+    fields["index_seconds"] = values.index_seconds;
+    fields["match_seconds"] = values.match_seconds;
+    fields["collect_seconds"] = values.collect_seconds;
+    try {
+        return py::module_::import("common.evaluation_stats").attr("EvaluationStats")(**fields);
+    } catch (const py::error_already_set&) {
+        return std::move(fields);
+    }
+}
+
+#endif // EVALUATION_STATS_BINDING_H
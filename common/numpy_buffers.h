@@ -0,0 +1,41 @@
+#ifndef NUMPY_BUFFERS_H
+#define NUMPY_BUFFERS_H
+
+#include <cstdint>
+#include <vector>
+#include <pybind11/numpy.h>
+#include <pybind11/pybind11.h>
+
+namespace py = pybind11;
+
+// Box rows handed over from NumPy: a C-contiguous (N, 7) int32 array of
+// annotation_id, image_id, category_id, x, y, w, h. A matching array is read in place; any other
+// dtype or layout (e.g. float COCO boxes) is converted to a temporary int32 copy once by pybind11.
+using BoxRows = py::array_t<int, py::array::c_style | py::array::forcecast>;
+
+static const py::ssize_t BOX_ROW_SIZE = 7;
+
+inline const int* box_rows_data(const BoxRows& rows, const char* name) {
+    if (rows.ndim() != 2 || rows.shape(1) != BOX_ROW_SIZE) {
+        throw py::value_error(std::string(name) + " must have shape (N, 7): "
+                              "annotation_id, image_id, category_id, x, y, w, h");
+    }
+    return rows.data();
+}
+
+// Hands a vector over to NumPy without copying it; the array owns the vector from then on.
+template <typename T>
+py::array_t<T> to_numpy(std::vector<T>&& values) {
+    auto* owned = new std::vector<T>(std::move(values));
+    py::capsule owner(owned, [](void* p) { delete static_cast<std::vector<T>*>(p); });
+    return py::array_t<T>(static_cast<py::ssize_t>(owned->size()), owned->data(), owner);
+}
+
+// Hands a vector of 0/1 flags over to NumPy as a boolean mask without copying it.
+inline py::array mask_to_numpy(std::vector<uint8_t>&& flags) {
+    auto* owned = new std::vector<uint8_t>(std::move(flags));
+    py::capsule owner(owned, [](void* p) { delete static_cast<std::vector<uint8_t>*>(p); });
+    return py::array(py::dtype::of<bool>(), {static_cast<py::ssize_t>(owned->size())}, {}, owned->data(), owner);
+}
+
+#endif // NUMPY_BUFFERS_H
@@ -0,0 +1,205 @@
+#ifndef SPATIAL_GRID_H
+#define SPATIAL_GRID_H
+
+#include <algorithm>
+#include <cstddef>
+#include <unordered_map>
+#include <vector>
+#include "box_columns.h"
+#include "evaluation_stats.h"
+
+// Key of the (image_id, category_id) group of a box
+inline long long group_key(int image_id, int category_id) {
+    return (static_cast<long long>(image_id) << 32) | static_cast<unsigned int>(category_id);
+}
+
+// Uniform grid over the boxes of one (image_id, category_id) group.
+// Boxes are bucketed by the cell of their top-left corner and cells are sized from the
+// biggest box of the group, so a query only visits the few cells around its own extent.
+// The cells of a grid row are adjacent in cell_boxes, so each row of the query window is one
+// contiguous run handed to the SIMD kernels of box_columns.h.
+// Boxes and queries are any type with int x1, y1, x2, y2 members: the BoundingBox of each core, or a QueryBox.
+class SpatialGrid {
+public:
+    SpatialGrid() : SpatialGrid(std::vector<QueryBox>()) {}
+
+    template <typename Box>
+    explicit SpatialGrid(const std::vector<Box>& boxes);
+
+    // True if any box of the grid reaches iou_threshold with the query box
+    template <typename Box>
+    bool any_match(const Box& query, double iou_threshold, MatchCounters& counters) const {
+        QueryBox query_box(query.x1, query.y1, query.x2, query.y2);
+        return visit_runs(query_box, iou_threshold, counters, [&](std::size_t begin, std::size_t end) {
+            return first_match(query_box, cell_boxes, begin, end, iou_threshold, counters) < end;
+        });
+    }
+
+    // Highest IoU of the query with the boxes of the grid. Only boxes that can reach min_iou are
+    // visited, so a result below min_iou only means that no box reaches it; the search stops at
+    // the first block of boxes reaching enough_iou.
+    template <typename Box>
+    double best_iou(const Box& query, double min_iou, double enough_iou, MatchCounters& counters) const {
+        QueryBox query_box(query.x1, query.y1, query.x2, query.y2);
+        double best = 0.0;
+        visit_runs(query_box, min_iou, counters, [&](std::size_t begin, std::size_t end) {
+            best = ::best_iou(query_box, cell_boxes, begin, end, best, enough_iou, counters);
+            return best >= enough_iou;
+        });
+        return best;
+    }
+
+private:
+    template <typename Visit>
+    bool visit_runs(const QueryBox& query, double iou_threshold, MatchCounters& counters, Visit visit) const;
+
+    int origin_x, origin_y, max_x1, max_y1;
+    int max_w, max_h;
+    int cell_w, cell_h, cols, rows;
+    std::vector<int> cell_offsets; // cell c holds cell_boxes[cell_offsets[c] .. cell_offsets[c + 1])
+    BoxColumns cell_boxes;         // boxes ordered by cell
+};
+
+// Spatial grids for every (image_id, category_id) group of one box set. Boxes and queries also need
+// image_id and category_id members.
+class SpatialIndex {
+public:
+    SpatialIndex() = default;
+
+    template <typename Box>
+    explicit SpatialIndex(const std::vector<Box>& boxes) {
+        std::unordered_map<long long, std::vector<Box>> groups;
+        for (const auto& box : boxes) {
+            groups[group_key(box.image_id, box.category_id)].push_back(box);
+        }
+        grids.reserve(groups.size());
+        for (const auto& group : groups) {
+            grids.emplace(group.first, SpatialGrid(group.second));
+        }
+    }
+
+    template <typename Box>
+    bool any_match(const Box& query, double iou_threshold, MatchCounters& counters) const {
+        counters.queries++;
+        auto it = grids.find(group_key(query.image_id, query.category_id));
+        if (it == grids.end()) {
+            return false;
+        }
+        return it->second.any_match(query, iou_threshold, counters);
+    }
+
+    template <typename Box>
+    double best_iou(const Box& query, double min_iou, double enough_iou, MatchCounters& counters) const {
+        counters.queries++;
+        auto it = grids.find(group_key(query.image_id, query.category_id));
+        if (it == grids.end()) {
+            return 0.0;
+        }
+        return it->second.best_iou(query, min_iou, enough_iou, counters);
+    }
+
+private:
+    std::unordered_map<long long, SpatialGrid> grids;
+};
+
+// SpatialGrid constructor: counting sort of the boxes into their cells
+template <typename Box>
+SpatialGrid::SpatialGrid(const std::vector<Box>& boxes) {
+    origin_x = origin_y = max_x1 = max_y1 = max_w = max_h = 0;
+    if (!boxes.empty()) {
+        origin_x = max_x1 = boxes[0].x1;
+        origin_y = max_y1 = boxes[0].y1;
+    }
+    for (const auto& box : boxes) {
+        origin_x = std::min(origin_x, box.x1);
+        origin_y = std::min(origin_y, box.y1);
+        max_x1 = std::max(max_x1, box.x1);
+        max_y1 = std::max(max_y1, box.y1);
+        max_w = std::max(max_w, box.x2 - box.x1);
+        max_h = std::max(max_h, box.y2 - box.y1);
+    }
+
+    // Grow the cells while the grid would hold far more cells than boxes (sparse, spread-out groups)
+    cell_w = std::max(1, max_w / 2);
+    cell_h = std::max(1, max_h / 2);
+    long long max_cells = 2 * static_cast<long long>(boxes.size()) + 1;
+    while (true) {
+        long long c = (static_cast<long long>(max_x1) - origin_x) / cell_w + 1;
+        long long r = (static_cast<long long>(max_y1) - origin_y) / cell_h + 1;
+        if (c * r <= max_cells) {
+            cols = static_cast<int>(c);
+            rows = static_cast<int>(r);
+            break;
+        }
+        cell_w *= 2;
+        cell_h *= 2;
+    }
+
+    std::vector<int> cell_of(boxes.size());
+    cell_offsets.assign(static_cast<std::size_t>(cols) * rows + 1, 0);
+    for (std::size_t i = 0; i < boxes.size(); ++i) {
+        int cx = (boxes[i].x1 - origin_x) / cell_w;
+        int cy = (boxes[i].y1 - origin_y) / cell_h;
+        cell_of[i] = cy * cols + cx;
+        cell_offsets[cell_of[i] + 1]++;
+    }
+    for (std::size_t c = 1; c < cell_offsets.size(); ++c) {
+        cell_offsets[c] += cell_offsets[c - 1];
+    }
+
+    std::vector<int> cursor(cell_offsets.begin(), cell_offsets.end() - 1);
+    std::vector<int> order(boxes.size());
+    for (std::size_t i = 0; i < boxes.size(); ++i) {
+        order[cursor[cell_of[i]]++] = static_cast<int>(i);
+    }
+    cell_boxes.reserve(boxes.size());
+    for (int i : order) {
+        cell_boxes.push_back(boxes[i].x1, boxes[i].y1, boxes[i].x2, boxes[i].y2);
+    }
+}
+
+// Calls visit(begin, end) on runs of cell_boxes holding every box that may reach iou_threshold with the
+// query, until visit returns true
+template <typename Visit>
+bool SpatialGrid::visit_runs(const QueryBox& query, double iou_threshold, MatchCounters& counters, Visit visit) const {
+    if (iou_threshold <= 0) {
+        // Non-overlapping boxes pass a non-positive threshold too, so nothing can be pruned
+        counters.candidate_pairs += cell_boxes.size();
+        if (visit(std::size_t(0), cell_boxes.size())) {
+            counters.early_exits++;
+            return true;
+        }
+        return false;
+    }
+
+    // A box overlaps the query only if its x1 lies in (query.x1 - max_w, query.x2), same for y1.
+    // Reaching the threshold also needs an intersection of at least iou_threshold * width
+    // (resp. h), which narrows the window on both sides; one pixel is kept as rounding margin.
+    int shrink_x = std::max(0, static_cast<int>(iou_threshold * (query.x2 - query.x1)) - 1);
+    int shrink_y = std::max(0, static_cast<int>(iou_threshold * (query.y2 - query.y1)) - 1);
+    int x_lo = std::max(query.x1 - max_w + 1 + shrink_x, origin_x);
+    int x_hi = std::min(query.x2 - 1 - shrink_x, max_x1);
+    int y_lo = std::max(query.y1 - max_h + 1 + shrink_y, origin_y);
+    int y_hi = std::min(query.y2 - 1 - shrink_y, max_y1);
+    if (x_lo > x_hi || y_lo > y_hi) {
+        return false;
+    }
+
+    // The window cells of one grid row form a single run; its boxes outside the window are tested
+    // too, which costs less in the kernels than filtering them one by one
+    int cx_lo = (x_lo - origin_x) / cell_w;
+    int cx_hi = (x_hi - origin_x) / cell_w;
+    int cy_hi = (y_hi - origin_y) / cell_h;
+    for (int cy = (y_lo - origin_y) / cell_h; cy <= cy_hi; ++cy) {
+        std::size_t begin = cell_offsets[cy * cols + cx_lo];
+        std::size_t end = cell_offsets[cy * cols + cx_hi + 1];
+        counters.candidate_pairs += end - begin;
+        if (visit(begin, end)) {
+            counters.early_exits++;
+            return true;
+        }
+    }
+    return false;
+}
+
+#endif // SPATIAL_GRID_H
@@ -0,0 +1,165 @@
+#ifndef THREAD_POOL_H
+#define THREAD_POOL_H
+
+#include <algorithm>
+#include <condition_variable>
+#include <cstddef>
+#include <exception>
+#include <functional>
+#include <memory>
+#include <mutex>
+#include <thread>
+#include <vector>
+
+// Fixed set of worker threads that stay alive between calls. parallel_for splits [0, n) into chunks
+// and deals them out in contiguous runs, one run per thread; a thread that runs out of chunks steals
+// from the back of the run of another thread, so skewed chunks do not leave the others idle.
+// The calling thread takes part in the work as participant 0.
+class WorkStealingPool {
+public:
+    explicit WorkStealingPool(int num_threads)
+        : num_threads(std::max(1, num_threads)), queues(this->num_threads) {
+        for (int i = 1; i < this->num_threads; ++i) {
+            workers.emplace_back(&WorkStealingPool::worker_loop, this, i);
+        }
+    }
+
+    ~WorkStealingPool() {
+        {
+            std::lock_guard<std::mutex> lock(mtx);
+            stopping = true;
+        }
+        wake.notify_all();
+        for (auto& worker : workers) worker.join();
+    }
+
+    WorkStealingPool(const WorkStealingPool&) = delete;
+    WorkStealingPool& operator=(const WorkStealingPool&) = delete;
+
+    int size() const { return num_threads; }
+
+    // Calls body(begin, end) over chunks of at most chunk_size indices covering [0, n), and returns
+    // once all of them are done. The first exception thrown by body is rethrown here.
+    void parallel_for(std::size_t n, std::size_t chunk_size, const std::function<void(std::size_t, std::size_t)>& body) {
+        if (n == 0) {
+            return;
+        }
+        chunk_size = std::max<std::size_t>(1, chunk_size);
+        std::size_t num_chunks = (n + chunk_size - 1) / chunk_size;
+        if (num_threads == 1 || num_chunks == 1) {
+            body(0, n);
+            return;
+        }
+
+        std::lock_guard<std::mutex> call_lock(call_mtx);  // One parallel_for at a time per pool
+        for (int i = 0; i < num_threads; ++i) {
+            std::lock_guard<std::mutex> lock(queues[i].mtx);
+            queues[i].next = num_chunks * i / num_threads;
+            queues[i].end = num_chunks * (i + 1) / num_threads;
+        }
+        {
+            std::lock_guard<std::mutex> lock(mtx);
+            job = &body;
+            job_size = n;
+            job_chunk_size = chunk_size;
+            job_error = nullptr;
+            busy_workers = num_threads - 1;
+            ++generation;
+        }
+        wake.notify_all();
+
+        run_chunks(0);
+
+        std::unique_lock<std::mutex> lock(mtx);
+        done.wait(lock, [this] { return busy_workers == 0; });
+        job = nullptr;
+        if (job_error) {
+            std::rethrow_exception(job_error);
+        }
+    }
+
+private:
+    struct ChunkQueue {
+        std::mutex mtx;
+        std::size_t next = 0;  // The owner takes chunks from the front
+        std::size_t end = 0;   // Thieves take chunks from the back
+    };
+
+    bool pop_own(int self, std::size_t& chunk) {
+        ChunkQueue& queue = queues[self];
+        std::lock_guard<std::mutex> lock(queue.mtx);
+        if (queue.next == queue.end) {
+            return false;
+        }
+        chunk = queue.next++;
+        return true;
+    }
+
+    bool steal(int self, std::size_t& chunk) {
+        for (int k = 1; k < num_threads; ++k) {
+            ChunkQueue& victim = queues[(self + k) % num_threads];
+            std::lock_guard<std::mutex> lock(victim.mtx);
+            if (victim.next < victim.end) {
+                chunk = --victim.end;
+                return true;
+            }
+        }
+        return false;
+    }
+
+    void run_chunks(int self) {
+        std::size_t chunk;
+        while (pop_own(self, chunk) || steal(self, chunk)) {
+            std::size_t begin = chunk * job_chunk_size;
+            std::size_t end = std::min(job_size, begin + job_chunk_size);
+            try {
+                (*job)(begin, end);
+            } catch (...) {
+                std::lock_guard<std::mutex> lock(mtx);
+                if (!job_error) {
+                    job_error = std::current_exception();
+                }
+            }
+        }
+    }
+
+    void worker_loop(int self) {
+        std::size_t seen_generation = 0;
+        while (true) {
+            {
+                std::unique_lock<std::mutex> lock(mtx);
+                wake.wait(lock, [&] { return stopping || generation != seen_generation; });
+                if (stopping) {
+                    return;
+                }
+                seen_generation = generation;
+            }
+
+            run_chunks(self);
+
+            std::lock_guard<std::mutex> lock(mtx);
+            if (--busy_workers == 0) {
+                done.notify_one();
+            }
+        }
+    }
+
+    int num_threads;
+    std::vector<ChunkQueue> queues;
+    std::vector<std::thread> workers;
+
+    std::mutex call_mtx;
+    std::mutex mtx;
+    std::condition_variable wake;
+    std::condition_variable done;
+    bool stopping = false;
+    std::size_t generation = 0;
+    int busy_workers = 0;
+
+    const std::function<void(std::size_t, std::size_t)>* job = nullptr;
+    std::size_t job_size = 0;
+    std::size_t job_chunk_size = 1;
+    std::exception_ptr job_error;
+};
+
+#endif // THREAD_POOL_H
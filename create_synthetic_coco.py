@@ -0,0 +1,248 @@
+"""
+Seeded generator of large synthetic COCO-style ground truth / prediction pairs.
+
+Every object of an image is a true positive (a ground truth plus a jittered prediction sharing its
+annotation id), a false positive (a prediction only) or a false negative (a ground truth only). Images
+are cut into chunks that worker processes generate in parallel and write to part files; the parts are
+then streamed into the output files, so memory stays bounded by the chunk size whatever the dataset size.
+The same seed and parameters always produce the same files, whatever the number of workers.
+
+Usage:
+    python create_synthetic_coco.py out_dir --images 100000 --categories 80 --boxes-per-image 100 \\
+        --distribution lognormal --crowd-fraction 0.1 --format binary --workers 8
+"""
+import argparse
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from common.binary_annotations import BINARY_SUFFIX, write_binary_columns
+
+TRUE_POSITIVE, FALSE_POSITIVE, FALSE_NEGATIVE = 0, 1, 2
+_COLUMN_NAMES = ('annotation_ids', 'image_ids', 'category_ids', 'x1', 'y1', 'x2', 'y2', 'w', 'h')
+_JSON_ITEM = '{"annotation_id":%d,"image_id":%d,"category_id":%d,"bbox":[%d,%d,%d,%d]}'
+
+
+class DatasetSpec(NamedTuple):
+    """
+    Attributes:
+        num_images (int): number of images, with ids 1..num_images.
+        num_categories (int): category ids are drawn uniformly from 1..num_categories.
+        boxes_per_image (float): mean number of objects per image.
+        distribution (str): objects per image, 'fixed', 'poisson' or 'lognormal' (skewed: a few images
+            hold most of the boxes).
+        skew (float): sigma of the lognormal distribution.
+        tp_ratio, fp_ratio, fn_ratio (float): share of true positives, false positives and false negatives
+            among the objects.
+        crowd_fraction (float): share of crowded images, whose boxes pile up around a few points.
+        crowd_spread (float): standard deviation, in pixels, of the box centres around those points.
+        image_size (int): images are image_size x image_size pixels.
+        min_box_size, max_box_size (int): range of the box widths and heights.
+        jitter (int): maximum shift, in pixels, of a true positive prediction from its ground truth.
+        seed (int): seed of every random draw.
+    """
+    num_images: int = 1000
+    num_categories: int = 80
+    boxes_per_image: float = 100
+    distribution: str = 'poisson'
+    skew: float = 1.0
+    tp_ratio: float = 0.65
+    fp_ratio: float = 0.13
+    fn_ratio: float = 0.22
+    crowd_fraction: float = 0.0
+    crowd_spread: float = 40.0
+    image_size: int = 1000
+    min_box_size: int = 20
+    max_box_size: int = 70
+    jitter: int = 5
+    seed: int = 0
+
+
+def objects_per_image(spec: DatasetSpec, rng: np.random.Generator) -> np.ndarray:
+    if spec.distribution == 'fixed':
+        return np.full(spec.num_images, int(round(spec.boxes_per_image)), dtype=np.int64)
+    if spec.distribution == 'poisson':
+        return rng.poisson(spec.boxes_per_image, spec.num_images).astype(np.int64)
+    if spec.distribution == 'lognormal':
+        mu = np.log(max(spec.boxes_per_image, 1e-9)) - spec.skew ** 2 / 2  # keeps the mean at boxes_per_image
+        return np.round(rng.lognormal(mu, spec.skew, spec.num_images)).astype(np.int64)
+    raise ValueError(f"Unknown distribution '{spec.distribution}', expected fixed, poisson or lognormal.")
+
+
+def _generate_chunk(spec: DatasetSpec, seed: np.random.SeedSequence, first_image_id: int, counts: np.ndarray,
+                    first_annotation_id: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Generates the objects of images first_image_id.. with the given object counts.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: ground truth and prediction rows as (7, N) int64 columns of
+            annotation_id, image_id, category_id, x, y, w, h.
+    """
+    rng = np.random.default_rng(seed)
+    num_objects = int(counts.sum())
+    image_index = np.repeat(np.arange(len(counts)), counts)
+    annotation_ids = first_annotation_id + np.arange(num_objects)
+    category_ids = rng.integers(1, spec.num_categories + 1, num_objects)
+    ratios = np.array([spec.tp_ratio, spec.fp_ratio, spec.fn_ratio], dtype=np.float64)
+    kinds = rng.choice(3, num_objects, p=ratios / ratios.sum())
+
+    w = rng.integers(spec.min_box_size, spec.max_box_size + 1, num_objects)
+    h = rng.integers(spec.min_box_size, spec.max_box_size + 1, num_objects)
+    cx = rng.uniform(0, spec.image_size, num_objects)
+    cy = rng.uniform(0, spec.image_size, num_objects)
+
+    # Crowded images: every box sits around one of a few anchor points of its image
+    crowded = (rng.random(len(counts)) < spec.crowd_fraction)[image_index]
+    anchors = rng.uniform(0, spec.image_size, (len(counts), 4, 2))
+    anchor = anchors[image_index, rng.integers(0, 4, num_objects)]
+    cx = np.where(crowded, anchor[:, 0] + rng.normal(0, spec.crowd_spread, num_objects), cx)
+    cy = np.where(crowded, anchor[:, 1] + rng.normal(0, spec.crowd_spread, num_objects), cy)
+
+    x = np.clip(np.round(cx - w / 2), 0, np.maximum(spec.image_size - w, 0)).astype(np.int64)
+    y = np.clip(np.round(cy - h / 2), 0, np.maximum(spec.image_size - h, 0)).astype(np.int64)
+    shift_x = rng.integers(-spec.jitter, spec.jitter + 1, num_objects)
+    shift_y = rng.integers(-spec.jitter, spec.jitter + 1, num_objects)
+
+    rows = np.stack([annotation_ids, first_image_id + image_index, category_ids, x, y, w, h])
+    predicted = rows.copy()
+    predicted[3] += np.where(kinds == TRUE_POSITIVE, shift_x, 0)
+    predicted[4] += np.where(kinds == TRUE_POSITIVE, shift_y, 0)
+    return rows[:, kinds != FALSE_POSITIVE], predicted[:, kinds != FALSE_NEGATIVE]
+
+
+def _write_chunk(spec: DatasetSpec, seed: np.random.SeedSequence, first_image_id: int, counts: np.ndarray,
+                 first_annotation_id: int, part_prefix: str, output_format: str) -> Tuple[int, int]:
+    """
+    Generates one chunk into <part_prefix>.gt and <part_prefix>.pred, returns their annotation counts.
+    """
+    ground_truths, predictions = _generate_chunk(spec, seed, first_image_id, counts, first_annotation_id)
+    for rows, suffix in ((ground_truths, '.gt'), (predictions, '.pred')):
+        with open(part_prefix + suffix, 'wb') as part:
+            if output_format == 'json':
+                part.write(','.join(_JSON_ITEM % item for item in zip(*rows.tolist())).encode('ascii'))
+            else:
+                # Columns back to back, in the order and types of the binary format
+                part.write(rows[:3].astype('<i4').tobytes())
+                boxes = rows[3:].astype('<f4')
+                part.write(np.concatenate([boxes[:2], boxes[:2] + boxes[2:], boxes[2:]]).tobytes())
+    return ground_truths.shape[1], predictions.shape[1]
+
+
+def _assemble_json(path: str, parts: List[str], counts: List[int]):
+    with open(path, 'wb') as output:
+        output.write(b'{"annotations":[')
+        first = True
+        for part_path, count in zip(parts, counts):
+            if count == 0:
+                continue
+            if not first:
+                output.write(b',')
+            with open(part_path, 'rb') as part:
+                shutil.copyfileobj(part, output)
+            first = False
+        output.write(b']}')
+
+
+def _assemble_binary(path: str, parts: List[str], counts: List[int]):
+    def write_column(output, name, typecode):
+        column = _COLUMN_NAMES.index(name)
+        for part_path, count in zip(parts, counts):
+            with open(part_path, 'rb') as part:
+                part.seek(4 * count * column)
+                output.write(part.read(4 * count))
+
+    write_binary_columns(path, sum(counts), write_column)
+
+
+def generate_dataset(output_dir: str, spec: DatasetSpec = DatasetSpec(), output_format: str = 'json',
+                     workers: Optional[int] = None, chunk_objects: int = 500_000) -> Tuple[str, str]:
+    """
+    Writes ground_truths and predictions files of a synthetic dataset into output_dir.
+
+    Args:
+        output_dir: directory of the two files, created if needed.
+        spec: what to generate.
+        output_format: 'json' for compact json files, 'binary' for binary annotation files (see
+            common.binary_annotations) that every backend reads straight from a memory map.
+        workers: generating processes, the cpu count by default.
+        chunk_objects: approximate number of objects a worker generates at a time.
+
+    Returns:
+        Tuple[str, str]: paths of the ground truth and prediction files.
+    """
+    if output_format not in ('json', 'binary'):
+        raise ValueError(f"Unknown format '{output_format}', expected json or binary.")
+    output = Path(output_dir)
+    output.mkdir(parents=True, exist_ok=True)
+    suffix = '.json' if output_format == 'json' else BINARY_SUFFIX
+    gt_path, pred_path = str(output / f'ground_truths{suffix}'), str(output / f'predictions{suffix}')
+
+    seed = np.random.SeedSequence(spec.seed)
+    counts_seed, objects_seed = seed.spawn(2)
+    counts = objects_per_image(spec, np.random.default_rng(counts_seed))
+    first_ids = np.concatenate(([1], 1 + np.cumsum(counts)))
+    if first_ids[-1] - 1 > np.iinfo(np.int32).max:
+        raise ValueError('More objects than int32 annotation ids can number.')
+
+    # Chunks of whole images holding about chunk_objects objects each; their seeds only depend on the images
+    # they hold, so the output does not depend on the number of workers
+    boundaries = np.searchsorted(first_ids, np.arange(1, first_ids[-1], max(1, chunk_objects)), side='right') - 1
+    boundaries = np.unique(np.concatenate((boundaries, [spec.num_images])))
+    chunk_seeds = objects_seed.spawn(len(boundaries) - 1)
+
+    with tempfile.TemporaryDirectory(dir=output) as part_dir, \
+            ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+        futures = [
+            executor.submit(_write_chunk, spec, chunk_seeds[i], int(start) + 1, counts[start:end],
+                            int(first_ids[start]), os.path.join(part_dir, f'{i:06d}'), output_format)
+            for i, (start, end) in enumerate(zip(boundaries[:-1], boundaries[1:]))
+        ]
+        part_counts = [future.result() for future in futures]
+
+        assemble = _assemble_json if output_format == 'json' else _assemble_binary
+        prefixes = [os.path.join(part_dir, f'{i:06d}') for i in range(len(futures))]
+        assemble(gt_path, [prefix + '.gt' for prefix in prefixes], [count[0] for count in part_counts])
+        assemble(pred_path, [prefix + '.pred' for prefix in prefixes], [count[1] for count in part_counts])
+    return gt_path, pred_path
+
+
+def main(argv: Optional[List[str]] = None):
+    defaults = DatasetSpec()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('output_dir')
+    parser.add_argument('--images', type=int, default=defaults.num_images)
+    parser.add_argument('--categories', type=int, default=defaults.num_categories)
+    parser.add_argument('--boxes-per-image', type=float, default=defaults.boxes_per_image)
+    parser.add_argument('--distribution', choices=('fixed', 'poisson', 'lognormal'), default=defaults.distribution)
+    parser.add_argument('--skew', type=float, default=defaults.skew, help='sigma of the lognormal distribution')
+    parser.add_argument('--ratios', type=float, nargs=3, metavar=('TP', 'FP', 'FN'),
+                        default=(defaults.tp_ratio, defaults.fp_ratio, defaults.fn_ratio))
+    parser.add_argument('--crowd-fraction', type=float, default=defaults.crowd_fraction)
+    parser.add_argument('--crowd-spread', type=float, default=defaults.crowd_spread)
+    parser.add_argument('--image-size', type=int, default=defaults.image_size)
+    parser.add_argument('--box-size', type=int, nargs=2, metavar=('MIN', 'MAX'),
+                        default=(defaults.min_box_size, defaults.max_box_size))
+    parser.add_argument('--jitter', type=int, default=defaults.jitter)
+    parser.add_argument('--seed', type=int, default=defaults.seed)
+    parser.add_argument('--format', choices=('json', 'binary'), default='json')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--chunk-objects', type=int, default=500_000)
+    args = parser.parse_args(argv)
+
+    spec = DatasetSpec(
+        num_images=args.images, num_categories=args.categories, boxes_per_image=args.boxes_per_image,
+        distribution=args.distribution, skew=args.skew, tp_ratio=args.ratios[0], fp_ratio=args.ratios[1],
+        fn_ratio=args.ratios[2], crowd_fraction=args.crowd_fraction, crowd_spread=args.crowd_spread,
+        image_size=args.image_size, min_box_size=args.box_size[0], max_box_size=args.box_size[1],
+        jitter=args.jitter, seed=args.seed)
+    for path in generate_dataset(args.output_dir, spec, args.format, args.workers, args.chunk_objects):
+        print(path)
+
+
+if __name__ == '__main__':
+    main()
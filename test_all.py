@@ -1,13 +1,6 @@
 import time
-from v1_python.py_evaluator import Evaluator
-from v2_jit.jit_evaluator import measure_jit_evaluator_time
-from v3_tai_chi.taichi_evaluator import measure_taichi_evaluator_time
-from v4_cython.evaluator import Evaluator as CyEvaluator
-from v5_parallel_cython.evaluator import Evaluator as CyParallelEvaluator
-from v6_cpp.cpp_evaluator import CppEvaluator
-from v7_cpp_parallel.parallel_cpp_evaluator import ParallelCppEvaluator
-from v8_cpp_parallel_shared_mutex.shared_mutex_parallel_evaluator import SharedMutexParallelCppEvaluator
-from v9_cpp_openmp.openmp_evaluator import OpenmpEvaluator
+
+from backend_registry import load_backend
 
 """
 LARGE JSONs:
@@ -49,19 +42,21 @@ def check_evaluator_time(module, gt_json_path, pred_json_path):
 if __name__ == "__main__":
     gt_json_path = 'small_jsons/ground_truths.json'
     pred_json_path = 'small_jsons/predictions.json'
-    t1, tp_ids, fp_ids, fn_ids = check_evaluator_time(Evaluator, gt_json_path, pred_json_path)
-    t2, tp2, fp2, fn2 = measure_jit_evaluator_time(gt_json_path, pred_json_path)
-    t3, tp3, fp3, fn3 = measure_taichi_evaluator_time(gt_json_path, pred_json_path)
-    t4, tp4, fp4, fn4 = check_evaluator_time(CyEvaluator, gt_json_path, pred_json_path)
-    t5, tp5, fp5, fn5 = check_evaluator_time(CyParallelEvaluator, gt_json_path, pred_json_path)
-    t6, tp6, fp6, fn6 = check_evaluator_time(CppEvaluator, gt_json_path, pred_json_path)
-    t7, tp7, fp7, fn7 = check_evaluator_time(ParallelCppEvaluator, gt_json_path, pred_json_path)
-    t8, tp8, fp8, fn8 = check_evaluator_time(SharedMutexParallelCppEvaluator, gt_json_path, pred_json_path)
-    t9, tp9, fp9, fn9 = check_evaluator_time(OpenmpEvaluator, gt_json_path, pred_json_path)
+    t1, tp_ids, fp_ids, fn_ids = check_evaluator_time(load_backend('Simple Python'), gt_json_path, pred_json_path)
+    t2, tp2, fp2, fn2 = load_backend('JIT')(gt_json_path, pred_json_path)
+    t3, tp3, fp3, fn3 = load_backend('TaiChi')(gt_json_path, pred_json_path)
+    t4, tp4, fp4, fn4 = check_evaluator_time(load_backend('Basic Cython'), gt_json_path, pred_json_path)
+    t5, tp5, fp5, fn5 = check_evaluator_time(load_backend('Parallel Cython'), gt_json_path, pred_json_path)
+    t6, tp6, fp6, fn6 = check_evaluator_time(load_backend('Simple C++'), gt_json_path, pred_json_path)
+    t7, tp7, fp7, fn7 = check_evaluator_time(load_backend('Parallel C++'), gt_json_path, pred_json_path)
+    t8, tp8, fp8, fn8 = check_evaluator_time(load_backend('Parallel C++ + shared mutex'), gt_json_path, pred_json_path)
+    t9, tp9, fp9, fn9 = check_evaluator_time(load_backend('C++ + OpenMP'), gt_json_path, pred_json_path)
+    t10, tp10, fp10, fn10 = check_evaluator_time(load_backend('NumPy'), gt_json_path, pred_json_path)
+    t11, tp11, fp11, fn11 = check_evaluator_time(load_backend('C++ engine'), gt_json_path, pred_json_path)
 
-    assert tp_ids == tp2 == tp3 == tp4 == tp5 == tp6 == tp7 == tp8 == tp9
-    assert fp_ids == fp2 == fp3 == fp4 == fp5 == fp6 == fp7 == fp8 == fp9
-    assert fn_ids == fn2 == fn3 == fn4 == fn5 == fn6 == fn7 == fn8 == fn9
+    assert tp_ids == tp2 == tp3 == tp4 == tp5 == tp6 == tp7 == tp8 == tp9 == tp10 == tp11
+    assert fp_ids == fp2 == fp3 == fp4 == fp5 == fp6 == fp7 == fp8 == fp9 == fp10 == fp11
+    assert fn_ids == fn2 == fn3 == fn4 == fn5 == fn6 == fn7 == fn8 == fn9 == fn10 == fn11
 
     p = [
         ('Simple Python', t1),
@@ -72,7 +67,9 @@ if __name__ == "__main__":
         ('Simple C++', t6),
         ('Parallel C++', t7),
         ('Parallel C++ + shared mutex', t8),
-        ('C++ + OpenMP ', t9)
+        ('C++ + OpenMP ', t9),
+        ('NumPy', t10),
+        ('C++ engine', t11)
     ]
 
     p = sorted(p, key=lambda x: x[1])
@@ -0,0 +1,57 @@
+"""
+Shared fixtures: a small seeded synthetic dataset, the results of the pure-Python evaluator on it as the
+reference every backend is compared with, and a loader that skips the backends not built here.
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from backend_registry import BackendUnavailable, load_backend  # noqa: E402
+from create_synthetic_coco import DatasetSpec, generate_dataset  # noqa: E402
+
+DATASET_SPEC = DatasetSpec(num_images=40, num_categories=3, boxes_per_image=25, crowd_fraction=0.2, seed=7)
+# Big enough for evaluations to overlap with each other and with edits, even on a single core
+CONCURRENCY_SPEC = DatasetSpec(num_images=400, num_categories=3, boxes_per_image=50, seed=7)
+
+
+def sorted_ids(result):
+    return tuple(sorted(int(i) for i in ids) for ids in result)
+
+
+@pytest.fixture(scope='session')
+def dataset(tmp_path_factory):
+    """
+    (ground truth json, predictions json) of the synthetic dataset.
+    """
+    return generate_dataset(str(tmp_path_factory.mktemp('dataset')), DATASET_SPEC, workers=1)
+
+
+@pytest.fixture(scope='session')
+def concurrency_dataset(tmp_path_factory):
+    return generate_dataset(str(tmp_path_factory.mktemp('concurrency')), CONCURRENCY_SPEC, workers=1)
+
+
+@pytest.fixture(scope='session')
+def concurrency_reference(concurrency_dataset):
+    return sorted_ids(load_backend('Simple Python')(*concurrency_dataset).evaluate())
+
+
+@pytest.fixture(scope='session')
+def reference(dataset):
+    """
+    Sorted tp, fp and fn ids of the dataset, from the pure-Python evaluator.
+    """
+    return sorted_ids(load_backend('Simple Python')(*dataset).evaluate())
+
+
+@pytest.fixture
+def require_backend():
+    def require(name):
+        try:
+            return load_backend(name)
+        except BackendUnavailable as error:
+            pytest.skip(str(error))
+    return require
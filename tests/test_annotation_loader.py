@@ -0,0 +1,36 @@
+"""
+The streaming loader reads the same annotations as json.load, wherever the chunks cut the file.
+"""
+import json
+
+import pytest
+
+from common.annotation_loader import iter_annotations
+
+DOCUMENT = {
+    'version': 12.5,
+    'scale': -3.25e-2,
+    'info': {'description': 'numbers and "escaped" strings \\ cut anywhere', 'ratios': [0.5, 1e3, -2E-1]},
+    'annotations': [
+        {'annotation_id': 1, 'image_id': 2, 'category_id': 3, 'bbox': [1.5, 2e1, 3.25E+1, 4], 'score': 0.875},
+        {'annotation_id': 2, 'image_id': 2, 'category_id': 1, 'bbox': [10, 20.25, 5e-1, 7.0], 'score': 1},
+        {'annotation_id': 3, 'image_id': 5, 'category_id': 1, 'bbox': [-0.5, 0, 12345.678, 1E2]},
+    ],
+    'licenses': [],
+}
+
+
+@pytest.fixture(scope='module')
+def json_paths(tmp_path_factory):
+    path = tmp_path_factory.mktemp('loader') / 'annotations.json'
+    # Compact and indented layouts cut the numbers at different places
+    path.write_text(json.dumps(DOCUMENT, separators=(',', ':')))
+    indented = path.with_name('indented.json')
+    indented.write_text(json.dumps(DOCUMENT, indent=2))
+    return path, indented
+
+
+@pytest.mark.parametrize('chunk_size', range(1, 81))
+def test_every_chunk_size(chunk_size, json_paths):
+    for path in json_paths:
+        assert list(iter_annotations(str(path), chunk_size)) == DOCUMENT['annotations']
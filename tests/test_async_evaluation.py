@@ -0,0 +1,67 @@
+"""
+evaluate_async hands back futures of evaluate(), which runs with the GIL released.
+"""
+import asyncio
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pytest
+
+from conftest import sorted_ids
+
+ASYNC_BACKENDS = ['Simple C++', 'Parallel C++', 'Parallel C++ + shared mutex', 'C++ + OpenMP', 'C++ engine']
+
+
+@pytest.mark.parametrize('name', ASYNC_BACKENDS)
+def test_futures_and_asyncio(name, dataset, reference, require_backend):
+    evaluator = require_backend(name)(*dataset)
+
+    future = evaluator.evaluate_async()
+    assert isinstance(future, Future)
+    assert sorted_ids(future.result()) == reference
+
+    with ThreadPoolExecutor(2) as executor:
+        assert sorted_ids(evaluator.evaluate_async(executor).result()) == reference
+
+    async def evaluate_twice():
+        return await asyncio.gather(asyncio.wrap_future(evaluator.evaluate_async()),
+                                    asyncio.wrap_future(evaluator.evaluate_async()))
+    assert [sorted_ids(result) for result in asyncio.run(evaluate_twice())] == [reference, reference]
+
+
+def python_ran_during(evaluate, rounds=20):
+    """
+    Whether a Python thread got to run while evaluate() was inside native code. The switch interval is
+    raised for the duration, so the interpreter never takes the GIL away from the evaluating thread on its
+    own: the other thread can only run while evaluate() has released it.
+    """
+    ticks, intervals = [], []
+    stop = threading.Event()
+
+    def tick():
+        while not stop.is_set():
+            ticks.append(time.perf_counter())
+            time.sleep(0.0002)
+
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(10)
+    ticker = threading.Thread(target=tick)
+    ticker.start()
+    try:
+        for _ in range(rounds):
+            start = time.perf_counter()
+            evaluate()
+            intervals.append((start, time.perf_counter()))
+    finally:
+        stop.set()
+        ticker.join()
+        sys.setswitchinterval(switch_interval)
+    return any(start < t < end for start, end in intervals for t in ticks)
+
+
+@pytest.mark.parametrize('name', ASYNC_BACKENDS)
+def test_evaluate_releases_the_gil(name, concurrency_dataset, require_backend):
+    evaluator = require_backend(name)(*concurrency_dataset)
+    assert python_ran_during(evaluator.evaluate)
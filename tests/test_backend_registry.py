@@ -0,0 +1,35 @@
+"""
+The registry imports a backend only when it is asked for, and says what a backend that cannot import needs.
+"""
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+import backend_registry
+from conftest import BackendUnavailable, load_backend
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def test_unknown_backend():
+    with pytest.raises(KeyError, match='Unknown backend'):
+        load_backend('Fortran')
+
+
+def test_backend_that_does_not_import(monkeypatch):
+    monkeypatch.setitem(backend_registry.REGISTRY, 'Missing',
+                        backend_registry.BackendSpec('v0_missing.evaluator', 'Evaluator', 'a time machine'))
+    with pytest.raises(BackendUnavailable, match='a time machine') as error:
+        load_backend('Missing')
+    assert isinstance(error.value, ImportError)
+    assert isinstance(error.value.__cause__, ImportError)
+
+
+def test_backends_are_imported_on_first_use():
+    script = ('import sys, backend_registry; '
+              'assert not {"numba", "taichi", "numpy"} & set(sys.modules), "imported with the registry"; '
+              'backend_registry.load_backend("Simple Python"); '
+              'assert not {"numba", "taichi", "numpy"} & set(sys.modules), "imported with Simple Python"')
+    subprocess.run([sys.executable, '-c', script], cwd=ROOT, check=True)
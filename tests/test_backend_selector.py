@@ -0,0 +1,51 @@
+"""
+BackendSelector picks the backend its cached timings predict fastest for an input, and evaluates with it.
+"""
+import json
+
+import pytest
+
+from auto_evaluate import CACHE_VERSION, BackendSelector, InputProfile, host_key
+from conftest import sorted_ids
+
+# Seconds at 1000, 10000 and 50000 boxes: Python wins on small inputs, C++ once its fixed cost is paid off
+TIMINGS = {'Simple Python': (0.001, 0.01, 0.05), 'Simple C++': (0.01001, 0.0101, 0.0105)}
+
+
+@pytest.fixture
+def cache_path(tmp_path, monkeypatch):
+    """
+    A calibration cache of this host with TIMINGS at two densities, which a selector must use as is.
+    """
+    def calibrate(*args, **kwargs):
+        raise AssertionError('the cached timings should have been used')
+    monkeypatch.setattr(BackendSelector, 'calibrate', calibrate)
+
+    backends = {backend: [{'boxes': boxes, 'boxes_per_image': boxes_per_image, 'level': level,
+                           'seconds': s, 'extrapolated': False}
+                          for level, boxes_per_image in enumerate((20, 2000))
+                          for boxes, s in zip((1000, 10000, 50000), seconds)]
+                for backend, seconds in TIMINGS.items()}
+    hosts = {host_key(): {'backends': backends, 'unavailable': {'JIT': 'numba is not installed'}}}
+    path = tmp_path / 'calibration.json'
+    path.write_text(json.dumps({'version': CACHE_VERSION, 'hosts': hosts}))
+    return str(path)
+
+
+def test_predictions_follow_the_cached_timings(cache_path):
+    selector = BackendSelector(cache_path, ['Simple Python', 'Simple C++', 'JIT'])
+    for density in (20, 2000):
+        for boxes, python_seconds, cpp_seconds in zip((1000, 10000, 50000), *TIMINGS.values()):
+            predictions = selector.predict(InputProfile(boxes, density))
+            assert predictions == pytest.approx({'Simple Python': python_seconds, 'Simple C++': cpp_seconds})
+
+
+def test_choice_depends_on_the_input_size(cache_path, dataset, concurrency_dataset, reference, require_backend):
+    require_backend('Simple C++')
+    selector = BackendSelector(cache_path, ['Simple Python', 'Simple C++', 'JIT'])
+    assert selector.choose(*dataset) == 'Simple Python'
+    assert selector.choose(*concurrency_dataset) == 'Simple C++'
+    assert sorted_ids(selector.evaluate(*dataset)) == reference
+
+    # Backends left out of the selector are never chosen
+    assert BackendSelector(cache_path, ['Simple Python']).choose(*concurrency_dataset) == 'Simple Python'
@@ -0,0 +1,70 @@
+"""
+evaluate_many scores prediction sets against one resident ground truth, in order and lazily.
+"""
+import json
+
+import numpy as np
+import pytest
+
+from common.batch_evaluation import evaluate_many
+from conftest import load_backend, sorted_ids
+
+NUM_SETS = 6
+
+
+@pytest.fixture(scope='module')
+def prediction_sets(dataset, tmp_path_factory):
+    """
+    Paths of prediction files that differ from each other: every set drops a different share of the
+    predictions and shifts the others by a few pixels.
+    """
+    directory = tmp_path_factory.mktemp('prediction_sets')
+    with open(dataset[1]) as file:
+        annotations = json.load(file)['annotations']
+    paths = []
+    for i in range(NUM_SETS):
+        kept = [dict(annotation, bbox=[annotation['bbox'][0] + i, *annotation['bbox'][1:]])
+                for n, annotation in enumerate(annotations) if n % (i + 2)]
+        path = directory / f'predictions_{i}.json'
+        path.write_text(json.dumps({'annotations': kept}))
+        paths.append(str(path))
+    return paths
+
+
+def rows_of(path):
+    """
+    (N, 7) int32 rows of annotation_id, image_id, category_id, x, y, w, h of a file.
+    """
+    with open(path) as file:
+        annotations = json.load(file)['annotations']
+    return np.array([[a['annotation_id'], a['image_id'], a['category_id'], *a['bbox']] for a in annotations],
+                    dtype=np.int32)
+
+
+@pytest.mark.parametrize('name', ['C++ + OpenMP', 'C++ engine'])
+def test_results_match_separate_evaluations(name, dataset, prediction_sets, require_backend):
+    evaluator = require_backend(name)(dataset[0])
+    evaluator.num_threads = 1
+    expected = [sorted_ids(load_backend('Simple Python')(dataset[0], path).evaluate()) for path in prediction_sets]
+    assert all(a != b for a, b in zip(expected, expected[1:]))
+
+    results = evaluate_many(evaluator.evaluate_predictions, prediction_sets, max_workers=3)
+    assert [sorted_ids(result) for result in results] == expected
+    results = evaluate_many(evaluator.evaluate_predictions, map(rows_of, prediction_sets), max_workers=3)
+    assert [sorted_ids(result) for result in results] == expected
+
+
+def test_prediction_sets_are_pulled_lazily(dataset, prediction_sets, require_backend):
+    evaluator = require_backend('C++ + OpenMP')(dataset[0])
+    pulled = []
+
+    def pull():
+        for path in prediction_sets:
+            pulled.append(path)
+            yield path
+
+    results = evaluate_many(evaluator.evaluate_predictions, pull(), max_workers=1, max_pending=2)
+    next(results)
+    assert len(pulled) == 2
+    assert len(list(results)) == NUM_SETS - 1
+    assert len(pulled) == NUM_SETS
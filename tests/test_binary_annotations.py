@@ -0,0 +1,120 @@
+"""
+Binary annotation files hold the same boxes as the json they were converted from, and every backend
+that reads them gets the same results as from the json.
+"""
+import json
+import random
+import shutil
+import struct
+from array import array
+from pathlib import Path
+
+import pytest
+
+from common.annotation_loader import load_annotation_columns
+from common.binary_annotations import convert_to_binary, open_binary_columns
+from conftest import sorted_ids
+
+CPP_BACKENDS = ['Simple C++', 'Parallel C++', 'Parallel C++ + shared mutex', 'C++ + OpenMP', 'C++ engine']
+COLUMNS = ('annotation_ids', 'image_ids', 'category_ids', 'x1', 'y1', 'x2', 'y2')
+
+
+def with_float_boxes(json_path, output_path, seed):
+    """
+    Copy of an annotation file whose boxes are shifted by fractions of a pixel, with two decimals as in
+    the COCO files. Widths and heights keep whole values now and then, where x2 - x1 in float32 can fall
+    just short of them.
+    """
+    rng = random.Random(seed)
+    with open(json_path) as file:
+        document = json.load(file)
+    for annotation in document['annotations']:
+        x, y, w, h = annotation['bbox']
+        annotation['bbox'] = [round(x + rng.random(), 2), round(y + rng.random(), 2),
+                              w if rng.random() < 0.3 else round(w + rng.random(), 2),
+                              h if rng.random() < 0.3 else round(h + rng.random(), 2)]
+    with open(output_path, 'w') as file:
+        json.dump(document, file)
+    return str(output_path)
+
+
+@pytest.fixture(scope='module')
+def float_dataset(dataset, tmp_path_factory):
+    """
+    (json paths, binary paths) of the synthetic dataset with float boxes.
+    """
+    directory = tmp_path_factory.mktemp('float_boxes')
+    json_paths = tuple(with_float_boxes(path, directory / f'{name}.json', seed)
+                       for seed, (path, name) in enumerate(zip(dataset, ('ground_truths', 'predictions'))))
+    return json_paths, tuple(convert_to_binary(path) for path in json_paths)
+
+
+def test_binary_columns_match_json(float_dataset):
+    for json_path, binary_path in zip(*float_dataset):
+        expected = load_annotation_columns(json_path)
+        mapped = open_binary_columns(binary_path)
+        assert len(mapped) == len(expected)
+        for name in COLUMNS:
+            assert list(getattr(mapped, name)) == list(getattr(expected, name)), name
+        with open(json_path) as file:
+            bboxes = [annotation['bbox'] for annotation in json.load(file)['annotations']]
+        assert list(mapped.w) == list(array('f', (bbox[2] for bbox in bboxes)))
+        assert list(mapped.h) == list(array('f', (bbox[3] for bbox in bboxes)))
+
+
+@pytest.mark.parametrize('name', CPP_BACKENDS)
+def test_binary_results_match_json(name, float_dataset, require_backend):
+    evaluator_class = require_backend(name)
+    json_paths, binary_paths = float_dataset
+    assert sorted_ids(evaluator_class(*binary_paths).evaluate()) == \
+        sorted_ids(evaluator_class(*json_paths).evaluate())
+
+
+def as_version_one(binary_path, output_path):
+    """
+    Copy of a binary file in the layout of version 1, which had no w and h columns.
+    """
+    data = bytearray(open(binary_path, 'rb').read())
+    count = struct.unpack_from('<Q', data, 16)[0]
+    struct.pack_into('<I', data, 8, 1)
+    output_path.write_bytes(bytes(data[:len(data) - 8 * count]))
+    return str(output_path)
+
+
+@pytest.mark.parametrize('name', CPP_BACKENDS)
+def test_older_format_falls_back_to_the_source(name, float_dataset, require_backend, tmp_path):
+    evaluator_class = require_backend(name)
+    json_paths, binary_paths = float_dataset
+    old_paths = [as_version_one(path, tmp_path / f'{i}.bin') for i, path in enumerate(binary_paths)]
+    assert sorted_ids(evaluator_class(*old_paths).evaluate()) == \
+        sorted_ids(evaluator_class(*json_paths).evaluate())
+
+
+def test_older_format_is_converted_again(float_dataset, tmp_path):
+    json_path, binary_path = float_dataset[0][0], float_dataset[1][0]
+    old_path = as_version_one(binary_path, tmp_path / 'old.bin')
+    mapped = open_binary_columns(old_path)
+    expected = load_annotation_columns(json_path)
+    for name in COLUMNS:
+        assert list(getattr(mapped, name)) == list(getattr(expected, name)), name
+
+
+@pytest.mark.parametrize('name', CPP_BACKENDS)
+def test_older_format_without_source_is_rejected(name, float_dataset, require_backend, tmp_path):
+    evaluator_class = require_backend(name)
+    json_paths = [str(shutil.copy(path, tmp_path / f'{i}.json')) for i, path in enumerate(float_dataset[0])]
+    old_path = as_version_one(convert_to_binary(json_paths[0]), tmp_path / 'old.bin')
+    Path(json_paths[0]).unlink()
+    with pytest.raises(RuntimeError, match='older binary format'):
+        evaluator_class(old_path, json_paths[1])
+    with pytest.raises(ValueError, match='older binary format'):
+        open_binary_columns(old_path)
+
+
+@pytest.mark.parametrize('name', CPP_BACKENDS)
+def test_empty_file_is_reported_as_invalid_json(name, dataset, require_backend, tmp_path):
+    evaluator_class = require_backend(name)
+    empty_path = tmp_path / 'empty.json'
+    empty_path.touch()
+    with pytest.raises(RuntimeError, match='Failed to parse JSON at byte 0'):
+        evaluator_class(str(empty_path), dataset[1])
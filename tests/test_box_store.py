@@ -0,0 +1,76 @@
+"""
+BoxStore keeps its id map and group index in line with its rows through removals and additions.
+"""
+import json
+import random
+from collections import defaultdict
+
+from v1_python.py_evaluator import BoundingBox, BoxStore, Evaluator, group_key
+
+
+def assert_consistent(store, expected):
+    """
+    expected maps the annotation id of every box the store should hold to its (image_id, category_id).
+    """
+    assert len(store) == len(expected)
+    assert sorted(store.annotation_ids) == sorted(expected)
+    groups = defaultdict(list)
+    for annotation_id, (image_id, category_id) in expected.items():
+        groups[group_key(image_id, category_id)].append(annotation_id)
+    assert list(store.group_keys()) == sorted(groups)
+    for key, annotation_ids in groups.items():
+        assert sorted(store.annotation_ids[row] for row in store.group(key)) == sorted(annotation_ids)
+
+
+def test_remove_and_add_keep_the_index_consistent(dataset):
+    with open(dataset[1]) as file:
+        annotations = json.load(file)['annotations']
+    store = BoxStore(annotations)
+    store.build_index()
+    expected = {annotation['annotation_id']: (annotation['image_id'], annotation['category_id'])
+                for annotation in annotations}
+
+    rng = random.Random(3)
+    next_id = max(expected) + 1
+    for _ in range(30):
+        removed = set(rng.sample(sorted(expected), 10)) | {-1}
+        keys = store.remove(removed)
+        assert keys == {group_key(*expected.pop(annotation_id)) for annotation_id in removed - {-1}}
+        for _ in range(rng.randrange(8)):
+            image_id, category_id = rng.choice(list(expected.values()))
+            store.append_box(BoundingBox(next_id, image_id, category_id, 10, 10, 20, 20))
+            expected[next_id] = (image_id, category_id)
+            next_id += 1
+        assert_consistent(store, expected)
+
+    assert store.remove(set(expected)) == {group_key(*ids) for ids in expected.values()}
+    assert_consistent(store, {})
+
+
+def test_boxes_at_the_threshold_score_as_bounding_boxes(tmp_path):
+    """
+    Pairs whose IoU is 0.5 up to rounding, with two-decimal coordinates as in the COCO files: the store
+    has to round them as BoundingBox objects do to land on the same side of the threshold.
+    """
+    rng = random.Random(5)
+    ground_truths, predictions = [], []
+    for image_id in range(2000):
+        k = rng.randrange(1, 3000)
+        x, y, h = round(rng.uniform(0, 500), 2), round(rng.uniform(0, 500), 2), round(rng.uniform(1, 100), 2)
+        ground_truths.append({'annotation_id': image_id, 'image_id': image_id, 'category_id': 1,
+                              'bbox': [x, y, 0.03 * k, h]})
+        predictions.append({'annotation_id': image_id, 'image_id': image_id, 'category_id': 1,
+                            'bbox': [round(x + 0.01 * k, 2), y, 0.03 * k, h]})
+    paths = []
+    for name, annotations in (('ground_truths', ground_truths), ('predictions', predictions)):
+        paths.append(tmp_path / f'{name}.json')
+        paths[-1].write_text(json.dumps({'annotations': annotations}))
+
+    def box(annotation):
+        return BoundingBox(annotation['annotation_id'], annotation['image_id'], annotation['category_id'],
+                           *annotation['bbox'])
+
+    expected_tp = sorted(prediction['annotation_id'] for prediction, ground_truth in zip(predictions, ground_truths)
+                         if box(prediction).is_true_positive_or_false_positive([box(ground_truth)]))
+    assert 0 < len(expected_tp) < len(predictions)
+    assert sorted(Evaluator(*map(str, paths)).evaluate()[0]) == expected_tp
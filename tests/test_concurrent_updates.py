@@ -0,0 +1,115 @@
+"""
+Evaluations running with the GIL released while other threads evaluate and edit the same evaluator.
+"""
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from conftest import load_backend, sorted_ids
+
+EXTRA_ID = 10 ** 8
+ROUNDS = 5
+
+
+def edit_while_evaluating(evaluator, executor, num_edits=300, num_evaluations=4):
+    """
+    Adds and removes predictions while num_evaluations evaluate_async calls run.
+    """
+    futures = [evaluator.evaluate_async(executor) for _ in range(num_evaluations)]
+    for i in range(num_edits):
+        evaluator.add_prediction(EXTRA_ID + i, 1, 1, 10, 10, 30, 30)
+        assert evaluator.remove_predictions([EXTRA_ID + i]) == 1
+    for future in futures:
+        tp_ids, fp_ids, fn_ids = future.result()
+        assert set(tp_ids).isdisjoint(fp_ids)
+
+
+@pytest.mark.parametrize('name', ['Simple C++', 'Parallel C++ + shared mutex'])
+def test_evaluate_async_alongside_edits(name, concurrency_dataset, concurrency_reference, require_backend):
+    evaluator_class = require_backend(name)
+    with ThreadPoolExecutor(4) as executor:
+        for _ in range(ROUNDS):
+            evaluator = evaluator_class(*concurrency_dataset)
+            edit_while_evaluating(evaluator, executor)
+            assert sorted_ids(evaluator.evaluate()) == concurrency_reference
+
+
+@pytest.mark.parametrize('name', ['Simple C++', 'Parallel C++', 'Parallel C++ + shared mutex', 'C++ + OpenMP',
+                                  'C++ engine'])
+def test_concurrent_evaluate_on_fresh_evaluator(name, concurrency_dataset, concurrency_reference,
+                                                require_backend):
+    evaluator_class = require_backend(name)
+    with ThreadPoolExecutor(4) as executor:
+        for _ in range(ROUNDS):
+            evaluator = evaluator_class(*concurrency_dataset)
+            futures = [evaluator.evaluate_async(executor) for _ in range(4)]
+            assert all(sorted_ids(future.result()) == concurrency_reference for future in futures)
+
+
+@pytest.mark.parametrize('name', ['Simple C++', 'Parallel C++ + shared mutex'])
+def test_remove_predictions_during_evaluate(name, concurrency_dataset, require_backend):
+    """
+    Removing existing predictions re-evaluates every group they were in, even while evaluations run.
+    """
+    evaluator_class = require_backend(name)
+    with open(concurrency_dataset[1]) as file:
+        removed_ids = [annotation['annotation_id'] for annotation in json.load(file)['annotations'][::7]]
+    reference = load_backend('Simple Python')(*concurrency_dataset)
+    reference.remove_predictions(removed_ids)
+    expected = sorted_ids(reference.evaluate())
+
+    evaluator = evaluator_class(*concurrency_dataset)
+    evaluator.evaluate()
+    with ThreadPoolExecutor(4) as executor:
+        futures = [evaluator.evaluate_async(executor) for _ in range(4)]
+        for start in range(0, len(removed_ids), 100):
+            batch = removed_ids[start:start + 100]
+            assert evaluator.remove_predictions(batch) == len(batch)
+        for future in futures:
+            future.result()
+    assert sorted_ids(evaluator.evaluate()) == expected
+
+
+@pytest.mark.parametrize('name', ['Simple C++', 'Parallel C++ + shared mutex'])
+def test_edit_waiting_for_evaluate_async_releases_the_gil(name, concurrency_dataset, require_backend):
+    """
+    An edit that waits for a running evaluation lets other Python threads run meanwhile. The switch interval
+    is raised, so a waiting edit that kept the GIL would stop the ticker thread until the evaluation ends.
+    """
+    evaluator_class = require_backend(name)
+    ticks, edits = [], []
+    stop = threading.Event()
+
+    def tick():
+        while not stop.is_set():
+            ticks.append(time.perf_counter())
+            time.sleep(0.0002)
+
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(10)
+    ticker = threading.Thread(target=tick)
+    ticker.start()
+    try:
+        with ThreadPoolExecutor(1) as executor:
+            for _ in range(8 * ROUNDS):
+                evaluator = evaluator_class(*concurrency_dataset)
+                future = evaluator.evaluate_async(executor)
+                time.sleep(0.0002)  # Lets the executor thread start evaluating
+                start = time.perf_counter()
+                evaluator.add_prediction(EXTRA_ID, 1, 1, 10, 10, 30, 30)
+                edits.append((start, time.perf_counter()))
+                future.result()
+    finally:
+        stop.set()
+        ticker.join()
+        sys.setswitchinterval(switch_interval)
+
+    # A waiting edit can also be waiting for the GIL, held by the executor thread while it converts the ids
+    # of its evaluation; an edit that keeps the GIL while waiting for the lock never sees a tick
+    waiting = [(start, end) for start, end in edits if end - start > 0.0005]
+    assert waiting, 'no edit had to wait for an evaluation'
+    assert sum(any(start < t < end for t in ticks) for start, end in waiting) > len(waiting) / 2
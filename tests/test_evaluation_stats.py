@@ -0,0 +1,22 @@
+"""
+Evaluators built with collect_stats time every phase and count their queries.
+"""
+import pytest
+
+from common.evaluation_stats import PHASES
+from conftest import sorted_ids
+
+
+@pytest.mark.parametrize('name', ['Simple Python', 'Simple C++', 'Parallel C++', 'Parallel C++ + shared mutex',
+                                  'C++ + OpenMP', 'C++ engine'])
+def test_stats_time_every_phase(name, dataset, reference, require_backend):
+    evaluator_class = require_backend(name)
+    assert evaluator_class(*dataset).stats is None
+
+    evaluator = evaluator_class(*dataset, collect_stats=True)
+    assert sorted_ids(evaluator.evaluate()) == reference
+    stats = evaluator.stats
+    # Every prediction and every ground truth is looked up once
+    assert stats.queries > len(reference[0]) + len(reference[1])
+    for phase in PHASES:
+        assert getattr(stats, f'{phase}_seconds') > 0, phase
@@ -0,0 +1,83 @@
+"""
+Evaluators edited with add_* / remove_* give the results of an evaluator built from the edited files.
+"""
+import json
+import random
+
+import pytest
+
+from conftest import load_backend, sorted_ids
+from v1_python.py_evaluator import BoundingBox
+
+NEW_ID = 10 ** 6
+
+
+def read_annotations(path):
+    with open(path) as file:
+        return json.load(file)['annotations']
+
+
+def write_annotations(path, annotations):
+    with open(path, 'w') as file:
+        json.dump({'annotations': annotations}, file)
+    return str(path)
+
+
+def plan_edits(annotations, rng, first_id):
+    """
+    (ids to remove, annotations to add) of one box set: a sixth of its boxes go, and twenty boxes come,
+    shifted copies of others so that some of them match.
+    """
+    removed = rng.sample([annotation['annotation_id'] for annotation in annotations], len(annotations) // 6)
+    added = []
+    for i, annotation in enumerate(rng.sample(annotations, 20)):
+        x, y, w, h = annotation['bbox']
+        added.append({'annotation_id': first_id + i, 'image_id': annotation['image_id'],
+                      'category_id': annotation['category_id'], 'bbox': [x + rng.randrange(-3, 4), y, w, h]})
+    return removed, added
+
+
+def apply_edits(evaluator, kind, removed, added, batches=3):
+    """
+    Removes and adds the boxes of one set (kind is 'ground_truth' or 'prediction') in batches, evaluating
+    after each one.
+    """
+    add = getattr(evaluator, f'add_{kind}')
+    remove = getattr(evaluator, f'remove_{kind}s')
+    for batch in range(batches):
+        assert remove(removed[batch::batches]) == len(removed[batch::batches])
+        for annotation in added[batch::batches]:
+            fields = (annotation['annotation_id'], annotation['image_id'], annotation['category_id'],
+                      *annotation['bbox'])
+            if isinstance(evaluator, load_backend('Simple Python')):
+                add(BoundingBox(*fields))
+            else:
+                add(*fields)
+        evaluator.evaluate()
+
+
+@pytest.mark.parametrize('name, kinds', [
+    ('Simple Python', ('ground_truth', 'prediction')),
+    ('Simple C++', ('ground_truth', 'prediction')),
+    ('Parallel C++ + shared mutex', ('prediction',)),
+])
+def test_edits_match_rebuilt_evaluator(name, kinds, dataset, tmp_path, require_backend):
+    evaluator_class = require_backend(name)
+    rng = random.Random(5)
+    annotations = {'ground_truth': read_annotations(dataset[0]), 'prediction': read_annotations(dataset[1])}
+    edits = {kind: plan_edits(annotations[kind], rng, NEW_ID * (i + 1)) for i, kind in enumerate(kinds)}
+
+    edited_paths = []
+    for kind, annotations_of_kind in annotations.items():
+        removed, added = edits.get(kind, ([], []))
+        removed = set(removed)
+        edited = [annotation for annotation in annotations_of_kind if annotation['annotation_id'] not in removed]
+        edited_paths.append(write_annotations(tmp_path / f'{kind}.json', edited + added))
+    expected = sorted_ids(load_backend('Simple Python')(*edited_paths).evaluate())
+
+    evaluator = evaluator_class(*dataset)
+    evaluator.evaluate()
+    for kind, (removed, added) in edits.items():
+        apply_edits(evaluator, kind, removed, added)
+    assert sorted_ids(evaluator.evaluate()) == expected
+    assert evaluator.remove_predictions([-1]) == 0
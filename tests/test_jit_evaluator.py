@@ -0,0 +1,44 @@
+"""
+The JIT backend keeps ids apart from the float32 coordinates and times its evaluation without compiling.
+"""
+import numpy as np
+import pytest
+
+from conftest import sorted_ids
+
+jit_evaluator = pytest.importorskip('v2_jit.jit_evaluator')
+
+LARGE_ID = 2 ** 24 + 1  # 2 ** 24 + 1 and 2 ** 24 + 2 are the same float32
+
+
+def boxes(rows):
+    rows = np.array(rows, dtype=np.int64)
+    return jit_evaluator.Boxes(rows[:, :3].astype(np.int32), rows[:, 3:].astype(np.float32))
+
+
+def test_evaluate_parallel_matches_reference(dataset, reference):
+    gt_boxes, pred_boxes = (jit_evaluator.load_boxes_from_json(path) for path in dataset)
+    assert sorted_ids(jit_evaluator.evaluate_parallel(gt_boxes, pred_boxes)) == reference
+
+
+def test_large_ids_do_not_collide():
+    # The same box in two images whose ids only differ past float32 precision
+    gt_boxes = boxes([[LARGE_ID, LARGE_ID, 1, 10, 10, 50, 50]])
+    pred_boxes = boxes([[LARGE_ID + 2, LARGE_ID + 1, 1, 10, 10, 50, 50],
+                        [LARGE_ID + 4, LARGE_ID, 1, 10, 10, 50, 50]])
+    tp_ids, fp_ids, fn_ids = jit_evaluator.evaluate_parallel(gt_boxes, pred_boxes)
+    assert (list(tp_ids), list(fp_ids), list(fn_ids)) == ([LARGE_ID + 4], [LARGE_ID + 2], [])
+
+
+def test_timing_leaves_out_compilation(dataset, reference, monkeypatch):
+    # Reads of the timer snapshot the compiled signatures: none may appear between the two reads
+    signatures = []
+
+    def time():
+        signatures.append(len(jit_evaluator.match_segments.signatures))
+        return 0.0
+    monkeypatch.setattr(jit_evaluator, 'time', time)
+
+    _, tp_ids, fp_ids, fn_ids = jit_evaluator.measure_jit_evaluator_time(*dataset)
+    assert (tp_ids, fp_ids, fn_ids) == reference
+    assert len(signatures) == 2 and signatures[0] == signatures[1] > 0
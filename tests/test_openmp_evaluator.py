@@ -0,0 +1,32 @@
+"""
+The OpenMP evaluator returns its ids in input order, whatever the threads and the schedule.
+"""
+import numpy as np
+import pytest
+
+from conftest import load_backend
+
+
+@pytest.fixture(scope='module')
+def input_order_reference(concurrency_dataset):
+    """
+    Ids of the pure-Python evaluator, which come in input order.
+    """
+    return tuple(list(ids) for ids in load_backend('Simple Python')(*concurrency_dataset).evaluate())
+
+
+@pytest.mark.parametrize('num_threads, schedule', [(1, 'static'), (4, 'dynamic'), (3, 'guided'), (4, 'static')])
+def test_ids_come_in_input_order(num_threads, schedule, concurrency_dataset, input_order_reference,
+                                 require_backend):
+    evaluator = require_backend('C++ + OpenMP')(*concurrency_dataset)
+    evaluator.num_threads = num_threads
+    evaluator.set_schedule(schedule, 7)
+
+    assert tuple(list(ids) for ids in evaluator.evaluate()) == input_order_reference
+    assert tuple(ids.tolist() for ids in evaluator.evaluate_arrays()) == input_order_reference
+
+    pred_is_tp, gt_is_fn = evaluator.evaluate_masks()
+    tp_ids, fp_ids, fn_ids = input_order_reference
+    assert int(np.count_nonzero(pred_is_tp)) == len(tp_ids)
+    assert len(pred_is_tp) == len(tp_ids) + len(fp_ids)
+    assert int(np.count_nonzero(gt_is_fn)) == len(fn_ids)
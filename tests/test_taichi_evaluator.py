@@ -0,0 +1,34 @@
+"""
+The Taichi backend keeps ids apart from the float32 coordinates.
+"""
+import numpy as np
+import pytest
+
+from common.binary_annotations import load_columns
+from conftest import sorted_ids
+
+taichi_evaluator = pytest.importorskip('v3_tai_chi.taichi_evaluator')
+
+LARGE_ID = 2 ** 24 + 1  # 2 ** 24 + 1 and 2 ** 24 + 2 are the same float32
+
+
+def boxes(rows):
+    rows = np.array(rows, dtype=np.int64)
+    return taichi_evaluator.Boxes(rows[:, :3].astype(np.int32), rows[:, 3:].astype(np.float32))
+
+
+def test_evaluate_matches_reference(dataset, reference):
+    gt_boxes, pred_boxes = (taichi_evaluator.boxes_from_columns(load_columns(path)) for path in dataset)
+    assert sorted_ids(taichi_evaluator.TaichiEvaluator().evaluate(gt_boxes, pred_boxes)) == reference
+
+
+def test_large_ids_do_not_collide():
+    # The same box in two images, and in two categories, whose ids only differ past float32 precision
+    gt_boxes = boxes([[LARGE_ID, LARGE_ID, 1, 10, 10, 50, 50],
+                      [LARGE_ID + 6, 1, LARGE_ID, 10, 10, 50, 50]])
+    pred_boxes = boxes([[LARGE_ID + 2, LARGE_ID + 1, 1, 10, 10, 50, 50],
+                        [LARGE_ID + 4, LARGE_ID, 1, 10, 10, 50, 50],
+                        [LARGE_ID + 8, 1, LARGE_ID + 1, 10, 10, 50, 50]])
+    tp_ids, fp_ids, fn_ids = taichi_evaluator.TaichiEvaluator().evaluate(gt_boxes, pred_boxes)
+    assert (list(tp_ids), list(fp_ids), list(fn_ids)) == ([LARGE_ID + 4], [LARGE_ID + 2, LARGE_ID + 8],
+                                                          [LARGE_ID + 6])
@@ -0,0 +1,65 @@
+"""
+evaluate_thresholds gives, for every IoU threshold, what a separate evaluation at that threshold gives.
+"""
+import json
+from collections import defaultdict
+
+import pytest
+
+from conftest import sorted_ids
+from v1_python.py_evaluator import BoundingBox
+
+COCO_THRESHOLDS = [0.5 + 0.05 * i for i in range(10)]
+
+
+def read_groups(path):
+    """
+    BoundingBoxes of a file by (image_id, category_id).
+    """
+    with open(path) as file:
+        annotations = json.load(file)['annotations']
+    groups = defaultdict(list)
+    for annotation in annotations:
+        box = BoundingBox(annotation['annotation_id'], annotation['image_id'], annotation['category_id'],
+                          *annotation['bbox'])
+        groups[box.image_id, box.category_id].append(box)
+    return groups
+
+
+def reference_at(gt_groups, pred_groups, iou_threshold):
+    tp_ids, fp_ids, fn_ids = [], [], []
+    for key, pred_boxes in pred_groups.items():
+        for box in pred_boxes:
+            is_tp = box.is_true_positive_or_false_positive(gt_groups.get(key, []), iou_threshold)
+            (tp_ids if is_tp else fp_ids).append(box.annotation_id)
+    for key, gt_boxes in gt_groups.items():
+        fn_ids += [box.annotation_id for box in gt_boxes
+                   if box.is_false_negative(pred_groups.get(key, []), iou_threshold)]
+    return sorted_ids((tp_ids, fp_ids, fn_ids))
+
+
+@pytest.mark.parametrize('name', ['C++ + OpenMP', 'C++ engine'])
+def test_every_threshold_matches_its_own_evaluation(name, dataset, reference, require_backend):
+    evaluator = require_backend(name)(*dataset)
+    gt_groups, pred_groups = read_groups(dataset[0]), read_groups(dataset[1])
+
+    results = evaluator.evaluate_thresholds()
+    assert len(results) == len(COCO_THRESHOLDS)
+    assert sorted_ids(results[0]) == reference
+    for threshold, result in zip(COCO_THRESHOLDS, results):
+        assert sorted_ids(result) == reference_at(gt_groups, pred_groups, threshold), threshold
+
+    # Thresholds are answered in the order given, whatever it is
+    thresholds = [0.9, 0.3, 0.7]
+    assert [sorted_ids(result) for result in evaluator.evaluate_thresholds(thresholds)] == \
+        [reference_at(gt_groups, pred_groups, threshold) for threshold in thresholds]
+
+
+@pytest.mark.parametrize('name', ['C++ + OpenMP', 'C++ engine'])
+@pytest.mark.parametrize('thresholds', [[0.0], [0.5, -0.1], [1.5], [float('nan')]])
+def test_thresholds_outside_unit_interval_are_rejected(name, thresholds, dataset, require_backend):
+    # At a threshold <= 0, a box without any candidate (best IoU 0) would pass for a match
+    evaluator = require_backend(name)(*dataset)
+    with pytest.raises(ValueError, match=r'\(0, 1\]'):
+        evaluator.evaluate_thresholds(thresholds)
+    assert len(evaluator.evaluate_thresholds([1.0])) == 1
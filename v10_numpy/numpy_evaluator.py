@@ -0,0 +1,144 @@
+from typing import List, Tuple
+
+import numpy as np
+
+from common.binary_annotations import load_columns
+
+# float64 temporaries of one IoU tile (intersection, union, scratch) plus the boolean result, per box pair
+BYTES_PER_PAIR = 3 * 8 + 1
+DEFAULT_MAX_MEMORY_BYTES = 64 * 1024 * 1024
+# Predictions are tiled in narrow bands of x1 so each tile only meets the ground truths of its own band
+MAX_TILE_ROWS = 256
+
+
+class GroupedBoxes:
+    """
+    Boxes of one annotation file sorted by (image_id, category_id), then by x1 inside each group.
+
+    Attributes:
+        order (np.ndarray): position of each sorted box in the original file.
+        annotation_ids (np.ndarray): int32 ids in file order.
+        coords (np.ndarray): (4, N) float64 x1, y1, x2, y2 in sorted order.
+        widths (np.ndarray): float64 box widths in sorted order.
+        areas (np.ndarray): float64 box areas in sorted order.
+        group_keys (np.ndarray): int64 key of every group, ascending.
+        group_starts (np.ndarray): offset of every group in the sorted arrays, plus a final end offset.
+    """
+
+    def __init__(self, json_path: str):
+        columns = load_columns(json_path)
+        image_ids = np.frombuffer(columns.image_ids, dtype=np.int32)
+        category_ids = np.frombuffer(columns.category_ids, dtype=np.int32)
+        keys = (image_ids.astype(np.int64) << 32) | (category_ids.astype(np.int64) & 0xFFFFFFFF)
+
+        self.order = np.lexsort((np.frombuffer(columns.x1, dtype=np.float32), keys))
+        keys = keys[self.order]
+        self.annotation_ids = np.frombuffer(columns.annotation_ids, dtype=np.int32)
+        self.coords = np.stack([
+            np.frombuffer(column, dtype=np.float32)[self.order]
+            for column in (columns.x1, columns.y1, columns.x2, columns.y2)
+        ]).astype(np.float64)
+        self.widths = self.coords[2] - self.coords[0]
+        self.areas = self.widths * (self.coords[3] - self.coords[1])
+
+        starts = np.flatnonzero(np.diff(keys)) + 1
+        self.group_keys = keys[np.concatenate(([0], starts))] if len(keys) else keys
+        self.group_starts = np.concatenate(([0], starts, [len(keys)]))
+
+    def __len__(self):
+        return len(self.annotation_ids)
+
+
+def _iou_at_least(pred_coords: np.ndarray, pred_areas: np.ndarray, gt_coords: np.ndarray, gt_areas: np.ndarray,
+                  iou_threshold: float) -> np.ndarray:
+    """
+    Returns the (num_pred, num_gt) boolean matrix of box pairs whose IoU reaches the threshold.
+    Works in place on two float64 matrices to keep the temporaries within BYTES_PER_PAIR.
+    """
+    px1, py1, px2, py2 = (c[:, None] for c in pred_coords)
+    gx1, gy1, gx2, gy2 = (c[None, :] for c in gt_coords)
+
+    inter = np.minimum(px2, gx2)
+    scratch = np.maximum(px1, gx1)
+    inter -= scratch
+    np.maximum(inter, 0, out=inter)
+
+    np.minimum(py2, gy2, out=scratch)
+    scratch -= np.maximum(py1, gy1)
+    np.maximum(scratch, 0, out=scratch)
+    inter *= scratch
+
+    np.add(pred_areas[:, None], gt_areas[None, :], out=scratch)
+    scratch -= inter
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inter /= scratch
+    return inter >= iou_threshold
+
+
+class NumpyEvaluator:
+    def __init__(self, ground_truth_json: str, predictions_json: str,
+                 max_memory_bytes: int = DEFAULT_MAX_MEMORY_BYTES):
+        """
+        Args:
+            ground_truth_json: ground truth json (or binary annotation) file.
+            predictions_json: predictions json (or binary annotation) file.
+            max_memory_bytes: budget for the temporary IoU matrices; large groups are split into tiles
+                that stay under it.
+        """
+        self.ground_truth_boxes = GroupedBoxes(ground_truth_json)
+        self.predicted_boxes = GroupedBoxes(predictions_json)
+        self.max_memory_bytes = max_memory_bytes
+
+    def _tile_shape(self, num_pred: int) -> Tuple[int, int]:
+        max_pairs = max(1, self.max_memory_bytes // BYTES_PER_PAIR)
+        pred_tile = max(1, min(num_pred, MAX_TILE_ROWS, max_pairs))
+        return pred_tile, max(1, max_pairs // pred_tile)
+
+    def evaluate(self, iou_threshold: float = 0.5) -> Tuple[List[int], List[int], List[int]]:
+        """
+        Matches every (image_id, category_id) group of predictions against the same group of ground truths
+        with broadcast IoU matrices, reduced with `any` along each axis. Each tile of predictions is only
+        compared with the ground truths whose x extent can overlap it.
+
+        Returns:
+            Tuple[List[int], List[int], List[int]]: tp prediction ids, fp prediction ids, fn ground truth ids
+        """
+        gt, pred = self.ground_truth_boxes, self.predicted_boxes
+        pred_matched = np.zeros(len(pred), dtype=bool)
+        gt_matched = np.zeros(len(gt), dtype=bool)
+
+        # Only groups present in both sets can hold matches
+        _, pred_groups, gt_groups = np.intersect1d(pred.group_keys, gt.group_keys, assume_unique=True,
+                                                   return_indices=True)
+        for p_group, g_group in zip(pred_groups, gt_groups):
+            p_start, p_end = pred.group_starts[p_group], pred.group_starts[p_group + 1]
+            g_start, g_end = gt.group_starts[g_group], gt.group_starts[g_group + 1]
+            pred_tile, gt_tile = self._tile_shape(p_end - p_start)
+            gt_x1 = gt.coords[0, g_start:g_end]
+            max_gt_width = gt.widths[g_start:g_end].max()
+
+            for p in range(p_start, p_end, pred_tile):
+                p_stop = min(p + pred_tile, p_end)
+                g_lo, g_hi = g_start, g_end
+                if iou_threshold > 0:
+                    # Ground truths overlapping the tile have x1 in (min pred x1 - max gt width, max pred x2)
+                    g_lo += np.searchsorted(gt_x1, pred.coords[0, p] - max_gt_width, side='right')
+                    g_hi = g_start + np.searchsorted(gt_x1, pred.coords[2, p:p_stop].max(), side='left')
+
+                for g in range(g_lo, g_hi, gt_tile):
+                    g_stop = min(g + gt_tile, g_hi)
+                    matches = _iou_at_least(pred.coords[:, p:p_stop], pred.areas[p:p_stop],
+                                            gt.coords[:, g:g_stop], gt.areas[g:g_stop], iou_threshold)
+                    pred_matched[p:p_stop] |= matches.any(axis=1)
+                    gt_matched[g:g_stop] |= matches.any(axis=0)
+
+        # Report the ids in the order of the input files, like the other backends
+        pred_is_tp = np.empty_like(pred_matched)
+        pred_is_tp[pred.order] = pred_matched
+        gt_is_fn = np.empty_like(gt_matched)
+        gt_is_fn[gt.order] = ~gt_matched
+
+        tp_ids = pred.annotation_ids[pred_is_tp]
+        fp_ids = pred.annotation_ids[~pred_is_tp]
+        fn_ids = gt.annotation_ids[gt_is_fn]
+        return tp_ids.tolist(), fp_ids.tolist(), fn_ids.tolist()
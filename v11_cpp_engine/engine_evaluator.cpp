@@ -0,0 +1,348 @@
+#include "engine_evaluator.h"
+#include "annotation_reader.h"
+#include <algorithm>
+#include <stdexcept>
+#include <thread>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
+bool openmp_available() {
+#ifdef _OPENMP
+    return true;
+#else
+    return false;
+#endif
+}
+
+ExecutionPolicy parse_execution_policy(const std::string& name) {
+    if (name == "auto") {
+        return ExecutionPolicy::Auto;
+    } else if (name == "serial") {
+        return ExecutionPolicy::Serial;
+    } else if (name == "threads") {
+        return ExecutionPolicy::Threads;
+    } else if (name == "openmp") {
+        if (!openmp_available()) {
+            throw std::invalid_argument("The openmp policy needs a build with OpenMP");
+        }
+        return ExecutionPolicy::OpenMP;
+    }
+    throw std::invalid_argument("Unknown policy '" + name + "', expected auto, serial, threads or openmp");
+}
+
+std::string execution_policy_name(ExecutionPolicy policy) {
+    switch (policy) {
+        case ExecutionPolicy::Serial: return "serial";
+        case ExecutionPolicy::Threads: return "threads";
+        case ExecutionPolicy::OpenMP: return "openmp";
+        default: return "auto";
+    }
+}
+
+static BoundingBox box_from_record(const AnnotationRecord& ann) {
+    return BoundingBox(ann.annotation_id, ann.image_id, ann.category_id, ann.bbox[0], ann.bbox[1], ann.bbox[2], ann.bbox[3]);
+}
+
+constexpr std::size_t EngineEvaluator::DEFAULT_PARALLEL_MIN_BOXES;
+constexpr std::size_t EngineEvaluator::CHUNKS_PER_THREAD;
+constexpr std::size_t EngineEvaluator::MIN_CHUNK_SIZE;
+constexpr std::size_t EngineEvaluator::MAX_CHUNK_SIZE;
+
+EngineEvaluator::EngineEvaluator(const std::string& ground_truth_json, const std::string& predictions_json, bool collect_stats) {
+    stats.enabled = collect_stats;
+    {
+        PhaseTimer timer(stats, &EvaluationStats::parse_seconds);
+        read_annotation_files(ground_truth_json, predictions_json, [this](const AnnotationRecord& ann) {
+            ground_truth_boxes.push_back(box_from_record(ann));
+        }, [this](const AnnotationRecord& ann) {
+            predicted_boxes.push_back(box_from_record(ann));
+        });
+    }
+    build_indexes();
+}
+
+EngineEvaluator::EngineEvaluator(const std::string& ground_truth_json, bool collect_stats) {
+    stats.enabled = collect_stats;
+    {
+        PhaseTimer timer(stats, &EvaluationStats::parse_seconds);
+        read_annotation_file(ground_truth_json, [this](const AnnotationRecord& ann) {
+            ground_truth_boxes.push_back(box_from_record(ann));
+        });
+    }
+    build_indexes();
+}
+
+EngineEvaluator::EngineEvaluator(const int* ground_truth_rows, std::size_t num_ground_truths, const int* prediction_rows, std::size_t num_predictions,
+                                 bool collect_stats) {
+    stats.enabled = collect_stats;
+    {
+        PhaseTimer timer(stats, &EvaluationStats::parse_seconds);
+        ground_truth_boxes.reserve(num_ground_truths);
+        read_annotation_rows(ground_truth_rows, num_ground_truths, [this](const AnnotationRecord& ann) {
+            ground_truth_boxes.push_back(box_from_record(ann));
+        });
+        predicted_boxes.reserve(num_predictions);
+        read_annotation_rows(prediction_rows, num_predictions, [this](const AnnotationRecord& ann) {
+            predicted_boxes.push_back(box_from_record(ann));
+        });
+    }
+    build_indexes();
+}
+
+void EngineEvaluator::build_indexes() {
+    PhaseTimer timer(stats, &EvaluationStats::index_seconds);
+    ground_truth_index = SpatialIndex(ground_truth_boxes);
+    predicted_index = SpatialIndex(predicted_boxes);
+}
+
+void EngineEvaluator::set_policy(const std::string& policy) {
+    this->policy = parse_execution_policy(policy);
+}
+
+std::string EngineEvaluator::get_policy() const {
+    return execution_policy_name(policy);
+}
+
+std::string EngineEvaluator::get_last_policy() const {
+    return execution_policy_name(last_policy.load());
+}
+
+void EngineEvaluator::set_num_threads(int num_threads) {
+    if (num_threads < 0) {
+        throw std::invalid_argument("num_threads must be >= 0 (0 uses every hardware thread)");
+    }
+    this->num_threads = num_threads;
+}
+
+int EngineEvaluator::get_num_threads() const {
+    return num_threads;
+}
+
+void EngineEvaluator::set_parallel_min_boxes(std::size_t num_boxes) {
+    parallel_min_boxes = num_boxes;
+}
+
+std::size_t EngineEvaluator::get_parallel_min_boxes() const {
+    return parallel_min_boxes;
+}
+
+int EngineEvaluator::thread_count(ExecutionPolicy resolved) const {
+    if (resolved == ExecutionPolicy::Serial) {
+        return 1;
+    }
+    if (num_threads > 0) {
+        return num_threads;
+    }
+#ifdef _OPENMP
+    if (resolved == ExecutionPolicy::OpenMP) {
+        return omp_get_max_threads();
+    }
+#endif
+    return static_cast<int>(std::max(1u, std::thread::hardware_concurrency()));
+}
+
+ExecutionPolicy EngineEvaluator::resolve_policy(std::size_t num_boxes) const {
+    if (policy != ExecutionPolicy::Auto) {
+        return policy;
+    }
+    ExecutionPolicy parallel = openmp_available() ? ExecutionPolicy::OpenMP : ExecutionPolicy::Threads;
+    if (num_boxes < parallel_min_boxes || thread_count(parallel) <= 1) {
+        return ExecutionPolicy::Serial;
+    }
+    return parallel;
+}
+
+std::shared_ptr<WorkStealingPool> EngineEvaluator::thread_pool(int threads) const {
+    std::lock_guard<std::mutex> lock(pool_mtx);
+    if (!pool || pool->size() != threads) {
+        pool = std::make_shared<WorkStealingPool>(threads);
+    }
+    return pool;  // A call still running on a replaced pool keeps it alive until it returns
+}
+
+template <typename Body>
+void EngineEvaluator::for_each_chunk(std::size_t n, Body body) const {
+    ExecutionPolicy resolved = resolve_policy(n);
+    last_policy = resolved;
+    int threads = thread_count(resolved);
+    // Enough chunks per thread for stealing or dynamic scheduling to even out skewed images
+    std::size_t chunk = std::min(MAX_CHUNK_SIZE, std::max(MIN_CHUNK_SIZE, n / (threads * CHUNKS_PER_THREAD)));
+
+    if (resolved == ExecutionPolicy::Threads) {
+        thread_pool(threads)->parallel_for(n, chunk, [&](std::size_t begin, std::size_t end) {
+            MatchCounters counters;
+            body(begin, end, counters);
+            stats.add(counters);
+        });
+        return;
+    }
+#ifdef _OPENMP
+    if (resolved == ExecutionPolicy::OpenMP) {
+        long num_chunks = static_cast<long>((n + chunk - 1) / chunk);
+        #pragma omp parallel num_threads(threads)
+        {
+            MatchCounters counters;  // Merged once per thread
+
+            #pragma omp for schedule(dynamic)
+            for (long c = 0; c < num_chunks; ++c) {
+                std::size_t begin = static_cast<std::size_t>(c) * chunk;
+                body(begin, std::min(n, begin + chunk), counters);
+            }
+
+            stats.add(counters);
+        }
+        return;
+    }
+#endif
+    MatchCounters counters;
+    body(0, n, counters);
+    stats.add(counters);
+}
+
+EvaluationIds EngineEvaluator::evaluate() {
+    return collect_ids(predicted_boxes, match_masks(predicted_boxes, predicted_index));
+}
+
+EvaluationMasks EngineEvaluator::evaluate_masks() {
+    return match_masks(predicted_boxes, predicted_index);
+}
+
+EvaluationIds EngineEvaluator::evaluate_predictions(const std::string& predictions_json) const {
+    std::vector<BoundingBox> predictions;
+    {
+        PhaseTimer timer(stats, &EvaluationStats::parse_seconds);
+        read_annotation_file(predictions_json, [&predictions](const AnnotationRecord& ann) {
+            predictions.push_back(box_from_record(ann));
+        });
+    }
+    return collect_ids(predictions, match_masks(predictions, index_predictions(predictions)));
+}
+
+EvaluationIds EngineEvaluator::evaluate_prediction_rows(const int* prediction_rows, std::size_t num_predictions) const {
+    std::vector<BoundingBox> predictions;
+    {
+        PhaseTimer timer(stats, &EvaluationStats::parse_seconds);
+        predictions.reserve(num_predictions);
+        read_annotation_rows(prediction_rows, num_predictions, [&predictions](const AnnotationRecord& ann) {
+            predictions.push_back(box_from_record(ann));
+        });
+    }
+    return collect_ids(predictions, match_masks(predictions, index_predictions(predictions)));
+}
+
+SpatialIndex EngineEvaluator::index_predictions(const std::vector<BoundingBox>& predictions) const {
+    PhaseTimer timer(stats, &EvaluationStats::index_seconds);
+    return SpatialIndex(predictions);
+}
+
+EvaluationMasks EngineEvaluator::match_masks(const std::vector<BoundingBox>& predictions, const SpatialIndex& prediction_index) const {
+    PhaseTimer timer(stats, &EvaluationStats::match_seconds);
+    std::vector<uint8_t> pred_is_tp(predictions.size());
+    std::vector<uint8_t> gt_is_fn(ground_truth_boxes.size());
+
+    // Predictions and ground truths share one loop, so a single parallel region covers both sides
+    std::size_t num_predictions = predictions.size();
+    for_each_chunk(num_predictions + ground_truth_boxes.size(), [&](std::size_t begin, std::size_t end, MatchCounters& counters) {
+        for (std::size_t i = begin; i < end; ++i) {
+            if (i < num_predictions) {
+                pred_is_tp[i] = ground_truth_index.any_match(predictions[i], 0.5, counters);
+            } else {
+                gt_is_fn[i - num_predictions] = !prediction_index.any_match(ground_truth_boxes[i - num_predictions], 0.5, counters);
+            }
+        }
+    });
+
+    return {std::move(pred_is_tp), std::move(gt_is_fn)};
+}
+
+EvaluationIds EngineEvaluator::collect_ids(const std::vector<BoundingBox>& predictions, const EvaluationMasks& masks) const {
+    PhaseTimer timer(stats, &EvaluationStats::collect_seconds);
+    const auto& pred_is_tp = masks.first;
+    const auto& gt_is_fn = masks.second;
+
+    std::vector<int> tp_pred_ids;
+    std::vector<int> fp_pred_ids;
+    std::vector<int> fn_gt_ids;
+
+    std::size_t num_tp = std::count(pred_is_tp.begin(), pred_is_tp.end(), 1);
+    tp_pred_ids.reserve(num_tp);
+    fp_pred_ids.reserve(predictions.size() - num_tp);
+    for (std::size_t i = 0; i < predictions.size(); ++i) {
+        if (pred_is_tp[i]) {
+            tp_pred_ids.push_back(predictions[i].annotation_id);
+        } else {
+            fp_pred_ids.push_back(predictions[i].annotation_id);
+        }
+    }
+
+    for (std::size_t i = 0; i < ground_truth_boxes.size(); ++i) {
+        if (gt_is_fn[i]) {
+            fn_gt_ids.push_back(ground_truth_boxes[i].annotation_id);
+        }
+    }
+
+    return std::make_tuple(std::move(tp_pred_ids), std::move(fp_pred_ids), std::move(fn_gt_ids));
+}
+
+std::pair<std::vector<double>, std::vector<double>> EngineEvaluator::best_ious(double min_iou, double enough_iou) {
+    PhaseTimer timer(stats, &EvaluationStats::match_seconds);
+    std::vector<double> pred_best_iou(predicted_boxes.size());
+    std::vector<double> gt_best_iou(ground_truth_boxes.size());
+
+    std::size_t num_predictions = predicted_boxes.size();
+    for_each_chunk(num_predictions + ground_truth_boxes.size(), [&](std::size_t begin, std::size_t end, MatchCounters& counters) {
+        for (std::size_t i = begin; i < end; ++i) {
+            if (i < num_predictions) {
+                pred_best_iou[i] = ground_truth_index.best_iou(predicted_boxes[i], min_iou, enough_iou, counters);
+            } else {
+                gt_best_iou[i - num_predictions] = predicted_index.best_iou(ground_truth_boxes[i - num_predictions], min_iou, enough_iou, counters);
+            }
+        }
+    });
+
+    return {std::move(pred_best_iou), std::move(gt_best_iou)};
+}
+
+std::vector<EvaluationIds> EngineEvaluator::evaluate_thresholds(const std::vector<double>& iou_thresholds) {
+    // Boxes without a candidate keep a best IoU of 0, which a threshold <= 0 would count as a match
+    for (double iou_threshold : iou_thresholds) {
+        if (!(iou_threshold > 0 && iou_threshold <= 1)) {
+            throw std::invalid_argument("iou_thresholds must be in (0, 1], got " + std::to_string(iou_threshold));
+        }
+    }
+    std::vector<EvaluationIds> results(iou_thresholds.size());
+    if (iou_thresholds.empty()) {
+        return results;
+    }
+
+    // One search at the loosest threshold: its candidate window contains those of all the others.
+    // A box that reaches the strictest threshold is a match everywhere, so its search stops there.
+    auto bounds = std::minmax_element(iou_thresholds.begin(), iou_thresholds.end());
+    auto best = best_ious(*bounds.first, *bounds.second);
+    const auto& pred_best_iou = best.first;
+    const auto& gt_best_iou = best.second;
+    PhaseTimer timer(stats, &EvaluationStats::collect_seconds);
+
+    for (std::size_t t = 0; t < iou_thresholds.size(); ++t) {
+        double iou_threshold = iou_thresholds[t];
+        auto& tp_pred_ids = std::get<0>(results[t]);
+        auto& fp_pred_ids = std::get<1>(results[t]);
+        auto& fn_gt_ids = std::get<2>(results[t]);
+
+        for (std::size_t i = 0; i < predicted_boxes.size(); ++i) {
+            if (pred_best_iou[i] >= iou_threshold) {
+                tp_pred_ids.push_back(predicted_boxes[i].annotation_id);
+            } else {
+                fp_pred_ids.push_back(predicted_boxes[i].annotation_id);
+            }
+        }
+        for (std::size_t i = 0; i < ground_truth_boxes.size(); ++i) {
+            if (!(gt_best_iou[i] >= iou_threshold)) {
+                fn_gt_ids.push_back(ground_truth_boxes[i].annotation_id);
+            }
+        }
+    }
+
+    return results;
+}
@@ -0,0 +1,125 @@
+#ifndef ENGINE_EVALUATOR_H
+#define ENGINE_EVALUATOR_H
+
+#include <atomic>
+#include <cstddef>
+#include <cstdint>
+#include <memory>
+#include <mutex>
+#include <string>
+#include <tuple>
+#include <unordered_map>
+#include <utility>
+#include <vector>
+#include "thread_pool.h"
+#include "evaluation_stats.h"
+#include "spatial_grid.h"
+
+struct BoundingBox {
+    int annotation_id;
+    int image_id;
+    int category_id;
+    int x1, y1, x2, y2;
+
+    BoundingBox(int annotation_id, int image_id, int category_id, int x, int y, int w, int h)
+        : annotation_id(annotation_id), image_id(image_id), category_id(category_id), x1(x), y1(y), x2(x + w), y2(y + h) {}
+};
+
+// How the matching loops run. Auto runs calls on few boxes serially, where starting threads costs more
+// than it saves, and larger ones in parallel (OpenMP when built with it, the thread pool otherwise).
+enum class ExecutionPolicy { Auto, Serial, Threads, OpenMP };
+
+// "auto", "serial", "threads" or "openmp"; invalid_argument for anything else, or for "openmp" in a
+// build without OpenMP
+ExecutionPolicy parse_execution_policy(const std::string& name);
+std::string execution_policy_name(ExecutionPolicy policy);
+bool openmp_available();
+
+using EvaluationIds = std::tuple<std::vector<int>, std::vector<int>, std::vector<int>>;
+using EvaluationMasks = std::pair<std::vector<uint8_t>, std::vector<uint8_t>>;
+
+// One evaluator for every execution policy: the same grids and IoU kernels run serially, on a
+// work-stealing thread pool or in an OpenMP team, chosen per evaluator and switchable between calls.
+class EngineEvaluator {
+public:
+    // Under the auto policy, calls matching fewer boxes than this (both sides together) run serially
+    static constexpr std::size_t DEFAULT_PARALLEL_MIN_BOXES = 10000;
+
+    EngineEvaluator(const std::string& ground_truth_json, const std::string& predictions_json, bool collect_stats = false);
+
+    // Only loads the ground truth, to score prediction sets with evaluate_predictions
+    explicit EngineEvaluator(const std::string& ground_truth_json, bool collect_stats = false);
+
+    // Boxes as rows of annotation_id, image_id, category_id, x, y, w, h
+    EngineEvaluator(const int* ground_truth_rows, std::size_t num_ground_truths, const int* prediction_rows, std::size_t num_predictions,
+                    bool collect_stats = false);
+
+    void set_policy(const std::string& policy);
+    std::string get_policy() const;
+
+    // Policy the last evaluation actually ran with, once auto picked one; "auto" before any evaluation
+    std::string get_last_policy() const;
+
+    // Threads of the parallel policies; 0 uses every hardware thread (the OpenMP default for openmp)
+    void set_num_threads(int num_threads);
+    int get_num_threads() const;
+
+    void set_parallel_min_boxes(std::size_t num_boxes);
+    std::size_t get_parallel_min_boxes() const;
+
+    // True positive and false positive prediction ids and false negative ground truth ids, in input order
+    EvaluationIds evaluate();
+
+    // Per-box flags in input order: prediction is a true positive, ground truth is a false negative
+    EvaluationMasks evaluate_masks();
+
+    // Another prediction set against the resident ground truth, leaving the evaluator unchanged.
+    // Safe to call from several threads at once.
+    EvaluationIds evaluate_predictions(const std::string& predictions_json) const;
+    EvaluationIds evaluate_prediction_rows(const int* prediction_rows, std::size_t num_predictions) const;
+
+    // Best IoU of every prediction and of every ground truth against the other side, in input order.
+    // Values below min_iou are not exact, and neither are values above enough_iou.
+    std::pair<std::vector<double>, std::vector<double>> best_ious(double min_iou = 0.5, double enough_iou = 1.0);
+
+    // evaluate() at every threshold from a single best IoU search at the lowest one; invalid_argument for a
+    // threshold outside (0, 1]
+    std::vector<EvaluationIds> evaluate_thresholds(const std::vector<double>& iou_thresholds);
+
+    // Only filled when collect_stats was set; every chunk of a parallel loop merges its counters once
+    mutable EvaluationStats stats;
+
+private:
+    static constexpr std::size_t CHUNKS_PER_THREAD = 16;
+    static constexpr std::size_t MIN_CHUNK_SIZE = 16;
+    static constexpr std::size_t MAX_CHUNK_SIZE = 1024;
+
+    std::vector<BoundingBox> ground_truth_boxes;
+    std::vector<BoundingBox> predicted_boxes;
+    SpatialIndex ground_truth_index;
+    SpatialIndex predicted_index;
+
+    ExecutionPolicy policy = ExecutionPolicy::Auto;
+    int num_threads = 0;
+    std::size_t parallel_min_boxes = DEFAULT_PARALLEL_MIN_BOXES;
+    mutable std::atomic<ExecutionPolicy> last_policy{ExecutionPolicy::Auto};
+
+    // Created on the first call under the threads policy, and again when the thread count changes
+    mutable std::shared_ptr<WorkStealingPool> pool;
+    mutable std::mutex pool_mtx;
+
+    ExecutionPolicy resolve_policy(std::size_t num_boxes) const;
+    int thread_count(ExecutionPolicy resolved) const;
+    std::shared_ptr<WorkStealingPool> thread_pool(int threads) const;
+
+    // Calls body(begin, end, counters) over chunks covering [0, n) under the policy resolved for n boxes
+    template <typename Body>
+    void for_each_chunk(std::size_t n, Body body) const;
+
+    void build_indexes();
+    SpatialIndex index_predictions(const std::vector<BoundingBox>& predictions) const;
+    EvaluationMasks match_masks(const std::vector<BoundingBox>& predictions, const SpatialIndex& prediction_index) const;
+    EvaluationIds collect_ids(const std::vector<BoundingBox>& predictions, const EvaluationMasks& masks) const;
+};
+
+#endif // ENGINE_EVALUATOR_H
@@ -0,0 +1,99 @@
+#include <pybind11/pybind11.h>
+#include <pybind11/numpy.h>
+#include <pybind11/stl.h>
+#include "engine_evaluator.h"
+#include "numpy_buffers.h"
+#include "async_evaluation.h"
+#include "evaluation_stats_binding.h"
+
+namespace py = pybind11;
+
+static std::vector<double> coco_iou_thresholds() {
+    std::vector<double> thresholds;
+    for (int i = 0; i < 10; ++i) {
+        thresholds.push_back(0.5 + 0.05 * i);
+    }
+    return thresholds;
+}
+
+PYBIND11_MODULE(engine_evaluator, m) {
+    m.attr("OPENMP_AVAILABLE") = openmp_available();
+    m.attr("POLICIES") = py::make_tuple("auto", "serial", "threads", "openmp");
+
+    // policy and collect_stats are keyword-only, so a second positional string is always the predictions file
+    py::class_<EngineEvaluator>(m, "EngineEvaluator")
+        .def(py::init([](const std::string& ground_truth_json, const std::string& predictions_json, const std::string& policy, bool collect_stats) {
+            ExecutionPolicy checked = parse_execution_policy(policy);  // Fails before the files are read
+            py::gil_scoped_release release;
+            auto* evaluator = new EngineEvaluator(ground_truth_json, predictions_json, collect_stats);
+            evaluator->set_policy(execution_policy_name(checked));
+            return evaluator;
+        }), py::arg("ground_truth_json"), py::arg("predictions_json"), py::kw_only(), py::arg("policy") = "auto",
+            py::arg("collect_stats") = false)
+        .def(py::init([](const std::string& ground_truth_json, const std::string& policy, bool collect_stats) {
+            ExecutionPolicy checked = parse_execution_policy(policy);
+            py::gil_scoped_release release;
+            auto* evaluator = new EngineEvaluator(ground_truth_json, collect_stats);
+            evaluator->set_policy(execution_policy_name(checked));
+            return evaluator;
+        }), py::arg("ground_truth_json"), py::kw_only(), py::arg("policy") = "auto", py::arg("collect_stats") = false)
+        .def(py::init([](const BoxRows& ground_truths, const BoxRows& predictions, const std::string& policy, bool collect_stats) {  // (N, 7) int32 rows, read in place
+            ExecutionPolicy checked = parse_execution_policy(policy);
+            const int* ground_truth_rows = box_rows_data(ground_truths, "ground_truths");
+            const int* prediction_rows = box_rows_data(predictions, "predictions");
+            std::size_t num_ground_truths = ground_truths.shape(0);
+            std::size_t num_predictions = predictions.shape(0);
+            py::gil_scoped_release release;  // The arrays stay alive as arguments of the call
+            auto* evaluator = new EngineEvaluator(ground_truth_rows, num_ground_truths, prediction_rows, num_predictions, collect_stats);
+            evaluator->set_policy(execution_policy_name(checked));
+            return evaluator;
+        }), py::arg("ground_truths"), py::arg("predictions"), py::kw_only(), py::arg("policy") = "auto",
+            py::arg("collect_stats") = false)
+        .def_property("policy", &EngineEvaluator::get_policy, &EngineEvaluator::set_policy)  // auto, serial, threads or openmp
+        .def_property_readonly("last_policy", &EngineEvaluator::get_last_policy)  // What the last evaluation ran with
+        .def_property("num_threads", &EngineEvaluator::get_num_threads, &EngineEvaluator::set_num_threads)  // 0: every hardware thread
+        .def_property("parallel_min_boxes", &EngineEvaluator::get_parallel_min_boxes, &EngineEvaluator::set_parallel_min_boxes)
+        // common.evaluation_stats.EvaluationStats accumulated since construction, None unless collect_stats was set
+        .def_property_readonly("stats", [](const EngineEvaluator& self) { return stats_to_python(self.stats); })
+        .def("evaluate", &EngineEvaluator::evaluate, py::call_guard<py::gil_scoped_release>())
+        .def("evaluate_async", [](py::object self, py::object executor) {  // concurrent.futures.Future of evaluate()
+            return submit_evaluation(self, "evaluate", executor);
+        }, py::arg("executor") = py::none())
+        .def("evaluate_arrays", [](EngineEvaluator& self) {  // Same ids as evaluate, as int32 arrays
+            EvaluationIds result;
+            {
+                py::gil_scoped_release release;
+                result = self.evaluate();
+            }
+            return py::make_tuple(to_numpy(std::move(std::get<0>(result))),
+                                  to_numpy(std::move(std::get<1>(result))),
+                                  to_numpy(std::move(std::get<2>(result))));
+        })
+        .def("evaluate_masks", [](EngineEvaluator& self) {  // Boolean masks in input order: pred_is_tp, gt_is_fn
+            EvaluationMasks masks;
+            {
+                py::gil_scoped_release release;
+                masks = self.evaluate_masks();
+            }
+            return py::make_tuple(mask_to_numpy(std::move(masks.first)), mask_to_numpy(std::move(masks.second)));
+        })
+        // Other prediction sets against the resident ground truth; see common/batch_evaluation.py for many at once
+        .def("evaluate_predictions", &EngineEvaluator::evaluate_predictions,
+             py::arg("predictions_json"), py::call_guard<py::gil_scoped_release>())
+        .def("evaluate_predictions", [](const EngineEvaluator& self, const BoxRows& predictions) {  // (N, 7) int32 rows
+            const int* prediction_rows = box_rows_data(predictions, "predictions");
+            std::size_t num_predictions = predictions.shape(0);
+            py::gil_scoped_release release;
+            return self.evaluate_prediction_rows(prediction_rows, num_predictions);
+        }, py::arg("predictions"))
+        .def("evaluate_thresholds", &EngineEvaluator::evaluate_thresholds,
+             py::arg("iou_thresholds") = coco_iou_thresholds(), py::call_guard<py::gil_scoped_release>())  // COCO 0.50:0.05:0.95 by default
+        .def("best_ious", [](EngineEvaluator& self, double min_iou, double enough_iou) {  // float64 arrays: pred_best_iou, gt_best_iou
+            std::pair<std::vector<double>, std::vector<double>> best;
+            {
+                py::gil_scoped_release release;
+                best = self.best_ious(min_iou, enough_iou);
+            }
+            return py::make_tuple(to_numpy(std::move(best.first)), to_numpy(std::move(best.second)));
+        }, py::arg("min_iou") = 0.5, py::arg("enough_iou") = 1.0);
+}
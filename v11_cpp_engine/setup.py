@@ -0,0 +1,23 @@
+from setuptools import setup, Extension
+import pybind11
+
+# Get the include path for pybind11
+pybind11_include = pybind11.get_include()
+
+# One module for every execution policy; without -fopenmp it still builds, minus the openmp policy
+engine_evaluator = Extension(
+    'engine_evaluator',
+    sources=['engine_evaluator.cpp', 'engine_evaluator_wrapper.cpp'],
+    include_dirs=[pybind11_include, '../common'],  # Include directories (pybind11 and the shared headers)
+    language='c++',
+    extra_compile_args=['-std=c++11', '-fopenmp'],
+    extra_link_args=['-fopenmp'],
+)
+
+setup(
+    name='engine_evaluator',
+    version='0.1',
+    description='C++ evaluator with serial, thread pool and OpenMP execution policies',
+    ext_modules=[engine_evaluator],
+    zip_safe=False,
+)
@@ -1,9 +1,69 @@
-import json
+from array import array
+from bisect import bisect_left
+from heapq import merge
+from itertools import compress
 from pathlib import Path
-from typing import List, Self
+from typing import Dict, Iterable, Iterator, List, Optional, Self, Sequence, Set, Tuple
 
+from common.annotation_loader import AnnotationColumns, iter_annotations
+from common.evaluation_stats import EvaluationStats, phase
 
-class BoundingBox:
+
+class _Box:
+    """
+    Matching methods of a box, shared by BoundingBox and the views of a BoxStore.
+    """
+    __slots__ = ()
+
+    def first_match(self, other_boxes: List[Self], iou_threshold: float = 0.5) -> int:
+        """
+        Finds the first box of the other set, in the same image and category, overlapping this one by at
+        least the IoU threshold.
+        Returns:
+            int: index of the matching box in other_boxes, or -1 if none matches.
+        """
+        for index, other_box in enumerate(other_boxes):
+            if other_box.category_id == self.category_id and other_box.image_id == self.image_id:
+                iou = self.calculate_iou(other_box)
+                if iou >= iou_threshold:
+                    return index
+        return -1
+
+    def is_true_positive_or_false_positive(self, ground_truth_boxes: List[Self], iou_threshold=0.5):
+        """
+        Determines if the prediction bounding-box is a True Positive or False Positive.
+        Returns:
+            bool: whether detection is true positive or false positive
+        """
+        return self.first_match(ground_truth_boxes, iou_threshold) >= 0
+
+    def is_false_negative(self, predicted_boxes: List[Self], iou_threshold: float = 0.5):
+        """
+        Determines if a ground truth bounding-box is a False Negative or not.
+        Returns:
+            bool: whether the bounding-box is a false negative or not.
+        """
+        return self.first_match(predicted_boxes, iou_threshold) < 0
+
+    def calculate_iou(self, other_box: Self):
+        """
+        Calculate Intersection over Union (IoU) between two bounding boxes.
+        """
+        x1_inter = max(self.x1, other_box.x1)
+        y1_inter = max(self.y1, other_box.y1)
+        x2_inter = min(self.x2, other_box.x2)
+        y2_inter = min(self.y2, other_box.y2)
+
+        inter_area = max(0, x2_inter - x1_inter) * max(0, y2_inter - y1_inter)
+
+        box1_area = self.w * self.h
+        box2_area = other_box.w * other_box.h
+
+        iou = inter_area / float(box1_area + box2_area - inter_area)
+        return iou
+
+
+class BoundingBox(_Box):
     """
 
     Attributes:
@@ -22,6 +82,7 @@ class BoundingBox:
 
 
     """
+    __slots__ = ('annotation_id', 'image_id', 'category_id', 'x1', 'y1', 'x2', 'y2', 'w', 'h')
 
     def __init__(self, annotation_id: int, image_id: int, category_id: int, x1: int, y1: int, w: int, h: int):
         """
@@ -46,108 +107,382 @@ class BoundingBox:
         self.x2 = x1 + w
         self.y2 = y1 + h
 
-    def is_true_positive_or_false_positive(self, ground_truth_boxes: List[Self], iou_threshold=0.5):
+
+class BoxView(_Box):
+    """
+    One box of a BoxStore, read from the columns of the store on access. Removing a box moves the last row
+    of the store into its place, so a view is only meant to be used until the store is next edited.
+    """
+    __slots__ = ('store', 'row')
+
+    def __init__(self, store: 'BoxStore', row: int):
+        self.store = store
+        self.row = row
+
+    @property
+    def annotation_id(self) -> int:
+        return self.store.annotation_ids[self.row]
+
+    @property
+    def image_id(self) -> int:
+        return self.store.image_ids[self.row]
+
+    @property
+    def category_id(self) -> int:
+        return self.store.category_ids[self.row]
+
+    @property
+    def x1(self) -> float:
+        return self.store.x1[self.row]
+
+    @property
+    def y1(self) -> float:
+        return self.store.y1[self.row]
+
+    @property
+    def x2(self) -> float:
+        return self.store.x2[self.row]
+
+    @property
+    def y2(self) -> float:
+        return self.store.y2[self.row]
+
+    @property
+    def w(self) -> float:
+        return self.store.w[self.row]
+
+    @property
+    def h(self) -> float:
+        return self.store.h[self.row]
+
+
+def group_key(image_id: int, category_id: int) -> int:
+    """
+    One int64 for the (image_id, category_id) pair of int32 ids.
+    """
+    return (image_id << 32) | (category_id & 0xFFFFFFFF)
+
+
+# Values of BoxStore.state, and bytes.translate tables selecting the rows of one value
+UNMATCHED, MATCHED = 0, 1
+_IS_MATCHED = bytes(int(value == MATCHED) for value in range(256))
+_IS_UNMATCHED = bytes(int(value == UNMATCHED) for value in range(256))
+
+# Marks the place of a removed row in the sorted group index
+_GAP = -1
+
+
+class BoxStore(AnnotationColumns):
+    """
+    Box set held in the columns of AnnotationColumns: about 70 bytes per box with its group index, instead
+    of the few hundred of a BoundingBox object in a list and a group list. Iterating yields BoxView objects;
+    the evaluator reads the columns directly.
+
+    The corners are float64 rather than the float32 of AnnotationColumns, and the widths and heights are
+    kept as given, so every IoU is computed from the same Python floats as with BoundingBox objects: boxes
+    right at the threshold are scored the same.
+
+    Attributes:
+        w (array): float64 width of the bounding-box.
+        h (array): float64 height of the bounding-box.
+        state (array): uint8 per row, UNMATCHED or MATCHED at the last evaluation.
+
+    Rows are grouped by group_key through a sorted index built on first use: the keys of the groups, the
+    start of every group, and the rows ordered by group and then by input order. Boxes appended afterwards
+    go to a per-group overflow. A removed box is swapped with the last row, which then takes its row
+    number, and leaves a gap in the index; the index is rebuilt once the overflow and the gaps pass an
+    eighth of the rows. Removals find their rows through a map of annotation ids, built on the first
+    removal, so editing a few boxes never costs more than the boxes themselves.
+    """
+    __slots__ = ('w', 'h', 'state', '_num_removed', '_num_added', '_group_keys', '_group_starts', '_group_rows', '_added_rows',
+                 '_rows_by_id')
+
+    REBUILD_FRACTION = 8
+    _COLUMNS = ('annotation_ids', 'image_ids', 'category_ids', 'x1', 'y1', 'x2', 'y2', 'w', 'h', 'state')
+
+    def __init__(self, annotations: Iterable[dict] = ()):
+        super().__init__()
+        self.x1, self.y1, self.x2, self.y2 = array('d'), array('d'), array('d'), array('d')
+        self.w, self.h = array('d'), array('d')
+        self._group_rows: Optional[array] = None
+        self._rows_by_id: Optional[Dict[int, int]] = None
+        for annotation in annotations:
+            self._append_columns(annotation)
+        self.state = array('B', bytes(len(self.annotation_ids)))
+
+    def __iter__(self) -> Iterator[BoxView]:
+        for row in range(len(self.state)):
+            yield BoxView(self, row)
+
+    def _append_columns(self, annotation: dict):
+        super().append(annotation)
+        self.w.append(annotation['bbox'][2])
+        self.h.append(annotation['bbox'][3])
+
+    def append(self, annotation: dict):
+        self._append_columns(annotation)
+        self._row_added()
+
+    def append_box(self, box: BoundingBox):
+        self.annotation_ids.append(box.annotation_id)
+        self.image_ids.append(box.image_id)
+        self.category_ids.append(box.category_id)
+        self.x1.append(box.x1)
+        self.y1.append(box.y1)
+        self.x2.append(box.x2)
+        self.y2.append(box.y2)
+        self.w.append(box.w)
+        self.h.append(box.h)
+        self._row_added()
+
+    def _row_added(self):
+        row = len(self.state)
+        self.state.append(UNMATCHED)
+        if self._rows_by_id is not None:
+            self._rows_by_id[self.annotation_ids[row]] = row
+        if self._group_rows is None:
+            return
+        self._added_rows.setdefault(group_key(self.image_ids[row], self.category_ids[row]), []).append(row)
+        self._num_added += 1
+        self._rebuild_if_stale()
+
+    def remove(self, annotation_ids: Set[int]) -> Set[int]:
         """
-        Determines if the prediction bounding-box is a True Positive or False Positive.
+        Removes the box of each of the annotation ids, which are unique within a store.
         Returns:
-            Tuple[bool, int | None]: whether detection is true positive or false positive, and matched_annotation_id
+            Set[int]: group keys of the removed boxes.
         """
-        for gt_box in ground_truth_boxes:
-            if gt_box.category_id == self.category_id and gt_box.image_id == self.image_id:
-                iou = self.calculate_iou(gt_box)
-                if iou >= iou_threshold:
-                    return True
-        return False
+        if self._rows_by_id is None:
+            self._rows_by_id = {annotation_id: row for row, annotation_id in enumerate(self.annotation_ids)}
+        touched = set()
+        for annotation_id in annotation_ids:
+            row = self._rows_by_id.pop(annotation_id, None)
+            if row is None:
+                continue
+            key = group_key(self.image_ids[row], self.category_ids[row])
+            touched.add(key)
+            self._move_in_index(key, row, _GAP)
 
-    def is_false_negative(self, predicted_boxes: List[Self], iou_threshold: float = 0.5):
+            last = len(self.state) - 1
+            if row != last:
+                last_key = group_key(self.image_ids[last], self.category_ids[last])
+                for name in self._COLUMNS:
+                    column = getattr(self, name)
+                    column[row] = column[last]
+                self._rows_by_id[self.annotation_ids[row]] = row
+                self._move_in_index(last_key, last, row)
+            for name in self._COLUMNS:
+                getattr(self, name).pop()
+        self._rebuild_if_stale()
+        return touched
+
+    def _move_in_index(self, key: int, row: int, new_row: int):
         """
-        Determines if a ground truth bounding-box is a False Negative or not.
-        Returns:
-            bool: whether the bounding-box is a false negative or not.
+        Replaces row by new_row in its group of the index, leaving a gap when new_row is _GAP.
         """
-        for pred_box in predicted_boxes:
-            if pred_box.category_id == self.category_id and pred_box.image_id == self.image_id:
-                iou = self.calculate_iou(pred_box)
-                if iou >= iou_threshold:
-                    return False
-        return True
+        if self._group_rows is None:
+            return
+        added = self._added_rows.get(key)
+        if added is not None and row in added:
+            if new_row == _GAP:
+                added.remove(row)
+                self._num_added -= 1
+            else:
+                added[added.index(row)] = new_row
+            return
+        i = bisect_left(self._group_keys, key)
+        position = self._group_rows.index(row, self._group_starts[i], self._group_starts[i + 1])
+        self._group_rows[position] = new_row
+        if new_row == _GAP:
+            self._num_removed += 1
 
-    def calculate_iou(self, other_box: Self):
+    def _rebuild_if_stale(self):
+        if self._group_rows is not None and \
+                (self._num_added + self._num_removed) * self.REBUILD_FRACTION > len(self.state):
+            self.build_index()
+
+    def build_index(self):
         """
-        Calculate Intersection over Union (IoU) between two bounding boxes.
+        Sorts the rows by group, keeping the row order inside each group.
         """
-        x1_inter = max(self.x1, other_box.x1)
-        y1_inter = max(self.y1, other_box.y1)
-        x2_inter = min(self.x2, other_box.x2)
-        y2_inter = min(self.y2, other_box.y2)
+        keys = array('q', map(group_key, self.image_ids, self.category_ids))
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        group_keys, group_starts = array('q'), array('i')
+        previous = None
+        for position, row in enumerate(order):
+            if keys[row] != previous:
+                previous = keys[row]
+                group_keys.append(previous)
+                group_starts.append(position)
+        group_starts.append(len(order))
+        self._group_keys, self._group_starts, self._group_rows = group_keys, group_starts, array('i', order)
+        self._added_rows, self._num_added, self._num_removed = {}, 0, 0
 
-        inter_area = max(0, x2_inter - x1_inter) * max(0, y2_inter - y1_inter)
+    def group_keys(self) -> Iterator[int]:
+        """
+        Keys of every group holding rows, in increasing order.
+        """
+        if self._group_rows is None or self._added_rows:
+            self.build_index()
+        return iter(self._group_keys)
 
-        box1_area = self.w * self.h
-        box2_area = other_box.w * other_box.h
+    def group(self, key: int) -> List[int]:
+        """
+        Rows of the boxes of one group, in row order as of the last index build, then in order of addition.
+        """
+        if self._group_rows is None:
+            self.build_index()
+        rows = []
+        i = bisect_left(self._group_keys, key)
+        if i < len(self._group_keys) and self._group_keys[i] == key:
+            rows = self._group_rows[self._group_starts[i]:self._group_starts[i + 1]].tolist()
+        rows += self._added_rows.get(key, [])
+        if self._num_removed:
+            rows = [row for row in rows if row != _GAP]
+        return rows
 
-        iou = inter_area / float(box1_area + box2_area - inter_area)
-        return iou
+    def corners(self, rows: Sequence[int]) -> List[Tuple[float, float, float, float, float]]:
+        """
+        (x1, y1, x2, y2, area) of the rows, as plain floats for the matching loops.
+        """
+        x1, y1, x2, y2, w, h = self.x1, self.y1, self.x2, self.y2, self.w, self.h
+        return [(x1[row], y1[row], x2[row], y2[row], w[row] * h[row]) for row in rows]
+
+    def annotation_ids_in_state(self, state: int) -> List[int]:
+        """
+        Annotation ids of the rows in one state, in row order.
+        """
+        table = _IS_MATCHED if state == MATCHED else _IS_UNMATCHED
+        return list(compress(self.annotation_ids, bytes(self.state).translate(table)))
+
+
+def _first_match(box: Tuple[float, ...], other_boxes: List[Tuple[float, ...]], iou_threshold: float = 0.5) -> int:
+    """
+    BoundingBox.first_match over (x1, y1, x2, y2, area) tuples of one group.
+    """
+    x1, y1, x2, y2, area = box
+    for index, (other_x1, other_y1, other_x2, other_y2, other_area) in enumerate(other_boxes):
+        inter_area = max(0, min(x2, other_x2) - max(x1, other_x1)) * max(0, min(y2, other_y2) - max(y1, other_y1))
+        if inter_area / float(area + other_area - inter_area) >= iou_threshold:
+            return index
+    return -1
 
 
 class Evaluator:
-    def __init__(self, ground_truth_json: str, predictions_json: str):
+    def __init__(self, ground_truth_json: str, predictions_json: str, collect_stats: bool = False):
         assert Path(ground_truth_json).is_file(), 'ground truth json file not found.'
         assert Path(predictions_json).is_file(), 'prediction json file not found.'
 
-        with open(ground_truth_json) as f:
-            gt_data = json.load(f)
-        with open(predictions_json) as f:
-            pred_data = json.load(f)
-
-        self.ground_truth_boxes = []
-        self.predicted_boxes = []
-
-        for gt in gt_data['annotations']:
-            bb = BoundingBox(
-                annotation_id=gt['annotation_id'],
-                image_id=gt['image_id'],
-                category_id=gt['category_id'],
-                x1=gt['bbox'][0],
-                y1=gt['bbox'][1],
-                w=gt['bbox'][2],
-                h=gt['bbox'][3]
-            )
-            self.ground_truth_boxes.append(bb)
-
-        for pred in pred_data['annotations']:
-            bb = BoundingBox(
-                annotation_id=pred['annotation_id'],
-                image_id=pred['image_id'],
-                category_id=pred['category_id'],
-                x1=pred['bbox'][0],
-                y1=pred['bbox'][1],
-                w=pred['bbox'][2],
-                h=pred['bbox'][3]
-            )
-            self.predicted_boxes.append(bb)
+        self.stats: Optional[EvaluationStats] = EvaluationStats() if collect_stats else None
 
-    def evaluate(self):
+        with phase(self.stats, 'parse'):
+            self.ground_truth_boxes = BoxStore(iter_annotations(ground_truth_json))
+            self.predicted_boxes = BoxStore(iter_annotations(predictions_json))
+
+        # Boxes can only match inside the same (image_id, category_id) group,
+        # so index both sets by that key once and compare group against group.
+        with phase(self.stats, 'index'):
+            self.ground_truth_boxes.build_index()
+            self.predicted_boxes.build_index()
+
+        # Group keys edited since the last evaluate(); None until the first one, which evaluates every group.
+        # The result of every box is kept in the state column of its store.
+        self._dirty_groups: Optional[Set[int]] = None
+
+    def add_ground_truth(self, box: BoundingBox):
+        self.ground_truth_boxes.append_box(box)
+        self._mark_dirty({group_key(box.image_id, box.category_id)})
+
+    def add_prediction(self, box: BoundingBox):
+        self.predicted_boxes.append_box(box)
+        self._mark_dirty({group_key(box.image_id, box.category_id)})
+
+    def remove_ground_truths(self, annotation_ids: Iterable[int]) -> int:
         """
-        Loops through both prediction bboxes and ground truth bboxes, to find
-        False Positives, False Negatives, and True Positives.
+        Removes every ground truth box with one of the annotation ids.
+        Returns:
+            int: number of removed boxes.
+        """
+        return self._remove_boxes(self.ground_truth_boxes, set(annotation_ids))
 
+    def remove_predictions(self, annotation_ids: Iterable[int]) -> int:
+        """
+        Removes every predicted box with one of the annotation ids.
         Returns:
-            Tuple[List[int], List[int], List[int]]
+            int: number of removed boxes.
+        """
+        return self._remove_boxes(self.predicted_boxes, set(annotation_ids))
+
+    def _remove_boxes(self, boxes: BoxStore, annotation_ids: Set[int]) -> int:
+        num_boxes = len(boxes)
+        self._mark_dirty(boxes.remove(annotation_ids))
+        return num_boxes - len(boxes)
+
+    def _mark_dirty(self, keys: Set[int]):
+        if self._dirty_groups is not None:
+            self._dirty_groups |= keys
+
+    def _evaluate_group(self, key: int):
+        ground_truth_rows = self.ground_truth_boxes.group(key)
+        prediction_rows = self.predicted_boxes.group(key)
+        ground_truths = self.ground_truth_boxes.corners(ground_truth_rows)
+        predictions = self.predicted_boxes.corners(prediction_rows)
+        ground_truth_state = self.ground_truth_boxes.state
+        prediction_state = self.predicted_boxes.state
+        num_tp = num_fn = 0
+
+        # Every IoU up to the first match is computed, or all of them when there is none
+        ious = 0
+
+        for row, pred_box in zip(prediction_rows, predictions):
+            match = _first_match(pred_box, ground_truths)
+            if match >= 0:
+                prediction_state[row] = MATCHED
+                num_tp += 1
+                ious += match + 1
+            else:
+                prediction_state[row] = UNMATCHED
+                ious += len(ground_truths)
+
+        for row, gt_box in zip(ground_truth_rows, ground_truths):
+            match = _first_match(gt_box, predictions)
+            if match < 0:
+                ground_truth_state[row] = UNMATCHED
+                num_fn += 1
+                ious += len(predictions)
+            else:
+                ground_truth_state[row] = MATCHED
+                ious += match + 1
+
+        if self.stats is not None:
+            self.stats.add(queries=len(predictions) + len(ground_truths), candidate_pairs=ious,
+                           iou_computations=ious, early_exits=num_tp + len(ground_truths) - num_fn)
+
+    def evaluate(self):
         """
-        tp_ids: List[int] = []
-        fp_ids: List[int] = []
-        fn_ids: List[int] = []
+        Finds the True Positives, False Positives and False Negatives of every (image_id, category_id)
+        group, comparing each box only against the boxes of the other set in its group. Only the groups
+        edited since the previous call are evaluated again; the others keep their results.
 
-        for pred_box in self.predicted_boxes:
-            is_tp = pred_box.is_true_positive_or_false_positive(self.ground_truth_boxes)
-            if is_tp:
-                tp_ids.append(pred_box.annotation_id)
+        Returns:
+            Tuple[List[int], List[int], List[int]]: ids in input order, as long as no box was removed:
+                removing a box moves the last box of its set into its place.
+        """
+        with phase(self.stats, 'match'):
+            if self._dirty_groups is None:
+                keys = merge(self.ground_truth_boxes.group_keys(), self.predicted_boxes.group_keys())
+                self._dirty_groups = set()
             else:
-                fp_ids.append(pred_box.annotation_id)
+                keys, self._dirty_groups = self._dirty_groups, set()
+            previous = None
+            for key in keys:
+                if key != previous:
+                    self._evaluate_group(key)
+                    previous = key
 
-        for gt_box in self.ground_truth_boxes:
-            if gt_box.is_false_negative(self.predicted_boxes):
-                fn_ids.append(gt_box.annotation_id)
+        with phase(self.stats, 'collect'):
+            tp_ids = self.predicted_boxes.annotation_ids_in_state(MATCHED)
+            fp_ids = self.predicted_boxes.annotation_ids_in_state(UNMATCHED)
+            fn_ids = self.ground_truth_boxes.annotation_ids_in_state(UNMATCHED)
 
         return tp_ids, fp_ids, fn_ids
@@ -1,9 +1,11 @@
-from typing import Tuple
-import json
+from typing import NamedTuple, Optional, Tuple
 import numpy as np
-from numba import jit
+from numba import jit, prange
 from time import time
 
+from common.binary_annotations import load_columns
+from common.evaluation_stats import EvaluationStats, phase
+
 
 @jit(nogil=True, nopython=True)
 def calculate_iou(x1, y1, x2, y2, x1_other, y1_other, x2_other, y2_other) -> float:
@@ -24,81 +26,236 @@ def calculate_iou(x1, y1, x2, y2, x1_other, y1_other, x2_other, y2_other) -> flo
 
 
 @jit(nogil=True, nopython=True)
-def is_true_positive_or_false_positive(pred_box, gt_boxes, iou_threshold=0.5) -> bool:
-    for gt_box in gt_boxes:
-        if gt_box[2] == pred_box[2] and gt_box[1] == pred_box[1]:  # Compare category_id and image_id
-            iou = calculate_iou(pred_box[3], pred_box[4], pred_box[5], pred_box[6], gt_box[3], gt_box[4], gt_box[5],
-                                gt_box[6])
+def is_true_positive_or_false_positive(pred_ids, pred_corners, gt_ids, gt_corners, iou_threshold=0.5) -> bool:
+    for j in range(len(gt_ids)):
+        if gt_ids[j, 2] == pred_ids[2] and gt_ids[j, 1] == pred_ids[1]:  # Compare category_id and image_id
+            iou = calculate_iou(pred_corners[0], pred_corners[1], pred_corners[2], pred_corners[3],
+                                gt_corners[j, 0], gt_corners[j, 1], gt_corners[j, 2], gt_corners[j, 3])
             if iou >= iou_threshold:
                 return True
     return False
 
 
 @jit(nogil=True, nopython=True)
-def is_false_negative(gt_box, pred_boxes, iou_threshold=0.5) -> bool:
-    for pred_box in pred_boxes:
-        if pred_box[2] == gt_box[2] and pred_box[1] == gt_box[1]:  # Compare category_id and image_id
-            iou = calculate_iou(
-                gt_box[3], gt_box[4], gt_box[5], gt_box[6], pred_box[3], pred_box[4], pred_box[5], pred_box[6]
-            )
+def is_false_negative(gt_ids, gt_corners, pred_ids, pred_corners, iou_threshold=0.5) -> bool:
+    for j in range(len(pred_ids)):
+        if pred_ids[j, 2] == gt_ids[2] and pred_ids[j, 1] == gt_ids[1]:  # Compare category_id and image_id
+            iou = calculate_iou(gt_corners[0], gt_corners[1], gt_corners[2], gt_corners[3],
+                                pred_corners[j, 0], pred_corners[j, 1], pred_corners[j, 2], pred_corners[j, 3])
             if iou >= iou_threshold:
                 return False
     return True
 
 
-def load_boxes_from_json(json_path: str) -> np.ndarray:
-    with open(json_path) as f:
-        data = json.load(f)
-    return np.array(
-        [(
-            ann['annotation_id'],
-            ann['image_id'], ann['category_id'],
-            ann['bbox'][0],
-            ann['bbox'][1],
-            ann['bbox'][0] + ann['bbox'][2],
-            ann['bbox'][1] + ann['bbox'][3])
-            for ann in data['annotations']],
-        dtype=np.float32
-    )
+class Boxes(NamedTuple):
+    """
+    Boxes of one file as two row-aligned arrays. Ids stay integers: float32 only holds integers up to
+    2 ** 24 exactly, past which distinct ids (and image or category ids) would collide.
+
+    Attributes:
+        ids (np.ndarray): (N, 3) int32 rows of annotation_id, image_id, category_id.
+        corners (np.ndarray): (N, 4) float32 rows of x1, y1, x2, y2.
+    """
+    ids: np.ndarray
+    corners: np.ndarray
+
+
+def load_boxes_from_json(json_path: str) -> Boxes:
+    """
+    Loads the boxes of a json file or of a memory-mapped binary annotation file.
+    """
+    columns = load_columns(json_path)
+    ids = np.empty((len(columns), 3), dtype=np.int32)
+    ids[:, 0] = np.frombuffer(columns.annotation_ids, dtype=np.int32)
+    ids[:, 1] = np.frombuffer(columns.image_ids, dtype=np.int32)
+    ids[:, 2] = np.frombuffer(columns.category_ids, dtype=np.int32)
+    corners = np.empty((len(columns), 4), dtype=np.float32)
+    corners[:, 0] = np.frombuffer(columns.x1, dtype=np.float32)
+    corners[:, 1] = np.frombuffer(columns.y1, dtype=np.float32)
+    corners[:, 2] = np.frombuffer(columns.x2, dtype=np.float32)
+    corners[:, 3] = np.frombuffer(columns.y2, dtype=np.float32)
+    return Boxes(ids, corners)
 
 
 @jit(nogil=True, nopython=True)
-def evaluate(gt_boxes: np.ndarray,
-             pred_boxes: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
-    tp_pred_ids = np.empty(len(pred_boxes), dtype=np.int32)
-    fp_pred_ids = np.empty(len(pred_boxes), dtype=np.int32)
-    fn_gt_ids = np.empty(len(gt_boxes), dtype=np.int32)
+def evaluate(gt_ids: np.ndarray, gt_corners: np.ndarray, pred_ids: np.ndarray,
+             pred_corners: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    tp_pred_ids = np.empty(len(pred_ids), dtype=np.int32)
+    fp_pred_ids = np.empty(len(pred_ids), dtype=np.int32)
+    fn_gt_ids = np.empty(len(gt_ids), dtype=np.int32)
 
     tp_pred_count = 0
     fp_pred_count = 0
     fn_gt_count = 0
 
     # Evaluate predictions
-    for i in range(len(pred_boxes)):
-        pred_box = pred_boxes[i]
-        is_tp = is_true_positive_or_false_positive(pred_box, gt_boxes)
+    for i in range(len(pred_ids)):
+        is_tp = is_true_positive_or_false_positive(pred_ids[i], pred_corners[i], gt_ids, gt_corners)
         if is_tp:
-            tp_pred_ids[tp_pred_count] = pred_box[0]
+            tp_pred_ids[tp_pred_count] = pred_ids[i, 0]
             tp_pred_count += 1
         else:
-            fp_pred_ids[fp_pred_count] = pred_box[0]
+            fp_pred_ids[fp_pred_count] = pred_ids[i, 0]
             fp_pred_count += 1
 
     # Evaluate ground truth for false negatives
-    for i in range(len(gt_boxes)):
-        gt_box = gt_boxes[i]
-        if is_false_negative(gt_box, pred_boxes):
-            fn_gt_ids[fn_gt_count] = gt_box[0]
+    for i in range(len(gt_ids)):
+        if is_false_negative(gt_ids[i], gt_corners[i], pred_ids, pred_corners):
+            fn_gt_ids[fn_gt_count] = gt_ids[i, 0]
             fn_gt_count += 1
 
     return tp_pred_ids[:tp_pred_count], fp_pred_ids[:fp_pred_count], fn_gt_ids[:fn_gt_count]
 
 
+class BoxSegments:
+    """
+    Boxes sorted by (image_id, category_id) and cut into one segment per group, so boxes are only ever
+    compared within a segment. Inside a segment, rows are sorted by x cell (x1 // cell_width, with
+    cell_width the widest box) and then by y1, which bounds the rows that can overlap a query box.
+    Only the corners are kept: the groups are told apart by int64 keys, never by float coordinates.
+    """
+
+    def __init__(self, boxes: Boxes):
+        keys = (boxes.ids[:, 1].astype(np.int64) << 32) | boxes.ids[:, 2].astype(np.int64)
+        corners = boxes.corners
+        widths = corners[:, 2] - corners[:, 0]
+        heights = corners[:, 3] - corners[:, 1]
+        self.cell_width = max(float(widths.max()), 1.0) if len(corners) else 1.0
+        self.max_height = float(heights.max()) if len(corners) else 0.0
+        cells = np.floor(corners[:, 0] / self.cell_width).astype(np.int64)
+
+        self.order = np.lexsort((corners[:, 1], cells, keys))  # position of every sorted row in the input
+        self.corners = np.ascontiguousarray(corners[self.order])
+        self.cells = cells[self.order]
+        self.y1 = np.ascontiguousarray(self.corners[:, 1])
+        keys = keys[self.order]
+
+        # Segment s holds the sorted rows offsets[s]:offsets[s + 1]
+        starts = np.flatnonzero(np.diff(keys)) + 1
+        self.offsets = np.concatenate(([0], starts, [len(keys)] if len(keys) else [])).astype(np.int64)
+        self.keys = keys[self.offsets[:-1]]
+        self.segment_of_row = np.repeat(np.arange(len(self.keys), dtype=np.int64), np.diff(self.offsets))
+
+    def partners(self, other: 'BoxSegments') -> np.ndarray:
+        """
+        Index of the segment of other holding the same group as each segment, -1 if there is none.
+        """
+        if len(other.keys) == 0:
+            return np.full(len(self.keys), -1, dtype=np.int64)
+        partner = np.searchsorted(other.keys, self.keys).clip(max=len(other.keys) - 1)
+        return np.where(other.keys[partner] == self.keys, partner, -1)
+
+    def match(self, other: 'BoxSegments', iou_threshold: float,
+              stats: Optional[EvaluationStats] = None) -> np.ndarray:
+        """
+        Whether each row, in input order, reaches iou_threshold with a row of the same group in other.
+        """
+        matched, ious = match_segments(self.corners, self.segment_of_row, self.partners(other), other.corners,
+                                       other.cells, other.y1, other.offsets, other.cell_width,
+                                       other.max_height, iou_threshold)
+        if stats is not None:
+            # The cell and y1 bisections bound the candidates, so every candidate gets its IoU computed
+            stats.add(queries=len(matched), candidate_pairs=ious, iou_computations=ious,
+                      early_exits=int(matched.sum()))
+        in_input_order = np.empty_like(matched)
+        in_input_order[self.order] = matched
+        return in_input_order
+
+
+@jit(nogil=True, nopython=True)
+def match_range(qx1, qy1, qx2, qy2, other_corners, lo, hi, iou_threshold) -> int:
+    """
+    Index of the first row of lo:hi reaching iou_threshold with the query, hi if there is none.
+    """
+    for j in range(lo, hi):
+        iou = calculate_iou(qx1, qy1, qx2, qy2, other_corners[j, 0], other_corners[j, 1], other_corners[j, 2],
+                            other_corners[j, 3])
+        if iou >= iou_threshold:
+            return j
+    return hi
+
+
+@jit(nogil=True, nopython=True, parallel=True)
+def match_segments(query_corners, query_segment_of_row, partner_segment, other_corners, other_cells, other_y1,
+                   other_offsets, cell_width, max_height, iou_threshold):
+    """
+    Per-row flags of the sorted query rows, see BoxSegments.match, and the number of IoUs computed.
+    Rows are spread over all cores.
+    """
+    matched = np.zeros(len(query_corners), dtype=np.bool_)
+    ious = 0
+    for i in prange(len(query_corners)):
+        partner = partner_segment[query_segment_of_row[i]]
+        if partner < 0:
+            continue
+        lo = other_offsets[partner]
+        hi = other_offsets[partner + 1]
+        qx1, qy1, qx2, qy2 = query_corners[i, 0], query_corners[i, 1], query_corners[i, 2], query_corners[i, 3]
+        if iou_threshold <= 0:
+            found = match_range(qx1, qy1, qx2, qy2, other_corners, lo, hi, iou_threshold)
+            matched[i] = found < hi
+            ious += found - lo + 1 if found < hi else hi - lo
+            continue
+
+        # A box overlapping the query has x1 in (qx1 - cell_width, qx2) and y1 in (qy1 - max_height, qy2)
+        first_cell = np.int64(np.floor((qx1 - cell_width) / cell_width))
+        last_cell = np.int64(np.floor(qx2 / cell_width))
+        cells = other_cells[lo:hi]
+        for cell in range(first_cell, last_cell + 1):
+            cell_lo = lo + np.searchsorted(cells, cell, side='left')
+            cell_hi = lo + np.searchsorted(cells, cell, side='right')
+            if cell_lo == cell_hi:
+                continue
+            y1 = other_y1[cell_lo:cell_hi]
+            start = cell_lo + np.searchsorted(y1, qy1 - max_height, side='right')
+            stop = cell_lo + np.searchsorted(y1, qy2, side='left')
+            found = match_range(qx1, qy1, qx2, qy2, other_corners, start, stop, iou_threshold)
+            if found < stop:
+                ious += found - start + 1
+                matched[i] = True
+                break
+            ious += stop - start
+    return matched, ious
+
+
+def evaluate_parallel(gt_boxes: Boxes, pred_boxes: Boxes, iou_threshold: float = 0.5,
+                      stats: Optional[EvaluationStats] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Parallel counterpart of `evaluate`: rows are grouped into sorted (image_id, category_id) segments, so
+    boxes are never compared across groups, and every row is matched on its own core with a per-row flag.
+    The counters and index/match/collect timings are added to stats when one is given.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: tp prediction ids, fp prediction ids, fn ground truth ids,
+            each in input order.
+    """
+    with phase(stats, 'index'):
+        gt_segments = BoxSegments(gt_boxes)
+        pred_segments = BoxSegments(pred_boxes)
+    with phase(stats, 'match'):
+        pred_is_tp = pred_segments.match(gt_segments, iou_threshold, stats)
+        gt_is_fn = ~gt_segments.match(pred_segments, iou_threshold, stats)
+
+    with phase(stats, 'collect'):
+        pred_ids = pred_boxes.ids[:, 0]
+        return pred_ids[pred_is_tp], pred_ids[~pred_is_tp], gt_boxes.ids[:, 0][gt_is_fn]
+
+
+def warm_up():
+    """
+    Compiles the kernels of evaluate_parallel on a one-box input, so the first real call runs compiled code.
+    Numba compiles on the first call of each signature, which takes seconds next to milliseconds of matching.
+    """
+    boxes = Boxes(np.ones((1, 3), dtype=np.int32), np.array([[0, 0, 1, 1]], dtype=np.float32))
+    evaluate_parallel(boxes, boxes)
+
+
 def measure_jit_evaluator_time(gt_json_path, pred_json_path):
     ground_truth_boxes = load_boxes_from_json(gt_json_path)
     predicted_boxes = load_boxes_from_json(pred_json_path)
+    warm_up()  # Only the evaluation is timed, not the compilation
 
     t1 = time()
-    tp_ids, fp_ids, fn_ids = evaluate(ground_truth_boxes, predicted_boxes)
+    tp_ids, fp_ids, fn_ids = evaluate_parallel(ground_truth_boxes, predicted_boxes)
     t2 = time()
     return t2 - t1, sorted(tp_ids), sorted(fp_ids), sorted(fn_ids)
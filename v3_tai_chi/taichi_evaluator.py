@@ -1,22 +1,51 @@
+import numpy as np
 import taichi as ti
 from pathlib import Path
 from time import time
-import json
+from typing import NamedTuple, Optional, Tuple
 
-ti.init(arch=ti.cpu)
+from common.annotation_loader import AnnotationColumns
+from common.binary_annotations import load_columns
+from common.evaluation_stats import EvaluationStats, phase
 
+_initialized = False
 
-@ti.data_oriented
-def initialize_boxes(annotations, boxes):
-    for i, ann in enumerate(annotations):
-        boxes[i] = [
-            ann['bbox'][0],
-            ann['bbox'][1],
-            ann['bbox'][0] + ann['bbox'][2],
-            ann['bbox'][1] + ann['bbox'][3],
-            ann['category_id'],
-            ann['annotation_id']
-        ]
+
+def init_taichi(**kwargs):
+    """
+    Starts the Taichi runtime on the CPU, with ti.init keyword arguments such as cpu_max_num_threads. The first
+    TaichiEvaluator calls it unless it was called before; calling it again restarts the runtime and drops the
+    fields allocated so far.
+    """
+    global _initialized
+    ti.init(arch=ti.cpu, **kwargs)
+    _initialized = True
+
+
+class Boxes(NamedTuple):
+    """
+    Boxes of one side as two row-aligned arrays. Ids stay integers: float32 only holds integers up to
+    2 ** 24 exactly, past which distinct ids (and image or category ids) would collide.
+
+    Attributes:
+        ids (np.ndarray): (N, 3) int32 rows of annotation_id, image_id, category_id.
+        corners (np.ndarray): (N, 4) float32 rows of x1, y1, x2, y2.
+    """
+    ids: np.ndarray
+    corners: np.ndarray
+
+
+def boxes_from_columns(columns: AnnotationColumns) -> Boxes:
+    ids = np.empty((len(columns), 3), dtype=np.int32)
+    ids[:, 0] = np.frombuffer(columns.annotation_ids, dtype=np.int32)
+    ids[:, 1] = np.frombuffer(columns.image_ids, dtype=np.int32)
+    ids[:, 2] = np.frombuffer(columns.category_ids, dtype=np.int32)
+    corners = np.empty((len(columns), 4), dtype=np.float32)
+    corners[:, 0] = np.frombuffer(columns.x1, dtype=np.float32)
+    corners[:, 1] = np.frombuffer(columns.y1, dtype=np.float32)
+    corners[:, 2] = np.frombuffer(columns.x2, dtype=np.float32)
+    corners[:, 3] = np.frombuffer(columns.y2, dtype=np.float32)
+    return Boxes(ids, corners)
 
 
 @ti.func
@@ -35,69 +64,178 @@ def calculate_iou(box1, box2) -> ti.f32:
 
 
 @ti.kernel
-def evaluate(num_gt_boxes: int, num_pred_boxes: int, gt_boxes: ti.template(), pred_boxes: ti.template(),
-             tp_ids: ti.template(), fp_ids: ti.template(), fn_ids: ti.template()):
-    for i in range(num_pred_boxes):
-        pred_box = pred_boxes[i]
-        is_tp = False
-
-        for j in range(num_gt_boxes):
-            gt_box = gt_boxes[j]
-            if pred_box[4] == gt_box[4]:  # Same category
-                iou = calculate_iou(pred_box, gt_box)
-                if iou >= 0.5:
-                    is_tp = True
-                    break
-
-        if is_tp:
-            tp_ids[i] = pred_box[5]
+def match_ranges(num_boxes: int, boxes: ti.template(), ranges: ti.template(), other_boxes: ti.template(),
+                 matched: ti.template(), iou_threshold: ti.f32):
+    for i in range(num_boxes):
+        box = boxes[i]
+        is_matched = 0
+        for j in range(ranges[i][0], ranges[i][1]):  # Only rows of the same image and category
+            if calculate_iou(box, other_boxes[j]) >= iou_threshold:
+                is_matched = j - ranges[i][0] + 1  # Number of IoUs computed before stopping, never 0
+                break
+        matched[i] = is_matched
+
+
+class _SortedBoxes:
+    """
+    Boxes of one side sorted by (image_id, category_id), then x1. Segment s of the sorted rows, one per
+    (image_id, category_id) group, spans offsets[s]:offsets[s + 1].
+    """
+
+    def __init__(self, boxes: Boxes):
+        keys = (boxes.ids[:, 1].astype(np.int64) << 32) | boxes.ids[:, 2].astype(np.int64)
+        self.order = np.lexsort((boxes.corners[:, 0], keys))
+        self.corners = boxes.corners[self.order]
+        keys = keys[self.order]
+
+        starts = np.flatnonzero(np.diff(keys)) + 1
+        self.offsets = np.concatenate(([0], starts, [len(keys)] if len(keys) else [])).astype(np.int64)
+        self.keys = keys[self.offsets[:-1]]
+        self.segment_of_row = np.repeat(np.arange(len(self.keys)), np.diff(self.offsets))
+        self.max_width = float((self.corners[:, 2] - self.corners[:, 0]).max()) if len(keys) else 0.0
+
+    def candidate_ranges(self, other: '_SortedBoxes', iou_threshold: float) -> np.ndarray:
+        """
+        For every sorted row, the [begin, end) rows of other that share its group and, for a positive
+        threshold, whose x1 lies in (x1 - widest box of other, x2), the only ones that can overlap it.
+        """
+        ranges = np.zeros((len(self.corners), 2), dtype=np.int32)
+        if len(other.keys) == 0 or len(self.corners) == 0:
+            return ranges
+        partner = np.searchsorted(other.keys, self.keys).clip(max=len(other.keys) - 1)
+        partner = np.where(other.keys[partner] == self.keys, partner, -1)[self.segment_of_row]
+        has_partner = partner >= 0
+        partner = partner.clip(min=0)
+        if iou_threshold <= 0:
+            ranges[:, 0] = other.offsets[partner]
+            ranges[:, 1] = other.offsets[partner + 1]
         else:
-            fp_ids[i] = pred_box[5]
-
-    for j in range(num_gt_boxes):
-        gt_box = gt_boxes[j]
-        is_fn = True
-
-        for i in range(num_pred_boxes):
-            pred_box = pred_boxes[i]
-            if pred_box[4] == gt_box[4]:  # Same category
-                iou = calculate_iou(pred_box, gt_box)
-                if iou >= 0.5:
-                    is_fn = False
-                    break
-
-        if is_fn:
-            fn_ids[j] = gt_box[5]
+            # Rows of other are sorted by (segment, x1), so segment * span + x1 is sorted too
+            low = min(self.corners[:, 0].min(), other.corners[:, 0].min()) - other.max_width
+            span = max(self.corners[:, 2].max(), other.corners[:, 2].max()) - low + 1.0
+            other_position = other.segment_of_row * span + (other.corners[:, 0] - low)
+            base = partner * span - low
+            ranges[:, 0] = np.searchsorted(other_position, base + self.corners[:, 0] - other.max_width,
+                                           side='right')
+            ranges[:, 1] = np.searchsorted(other_position, base + self.corners[:, 2], side='left')
+        ranges[~has_partner] = 0
+        return ranges
+
+    def in_input_order(self, flags: np.ndarray) -> np.ndarray:
+        unsorted = np.empty_like(flags)
+        unsorted[self.order] = flags
+        return unsorted
+
+
+class _SideFields:
+    """
+    Taichi fields of one side, allocated in their own SNode tree and only reallocated (to the next power
+    of two) when a call brings more rows than they hold. The numpy staging arrays match their shapes.
+    """
+
+    def __init__(self):
+        self.capacity = 0
+        self.tree = None
+
+    def load(self, boxes: np.ndarray, ranges: np.ndarray):
+        num_boxes = len(boxes)
+        if self.tree is None or num_boxes > self.capacity:
+            self.allocate(1 << max(num_boxes - 1, 0).bit_length())
+        self.box_staging[:num_boxes] = boxes
+        self.range_staging[:num_boxes] = ranges
+        self.range_staging[num_boxes:] = 0
+        self.boxes.from_numpy(self.box_staging)
+        self.ranges.from_numpy(self.range_staging)
+
+    def matched_counts(self, num_boxes: int) -> np.ndarray:
+        """
+        Per sorted row, the number of IoUs computed up to its match, 0 when it has none.
+        """
+        return self.matched.to_numpy()[:num_boxes]
+
+    def allocate(self, capacity: int):
+        if self.tree is not None:
+            self.tree.destroy()
+        builder = ti.FieldsBuilder()
+        self.boxes = ti.Vector.field(4, dtype=ti.f32)
+        self.ranges = ti.Vector.field(2, dtype=ti.i32)
+        self.matched = ti.field(dtype=ti.i32)
+        builder.dense(ti.i, capacity).place(self.boxes, self.ranges, self.matched)
+        self.tree = builder.finalize()
+        self.capacity = capacity
+        self.box_staging = np.zeros((capacity, 4), dtype=np.float32)
+        self.range_staging = np.zeros((capacity, 2), dtype=np.int32)
+
+
+class TaichiEvaluator:
+    """
+    Reusable Taichi engine: the fields stay allocated between calls and are filled with bulk from_numpy
+    loads. Rows are sorted into (image_id, category_id) segments beforehand, so every kernel thread only
+    scans the candidates of its own group.
+    """
+
+    def __init__(self, collect_stats: bool = False):
+        if not _initialized:
+            init_taichi()
+        self.ground_truth_fields = _SideFields()
+        self.predicted_fields = _SideFields()
+        self.stats: Optional[EvaluationStats] = EvaluationStats() if collect_stats else None
+
+    def evaluate(self, gt_boxes: Boxes, pred_boxes: Boxes,
+                 iou_threshold: float = 0.5) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Args:
+            gt_boxes, pred_boxes: boxes of each side, see boxes_from_columns.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: tp prediction ids, fp prediction ids, fn ground truth
+                ids as compact int32 arrays, each in input order.
+        """
+        gt_fields, pred_fields = self.ground_truth_fields, self.predicted_fields
+        with phase(self.stats, 'index'):
+            gt_sorted = _SortedBoxes(gt_boxes)
+            pred_sorted = _SortedBoxes(pred_boxes)
+            gt_ranges = gt_sorted.candidate_ranges(pred_sorted, iou_threshold)
+            pred_ranges = pred_sorted.candidate_ranges(gt_sorted, iou_threshold)
+            gt_fields.load(gt_sorted.corners, gt_ranges)
+            pred_fields.load(pred_sorted.corners, pred_ranges)
+
+        with phase(self.stats, 'match'):
+            match_ranges(len(pred_sorted.corners), pred_fields.boxes, pred_fields.ranges, gt_fields.boxes,
+                         pred_fields.matched, iou_threshold)
+            match_ranges(len(gt_sorted.corners), gt_fields.boxes, gt_fields.ranges, pred_fields.boxes, gt_fields.matched,
+                         iou_threshold)
+            pred_counts = pred_fields.matched_counts(len(pred_sorted.corners))
+            gt_counts = gt_fields.matched_counts(len(gt_sorted.corners))
+
+        with phase(self.stats, 'collect'):
+            pred_is_tp = pred_sorted.in_input_order(pred_counts != 0)
+            gt_is_fn = ~gt_sorted.in_input_order(gt_counts != 0)
+            pred_ids, gt_ids = pred_boxes.ids[:, 0], gt_boxes.ids[:, 0]
+            results = pred_ids[pred_is_tp], pred_ids[~pred_is_tp], gt_ids[gt_is_fn]
+
+        if self.stats is not None:
+            for counts, ranges in ((pred_counts, pred_ranges), (gt_counts, gt_ranges)):
+                # Rows stop at their match; the others compute the IoU of their whole range
+                ious = int(np.where(counts != 0, counts, ranges[:, 1] - ranges[:, 0]).sum())
+                self.stats.add(queries=len(counts), candidate_pairs=ious, iou_computations=ious,
+                               early_exits=int(np.count_nonzero(counts)))
+        return results
 
 
 def taichi_evaluate(ground_truth_json: str, predictions_json: str):
     assert Path(ground_truth_json).is_file(), 'Ground truth JSON file not found.'
     assert Path(predictions_json).is_file(), 'Prediction JSON file not found.'
 
-    with open(ground_truth_json) as f:
-        ground_truth_data = json.load(f)
-    with open(predictions_json) as f:
-        predictions_data = json.load(f)
-
-    num_gt_boxes = len(ground_truth_data['annotations'])
-    num_pred_boxes = len(predictions_data['annotations'])
+    gt_boxes = boxes_from_columns(load_columns(ground_truth_json))
+    pred_boxes = boxes_from_columns(load_columns(predictions_json))
 
     t1 = time()
-    gt_boxes = ti.Vector.field(6, dtype=ti.i32, shape=num_gt_boxes)
-    pred_boxes = ti.Vector.field(6, dtype=ti.i32, shape=num_pred_boxes)
-    tp_ids = ti.field(dtype=ti.i32, shape=num_pred_boxes)
-    fp_ids = ti.field(dtype=ti.i32, shape=num_pred_boxes)
-    fn_ids = ti.field(dtype=ti.i32, shape=num_gt_boxes)
-    initialize_boxes(ground_truth_data['annotations'], gt_boxes)
-    initialize_boxes(predictions_data['annotations'], pred_boxes)
-    evaluate(num_gt_boxes, num_pred_boxes, gt_boxes, pred_boxes, tp_ids, fp_ids, fn_ids)
+    tp_ids, fp_ids, fn_ids = TaichiEvaluator().evaluate(gt_boxes, pred_boxes)
     t2 = time()
-    return t2 - t1, tp_ids.to_numpy(), fp_ids.to_numpy(), fn_ids.to_numpy()
+    return t2 - t1, tp_ids, fp_ids, fn_ids
 
 
 def measure_taichi_evaluator_time(gt_json_path, pred_json_path):
     elapsed_time, tp_ids, fp_ids, fn_ids = taichi_evaluate(gt_json_path, pred_json_path)
-    tp_ids = [tp for tp in tp_ids if tp != 0]
-    fp_ids = [fp for fp in fp_ids if fp != 0]
-    fn_ids = [fn for fn in fn_ids if fn != 0]
     return elapsed_time, sorted(tp_ids), sorted(fp_ids), sorted(fn_ids)
@@ -1,8 +1,12 @@
-import json
 import numpy as np
 cimport cython
 
+from common.binary_annotations import load_columns
+from common.evaluation_stats import EvaluationStats, phase
 
+
+# Immutable: evaluate() compares every pair of boxes, so there are no per-group results an edit could keep.
+# Evaluators with add_* / remove_* are v1's Evaluator, CppEvaluator and SharedMutexParallelCppEvaluator.
 @cython.boundscheck(False)  # Turn off bounds-checking for performance
 @cython.wraparound(False)   # Turn off negative index wraparound for performance
 cdef class Evaluator:
@@ -10,38 +14,51 @@ cdef class Evaluator:
     cdef float[:, :] predicted_boxes
     cdef int[:] gt_annotation_ids
     cdef int[:] pred_annotation_ids
+    cdef readonly object stats
+    # Pairs of the current evaluate() skipped for their image or category, and IoUs it computed
+    cdef unsigned long long filtered_pairs
+    cdef unsigned long long iou_computations
 
-    def __init__(self, str ground_truth_json, str predictions_json):
+    def __init__(self, str ground_truth_json, str predictions_json, bint collect_stats=False):
         cdef int num_gt, num_pred
 
-        with open(ground_truth_json, 'r') as f:
-            ground_truth_data = json.load(f)
-        with open(predictions_json, 'r') as f:
-            predictions_data = json.load(f)
+        self.stats = EvaluationStats() if collect_stats else None
+
+        with phase(self.stats, 'parse'):
+            ground_truth_data = load_columns(ground_truth_json)
+            predictions_data = load_columns(predictions_json)
 
-        num_gt = len(ground_truth_data['annotations'])
-        num_pred = len(predictions_data['annotations'])
+        num_gt = len(ground_truth_data)
+        num_pred = len(predictions_data)
 
-        self.ground_truth_boxes = np.zeros((num_gt, 8), dtype=np.float32)
-        self.predicted_boxes = np.zeros((num_pred, 8), dtype=np.float32)
-        self.gt_annotation_ids = np.zeros(num_gt, dtype=np.int32)
-        self.pred_annotation_ids = np.zeros(num_pred, dtype=np.int32)
+        with phase(self.stats, 'index'):
+            self.ground_truth_boxes = np.zeros((num_gt, 8), dtype=np.float32)
+            self.predicted_boxes = np.zeros((num_pred, 8), dtype=np.float32)
+            self.gt_annotation_ids = np.zeros(num_gt, dtype=np.int32)
+            self.pred_annotation_ids = np.zeros(num_pred, dtype=np.int32)
 
-        self._initialize_boxes(self.ground_truth_boxes, self.gt_annotation_ids, ground_truth_data['annotations'])
-        self._initialize_boxes(self.predicted_boxes, self.pred_annotation_ids, predictions_data['annotations'])
+            self._initialize_boxes(self.ground_truth_boxes, self.gt_annotation_ids, ground_truth_data)
+            self._initialize_boxes(self.predicted_boxes, self.pred_annotation_ids, predictions_data)
 
-    cdef void _initialize_boxes(self, float[:, :] boxes, int[:] annotation_ids, list data):
+    cdef void _initialize_boxes(self, float[:, :] boxes, int[:] annotation_ids, columns):
         cdef int i
+        cdef const int[:] ids = columns.annotation_ids
+        cdef const int[:] image_ids = columns.image_ids
+        cdef const int[:] category_ids = columns.category_ids
+        cdef const float[:] x1 = columns.x1
+        cdef const float[:] y1 = columns.y1
+        cdef const float[:] x2 = columns.x2
+        cdef const float[:] y2 = columns.y2
         for i in range(boxes.shape[0]):
-            annotation_ids[i] = data[i]['annotation_id']
-            boxes[i, 0] = data[i]['image_id']
-            boxes[i, 1] = data[i]['category_id']
-            boxes[i, 2] = data[i]['bbox'][0]
-            boxes[i, 3] = data[i]['bbox'][1]
-            boxes[i, 4] = data[i]['bbox'][0] + data[i]['bbox'][2]
-            boxes[i, 5] = data[i]['bbox'][1] + data[i]['bbox'][3]
-            boxes[i, 6] = data[i]['bbox'][2]
-            boxes[i, 7] = data[i]['bbox'][3]
+            annotation_ids[i] = ids[i]
+            boxes[i, 0] = image_ids[i]
+            boxes[i, 1] = category_ids[i]
+            boxes[i, 2] = x1[i]
+            boxes[i, 3] = y1[i]
+            boxes[i, 4] = x2[i]
+            boxes[i, 5] = y2[i]
+            boxes[i, 6] = x2[i] - x1[i]
+            boxes[i, 7] = y2[i] - y1[i]
 
     cpdef tuple evaluate(self):
         cdef list tp_pred_ids = []
@@ -52,17 +69,27 @@ cdef class Evaluator:
         cdef float iou
         cdef bint is_tp
 
-        for i in range(self.predicted_boxes.shape[0]):
-            is_tp = self._is_true_positive_or_false_positive(self.predicted_boxes[i, :], self.ground_truth_boxes)
-            if is_tp:
-                tp_pred_ids.append(self.pred_annotation_ids[i])
-            else:
-                fp_pred_ids.append(self.pred_annotation_ids[i])
-
-        for i in range(self.ground_truth_boxes.shape[0]):
-            if self._is_false_negative(self.ground_truth_boxes[i, :], self.predicted_boxes):
-                fn_gt_ids.append(self.gt_annotation_ids[i])
-
+        self.filtered_pairs = 0
+        self.iou_computations = 0
+
+        with phase(self.stats, 'match'):
+            for i in range(self.predicted_boxes.shape[0]):
+                is_tp = self._is_true_positive_or_false_positive(self.predicted_boxes[i, :],
+                                                                 self.ground_truth_boxes)
+                if is_tp:
+                    tp_pred_ids.append(self.pred_annotation_ids[i])
+                else:
+                    fp_pred_ids.append(self.pred_annotation_ids[i])
+
+            for i in range(self.ground_truth_boxes.shape[0]):
+                if self._is_false_negative(self.ground_truth_boxes[i, :], self.predicted_boxes):
+                    fn_gt_ids.append(self.gt_annotation_ids[i])
+
+        if self.stats is not None:
+            self.stats.add(queries=self.predicted_boxes.shape[0] + self.ground_truth_boxes.shape[0],
+                           filtered_pairs=self.filtered_pairs, candidate_pairs=self.iou_computations,
+                           iou_computations=self.iou_computations,
+                           early_exits=len(tp_pred_ids) + self.ground_truth_boxes.shape[0] - len(fn_gt_ids))
         return tp_pred_ids, fp_pred_ids, fn_gt_ids
 
     cdef tuple _is_true_positive_or_false_positive(self, float[:] pred_box, float[:, :] ground_truth_boxes, float iou_threshold=0.5):
@@ -71,9 +98,12 @@ cdef class Evaluator:
 
         for i in range(ground_truth_boxes.shape[0]):
             if ground_truth_boxes[i, 1] == pred_box[1] and ground_truth_boxes[i, 0] == pred_box[0]:
+                self.iou_computations += 1
                 iou = self._calculate_iou(pred_box, ground_truth_boxes[i, :])
                 if iou >= iou_threshold:
                     return True
+            else:
+                self.filtered_pairs += 1
         return False
 
     cdef bint _is_false_negative(self, float[:] gt_box, float[:, :] predicted_boxes, float iou_threshold=0.5):
@@ -82,9 +112,12 @@ cdef class Evaluator:
 
         for i in range(predicted_boxes.shape[0]):
             if predicted_boxes[i, 1] == gt_box[1] and predicted_boxes[i, 0] == gt_box[0]:
+                self.iou_computations += 1
                 iou = self._calculate_iou(gt_box, predicted_boxes[i, :])
                 if iou >= iou_threshold:
                     return False
+            else:
+                self.filtered_pairs += 1
         return True
 
     cdef float _calculate_iou(self, float[:] box1, float[:] box2):
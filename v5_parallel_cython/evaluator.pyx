@@ -1,137 +1,277 @@
-import json
 cimport cython
 from cython.parallel import prange
-from cython.view cimport array
+from libc.math cimport floorf
+from libc.stdlib cimport free, malloc, qsort
 import numpy as np
-cimport numpy as np
 
-np.import_array()
+from common.binary_annotations import load_columns
+from common.evaluation_stats import EvaluationStats, phase
+
+
+cdef struct Box:
+    int annotation_id
+    int image_id
+    int category_id
+    int cell      # x1 // cell_width of its set
+    int segment   # index of its (image_id, category_id) segment
+    int index     # position in the input
+    float x1
+    float y1
+    float x2
+    float y2
+    float area
+
+
+# Boxes of one file sorted by (image_id, category_id, cell, y1). Segment s, one per (image_id, category_id)
+# group, spans boxes[offsets[s]:offsets[s + 1]] and partners[s] is the segment of the same group in the
+# other set, or -1. Within a segment a box can only overlap boxes of its own and the neighbouring cells.
+cdef struct BoxSet:
+    Box* boxes
+    Py_ssize_t size
+    Py_ssize_t* offsets
+    Py_ssize_t* partners
+    Py_ssize_t num_segments
+    float cell_width  # widest box of the set
+    float max_height
+
+
+cdef int _compare_boxes(const void* a, const void* b) noexcept nogil:
+    cdef const Box* p = <const Box*> a
+    cdef const Box* q = <const Box*> b
+    if p.image_id != q.image_id:
+        return -1 if p.image_id < q.image_id else 1
+    if p.category_id != q.category_id:
+        return -1 if p.category_id < q.category_id else 1
+    if p.cell != q.cell:
+        return -1 if p.cell < q.cell else 1
+    if p.y1 != q.y1:
+        return -1 if p.y1 < q.y1 else 1
+    return 0
+
+
+cdef inline int _compare_groups(const Box* p, const Box* q) noexcept nogil:
+    if p.image_id != q.image_id:
+        return -1 if p.image_id < q.image_id else 1
+    if p.category_id != q.category_id:
+        return -1 if p.category_id < q.category_id else 1
+    return 0
+
+
+cdef inline float _calculate_iou(const Box* box1, const Box* box2) noexcept nogil:
+    cdef float x1_inter = max(box1.x1, box2.x1)
+    cdef float y1_inter = max(box1.y1, box2.y1)
+    cdef float x2_inter = min(box1.x2, box2.x2)
+    cdef float y2_inter = min(box1.y2, box2.y2)
+
+    cdef float inter_area = max(<float> 0, x2_inter - x1_inter) * max(<float> 0, y2_inter - y1_inter)
+    return inter_area / (box1.area + box2.area - inter_area)
+
+
+cdef inline Py_ssize_t _first_in_cell(const Box* boxes, Py_ssize_t lo, Py_ssize_t hi, int cell) noexcept nogil:
+    # First index in [lo, hi) whose cell is >= cell
+    cdef Py_ssize_t mid
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if boxes[mid].cell < cell:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+cdef inline Py_ssize_t _first_below(const Box* boxes, Py_ssize_t lo, Py_ssize_t hi, float y1) noexcept nogil:
+    # First index in [lo, hi) whose y1 is > y1
+    cdef Py_ssize_t mid
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if boxes[mid].y1 <= y1:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.cdivision(True)
+cdef bint _has_match(const Box* query, Py_ssize_t partner, const BoxSet* other, float iou_threshold,
+                     Py_ssize_t* ious) noexcept nogil:
+    # Whether a box of segment partner of other reaches iou_threshold with query; adds the IoUs computed to ious
+    cdef Py_ssize_t begin, end, lo, hi, j
+    cdef int cell, first_cell, last_cell
+    if partner < 0:
+        return False
+    begin = other.offsets[partner]
+    end = other.offsets[partner + 1]
+
+    if iou_threshold <= 0:
+        for j in range(begin, end):
+            ious[0] += 1
+            if _calculate_iou(query, &other.boxes[j]) >= iou_threshold:
+                return True
+        return False
+
+    # An overlapping box has x1 in (x1 - cell_width, x2) and y1 in (y1 - max_height, y2)
+    first_cell = <int> floorf((query.x1 - other.cell_width) / other.cell_width)
+    last_cell = <int> floorf(query.x2 / other.cell_width)
+    lo = _first_in_cell(other.boxes, begin, end, first_cell)
+    for cell in range(first_cell, last_cell + 1):
+        hi = _first_in_cell(other.boxes, lo, end, cell + 1)
+        j = _first_below(other.boxes, lo, hi, query.y1 - other.max_height)
+        while j < hi and other.boxes[j].y1 < query.y2:
+            ious[0] += 1
+            if _calculate_iou(query, &other.boxes[j]) >= iou_threshold:
+                return True
+            j += 1
+        lo = hi
+    return False
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef Py_ssize_t _match_all(const BoxSet* query, const BoxSet* other, unsigned char* matched,
+                           float iou_threshold) noexcept nogil:
+    # matched[i] of the box at input position i; every thread only reads the two sets. Returns the number
+    # of IoUs computed, summed over the threads by the prange reduction.
+    cdef Py_ssize_t i, row_ious, total_ious = 0
+    for i in prange(query.size, schedule='guided'):
+        row_ious = 0
+        matched[query.boxes[i].index] = _has_match(&query.boxes[i], query.partners[query.boxes[i].segment], other,
+                                                   iou_threshold, &row_ious)
+        total_ious += row_ious
+    return total_ious
+
+
+cdef void _link_segments(BoxSet* first, BoxSet* second) noexcept nogil:
+    # Both segment lists are sorted by (image_id, category_id), so one merge pairs them up
+    cdef Py_ssize_t s = 0, t = 0
+    cdef int order
+    for s in range(first.num_segments):
+        first.partners[s] = -1
+    for t in range(second.num_segments):
+        second.partners[t] = -1
+    s = 0
+    t = 0
+    while s < first.num_segments and t < second.num_segments:
+        order = _compare_groups(&first.boxes[first.offsets[s]], &second.boxes[second.offsets[t]])
+        if order == 0:
+            first.partners[s] = t
+            second.partners[t] = s
+            s += 1
+            t += 1
+        elif order < 0:
+            s += 1
+        else:
+            t += 1
+
+
+cdef void _free_boxes(BoxSet* box_set) noexcept:
+    free(box_set.boxes)
+    free(box_set.offsets)
+    free(box_set.partners)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
 cdef class Evaluator:
-    cdef float[:, :] ground_truth_boxes
-    cdef float[:, :] predicted_boxes
-    cdef float[:] gt_annotation_ids
-    cdef float[:] pred_annotation_ids
-
-    __slots__ = ["ground_truth_boxes", "predicted_boxes", "gt_annotation_ids", "pred_annotation_ids"]
-
-    def __init__(self, str ground_truth_json, str predictions_json):
-        cdef int num_gt, num_pred
-
-        with open(ground_truth_json, 'r') as f:
-            ground_truth_data = json.load(f)
-        with open(predictions_json, 'r') as f:
-            predictions_data = json.load(f)
-
-        num_gt = len(ground_truth_data['annotations'])
-        num_pred = len(predictions_data['annotations'])
-
-        # Initialize memoryviews
-        self.ground_truth_boxes = self._create_array(num_gt, 8)
-        self.predicted_boxes = self._create_array(num_pred, 8)
-        self.gt_annotation_ids = self._create_float_array(num_gt)
-        self.pred_annotation_ids = self._create_float_array(num_pred)
-
-        # Populate memoryviews
-        self._initialize_boxes(self.ground_truth_boxes, self.gt_annotation_ids, ground_truth_data['annotations'])
-        self._initialize_boxes(self.predicted_boxes, self.pred_annotation_ids, predictions_data['annotations'])
-
-    cdef float[:, :] _create_array(self, int rows, int cols):
-        cdef float[:, :] arr = array(shape=(rows, cols), itemsize=sizeof(float), format='f')
-        return arr
-
-    cdef float[:] _create_float_array(self, int length):
-        cdef float[:] arr = array(shape=(length,), itemsize=sizeof(float), format='f')
-        return arr
-
-    cdef void _initialize_boxes(self, float[:, :] boxes, float[:] annotation_ids, list data):
-        cdef int i
-        for i in range(len(data)):
-            annotation_ids[i] = data[i]['annotation_id']
-            boxes[i, 0] = data[i]['image_id']
-            boxes[i, 1] = data[i]['category_id']
-            boxes[i, 2] = data[i]['bbox'][0]
-            boxes[i, 3] = data[i]['bbox'][1]
-            boxes[i, 4] = data[i]['bbox'][0] + data[i]['bbox'][2]
-            boxes[i, 5] = data[i]['bbox'][1] + data[i]['bbox'][3]
-            boxes[i, 6] = data[i]['bbox'][2]
-            boxes[i, 7] = data[i]['bbox'][3]
-
-    cpdef tuple evaluate(self):
-        cdef int i, n_pred, n_gt
-        cdef int tp_pred_index = 0
-        cdef int fp_pred_index = 0
-        cdef int fn_gt_index = 0
-
-        n_pred = self.predicted_boxes.shape[0]
-        n_gt = self.ground_truth_boxes.shape[0]
-
-        # Initialize results with maximum length
-        cdef float[:] tp_pred_ids = self._create_float_array(n_pred)
-        cdef float[:] fp_pred_ids = self._create_float_array(n_pred)
-        cdef float[:] fn_gt_ids = self._create_float_array(n_gt)
-        cdef float output
-
-        # Allocate thread-local storage for each thread
-        cdef int[:] tp_pred_thread_ids = np.zeros(n_pred, dtype=np.int32)
-        cdef int[:] fp_pred_thread_ids = np.zeros(n_pred, dtype=np.int32)
-        cdef int[:] fn_gt_thread_ids = np.zeros(n_gt, dtype=np.int32)
-
-        # Parallelize the computation using prange
-        with nogil, cython.parallel.parallel():
-            for i in prange(n_pred, schedule='dynamic'):
-                output = self._is_true_positive_or_false_positive(self.predicted_boxes[i], self.ground_truth_boxes)
-                if output:
-                    # Each thread works on its own slice of the array
-                    tp_pred_thread_ids[i] = 1  # Mark as true positive
-                else:
-                    fp_pred_thread_ids[i] = 1  # Mark as false positive
-
-            # Process ground truth boxes
-            for i in prange(n_gt, schedule='dynamic'):
-                if self._is_false_negative(self.ground_truth_boxes[i], self.predicted_boxes):
-                    fn_gt_thread_ids[i] = 1  # Mark as false negative
-
-        # After the parallel block, process the results
-        tp_pred_list = [self.pred_annotation_ids[i] for i in range(n_pred) if tp_pred_thread_ids[i]]
-        fp_pred_list = [self.pred_annotation_ids[i] for i in range(n_pred) if fp_pred_thread_ids[i]]
-        fn_gt_list = [self.gt_annotation_ids[i] for i in range(n_gt) if fn_gt_thread_ids[i]]
+    cdef BoxSet ground_truths
+    cdef BoxSet predictions
+    cdef object gt_annotation_ids
+    cdef object pred_annotation_ids
+    cdef readonly object stats
 
-        return tp_pred_list, fp_pred_list, fn_gt_list
+    def __cinit__(self):
+        self.ground_truths.boxes = NULL
+        self.ground_truths.offsets = NULL
+        self.ground_truths.partners = NULL
+        self.predictions.boxes = NULL
+        self.predictions.offsets = NULL
+        self.predictions.partners = NULL
 
-    cdef bint _is_true_positive_or_false_positive(self, float[:] pred_box, float[:, :] ground_truth_boxes, float iou_threshold=0.5) nogil:
-        cdef int i
-        cdef float iou
+    def __init__(self, str ground_truth_json, str predictions_json, bint collect_stats=False):
+        self.stats = EvaluationStats() if collect_stats else None
 
-        for i in range(ground_truth_boxes.shape[0]):
-            if ground_truth_boxes[i, 1] == pred_box[1] and ground_truth_boxes[i, 0] == pred_box[0]:
-                iou = self._calculate_iou(pred_box, ground_truth_boxes[i])
-                if iou >= iou_threshold:
-                    return True
-        return False
+        with phase(self.stats, 'parse'):
+            ground_truth_data = load_columns(ground_truth_json)
+            predictions_data = load_columns(predictions_json)
+
+        with phase(self.stats, 'index'):
+            self.gt_annotation_ids = np.array(ground_truth_data.annotation_ids, dtype=np.int32)
+            self.pred_annotation_ids = np.array(predictions_data.annotation_ids, dtype=np.int32)
+            self._initialize_boxes(&self.ground_truths, ground_truth_data)
+            self._initialize_boxes(&self.predictions, predictions_data)
+            with nogil:
+                _link_segments(&self.ground_truths, &self.predictions)
+
+    def __dealloc__(self):
+        _free_boxes(&self.ground_truths)
+        _free_boxes(&self.predictions)
 
-    cdef bint _is_false_negative(self, float[:] gt_box, float[:, :] predicted_boxes, float iou_threshold=0.5) nogil:
-        cdef int i
-        cdef float iou
+    cdef void _initialize_boxes(self, BoxSet* box_set, columns) except *:
+        cdef Py_ssize_t i, n = len(columns)
+        cdef const int[:] ids = columns.annotation_ids
+        cdef const int[:] image_ids = columns.image_ids
+        cdef const int[:] category_ids = columns.category_ids
+        cdef const float[:] x1 = columns.x1
+        cdef const float[:] y1 = columns.y1
+        cdef const float[:] x2 = columns.x2
+        cdef const float[:] y2 = columns.y2
 
-        for i in range(predicted_boxes.shape[0]):
-            if predicted_boxes[i, 1] == gt_box[1] and predicted_boxes[i, 0] == gt_box[0]:
-                iou = self._calculate_iou(gt_box, predicted_boxes[i])
-                if iou >= iou_threshold:
-                    return False
-        return True
+        box_set.size = n
+        box_set.boxes = <Box*> malloc(max(n, 1) * sizeof(Box))
+        box_set.offsets = <Py_ssize_t*> malloc((n + 1) * sizeof(Py_ssize_t))
+        box_set.partners = <Py_ssize_t*> malloc(max(n, 1) * sizeof(Py_ssize_t))
+        if box_set.boxes == NULL or box_set.offsets == NULL or box_set.partners == NULL:
+            raise MemoryError()
 
-    cdef float _calculate_iou(self, float[:] box1, float[:] box2) nogil:
-        cdef float x1_inter = max(box1[2], box2[2])
-        cdef float y1_inter = max(box1[3], box2[3])
-        cdef float x2_inter = min(box1[4], box2[4])
-        cdef float y2_inter = min(box1[5], box2[5])
+        box_set.cell_width = 1
+        box_set.max_height = 0
+        for i in range(n):
+            box_set.cell_width = max(box_set.cell_width, x2[i] - x1[i])
+            box_set.max_height = max(box_set.max_height, y2[i] - y1[i])
 
-        cdef float inter_area = max(0, x2_inter - x1_inter) * max(0, y2_inter - y1_inter)
-        cdef float box1_area = box1[6] * box1[7]
-        cdef float box2_area = box2[6] * box2[7]
+        with nogil:
+            for i in range(n):
+                box_set.boxes[i].annotation_id = ids[i]
+                box_set.boxes[i].image_id = image_ids[i]
+                box_set.boxes[i].category_id = category_ids[i]
+                box_set.boxes[i].cell = <int> floorf(x1[i] / box_set.cell_width)
+                box_set.boxes[i].index = <int> i
+                box_set.boxes[i].x1 = x1[i]
+                box_set.boxes[i].y1 = y1[i]
+                box_set.boxes[i].x2 = x2[i]
+                box_set.boxes[i].y2 = y2[i]
+                box_set.boxes[i].area = (x2[i] - x1[i]) * (y2[i] - y1[i])
+            qsort(box_set.boxes, n, sizeof(Box), _compare_boxes)
 
-        return inter_area / (box1_area + box2_area - inter_area)
+            box_set.num_segments = 0
+            for i in range(n):
+                if i == 0 or _compare_groups(&box_set.boxes[i - 1], &box_set.boxes[i]) != 0:
+                    box_set.offsets[box_set.num_segments] = i
+                    box_set.num_segments += 1
+                box_set.boxes[i].segment = <int> (box_set.num_segments - 1)
+            box_set.offsets[box_set.num_segments] = n
+
+    cpdef tuple evaluate(self, float iou_threshold=0.5):
+        cdef unsigned char[::1] pred_matched = np.zeros(self.predictions.size + 1, dtype=np.uint8)
+        cdef unsigned char[::1] gt_matched = np.zeros(self.ground_truths.size + 1, dtype=np.uint8)
+        cdef Py_ssize_t ious
+
+        with phase(self.stats, 'match'):
+            with nogil:
+                ious = _match_all(&self.predictions, &self.ground_truths, &pred_matched[0], iou_threshold)
+                ious += _match_all(&self.ground_truths, &self.predictions, &gt_matched[0], iou_threshold)
+
+        with phase(self.stats, 'collect'):
+            pred_is_tp = np.asarray(pred_matched)[:self.predictions.size].view(bool)
+            gt_is_matched = np.asarray(gt_matched)[:self.ground_truths.size].view(bool)
+            tp_pred_list = self.pred_annotation_ids[pred_is_tp].tolist()
+            fp_pred_list = self.pred_annotation_ids[~pred_is_tp].tolist()
+            fn_gt_list = self.gt_annotation_ids[~gt_is_matched].tolist()
+
+        if self.stats is not None:
+            # The cell and y1 bisections bound the candidates, so every candidate gets its IoU computed
+            self.stats.add(queries=self.predictions.size + self.ground_truths.size, candidate_pairs=ious,
+                           iou_computations=ious,
+                           early_exits=len(tp_pred_list) + self.ground_truths.size - len(fn_gt_list))
+        return tp_pred_list, fp_pred_list, fn_gt_list
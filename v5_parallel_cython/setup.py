@@ -8,6 +8,8 @@ extensions = [
         "evaluator",
         sources=["evaluator.pyx"],
         include_dirs=[np.get_include()],
+        extra_compile_args=['-fopenmp'],
+        extra_link_args=['-fopenmp'],
     )
 ]
 
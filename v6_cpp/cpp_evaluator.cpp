@@ -1,8 +1,6 @@
 #include "cpp_evaluator.h"  // Include the header file
-#include <fstream>
-#include <nlohmann/json.hpp>  // Assuming you're using nlohmann JSON library
-
-using json = nlohmann::json;
+#include <algorithm>
+#include "annotation_reader.h"
 
 // BoundingBox constructor
 BoundingBox::BoundingBox(int annotation_id, int image_id, int category_id, int x1, int y1, int w, int h)
@@ -49,48 +47,214 @@ bool BoundingBox::is_false_negative(const std::vector<BoundingBox>& predicted_bo
     return true;
 }
 
-
 // Evaluator constructor
-CppEvaluator::CppEvaluator(const std::string& ground_truth_json, const std::string& predictions_json) {
-    std::ifstream gt_file(ground_truth_json);
-    std::ifstream pred_file(predictions_json);
-
-    json gt_data, pred_data;
-    gt_file >> gt_data;
-    pred_file >> pred_data;
-
-    for (const auto& ann : gt_data["annotations"]) {
-        ground_truth_boxes.emplace_back(
-            ann["annotation_id"], ann["image_id"], ann["category_id"],
-            ann["bbox"][0], ann["bbox"][1], ann["bbox"][2], ann["bbox"][3]);
+CppEvaluator::CppEvaluator(const std::string& ground_truth_json, const std::string& predictions_json, bool collect_stats) {
+    stats.enabled = collect_stats;
+    {
+        PhaseTimer timer(stats, &EvaluationStats::parse_seconds);
+        read_annotation_files(ground_truth_json, predictions_json, [this](const AnnotationRecord& ann) {
+            ground_truth_boxes.emplace_back(
+                ann.annotation_id, ann.image_id, ann.category_id,
+                ann.bbox[0], ann.bbox[1], ann.bbox[2], ann.bbox[3]);
+        }, [this](const AnnotationRecord& ann) {
+            predicted_boxes.emplace_back(
+                ann.annotation_id, ann.image_id, ann.category_id,
+                ann.bbox[0], ann.bbox[1], ann.bbox[2], ann.bbox[3]);
+        });
     }
 
-    for (const auto& ann : pred_data["annotations"]) {
-        predicted_boxes.emplace_back(
-            ann["annotation_id"], ann["image_id"], ann["category_id"],
-            ann["bbox"][0], ann["bbox"][1], ann["bbox"][2], ann["bbox"][3]);
-    }
+    build_groups();
 }
 
-// Implementation of evaluate
-std::tuple<std::vector<int>, std::vector<int>, std::vector<int>> CppEvaluator::evaluate() {
-    std::vector<int> tp_pred_ids, fp_pred_ids, fn_gt_ids;
+// Evaluator constructor from box rows already in memory (annotation_id, image_id, category_id, x, y, w, h)
+CppEvaluator::CppEvaluator(const int* ground_truth_rows, std::size_t num_ground_truths, const int* prediction_rows, std::size_t num_predictions,
+                           bool collect_stats) {
+    stats.enabled = collect_stats;
+    {
+        PhaseTimer timer(stats, &EvaluationStats::parse_seconds);
+        ground_truth_boxes.reserve(num_ground_truths);
+        read_annotation_rows(ground_truth_rows, num_ground_truths, [this](const AnnotationRecord& ann) {
+            ground_truth_boxes.emplace_back(
+                ann.annotation_id, ann.image_id, ann.category_id,
+                ann.bbox[0], ann.bbox[1], ann.bbox[2], ann.bbox[3]);
+        });
+
+        predicted_boxes.reserve(num_predictions);
+        read_annotation_rows(prediction_rows, num_predictions, [this](const AnnotationRecord& ann) {
+            predicted_boxes.emplace_back(
+                ann.annotation_id, ann.image_id, ann.category_id,
+                ann.bbox[0], ann.bbox[1], ann.bbox[2], ann.bbox[3]);
+        });
+    }
+
+    build_groups();
+}
 
+// Buckets every box into its group and builds the grids; every group still has to be scored
+void CppEvaluator::build_groups() {
+    PhaseTimer timer(stats, &EvaluationStats::index_seconds);
+    for (const auto& gt_box : ground_truth_boxes) {
+        groups[group_key(gt_box.image_id, gt_box.category_id)].ground_truths.push_back(gt_box);
+    }
     for (const auto& pred_box : predicted_boxes) {
-        bool is_tp = pred_box.is_true_positive_or_false_positive(ground_truth_boxes);
-        if (is_tp) {
-            tp_pred_ids.push_back(pred_box.annotation_id);
-        } else {
-            fp_pred_ids.push_back(pred_box.annotation_id);
+        groups[group_key(pred_box.image_id, pred_box.category_id)].predictions.push_back(pred_box);
+    }
+    for (auto& entry : groups) {
+        EvaluationGroup& group = entry.second;
+        group.ground_truth_grid = SpatialGrid(group.ground_truths);
+        group.predicted_grid = SpatialGrid(group.predictions);
+        group.grids_stale = false;
+        dirty_groups.insert(entry.first);
+    }
+}
+
+// Rebuilds the grids and results of the dirty groups; called with mtx held
+void CppEvaluator::update_dirty_groups() {
+    {
+        PhaseTimer timer(stats, &EvaluationStats::index_seconds);
+        for (long long key : dirty_groups) {
+            EvaluationGroup& group = groups[key];
+            if (group.ground_truths.empty() && group.predictions.empty()) {
+                groups.erase(key);
+                continue;
+            }
+            if (group.grids_stale) {
+                group.ground_truth_grid = SpatialGrid(group.ground_truths);
+                group.predicted_grid = SpatialGrid(group.predictions);
+                group.grids_stale = false;
+            }
         }
     }
 
-    for (const auto& gt_box : ground_truth_boxes) {
-        bool is_fn = gt_box.is_false_negative(predicted_boxes);
-        if (is_fn) {
-            fn_gt_ids.push_back(gt_box.annotation_id);
+    PhaseTimer timer(stats, &EvaluationStats::match_seconds);
+    MatchCounters counters;
+    for (long long key : dirty_groups) {
+        auto it = groups.find(key);
+        if (it == groups.end()) {
+            continue;
+        }
+        EvaluationGroup& group = it->second;
+        group.tp_pred_ids.clear();
+        group.fp_pred_ids.clear();
+        group.fn_gt_ids.clear();
+        counters.queries += group.predictions.size() + group.ground_truths.size();
+        for (const auto& pred_box : group.predictions) {
+            if (group.ground_truth_grid.any_match(pred_box, 0.5, counters)) {
+                group.tp_pred_ids.push_back(pred_box.annotation_id);
+            } else {
+                group.fp_pred_ids.push_back(pred_box.annotation_id);
+            }
+        }
+        for (const auto& gt_box : group.ground_truths) {
+            if (!group.predicted_grid.any_match(gt_box, 0.5, counters)) {
+                group.fn_gt_ids.push_back(gt_box.annotation_id);
+            }
         }
     }
+    dirty_groups.clear();
+    stats.add(counters);
+}
+
+void CppEvaluator::add_ground_truth(int annotation_id, int image_id, int category_id, int x, int y, int w, int h) {
+    std::lock_guard<std::mutex> lock(mtx);
+    ground_truth_boxes.emplace_back(annotation_id, image_id, category_id, x, y, w, h);
+    long long key = group_key(image_id, category_id);
+    EvaluationGroup& group = groups[key];
+    group.ground_truths.push_back(ground_truth_boxes.back());
+    group.grids_stale = true;
+    dirty_groups.insert(key);
+}
+
+void CppEvaluator::add_prediction(int annotation_id, int image_id, int category_id, int x, int y, int w, int h) {
+    std::lock_guard<std::mutex> lock(mtx);
+    predicted_boxes.emplace_back(annotation_id, image_id, category_id, x, y, w, h);
+    long long key = group_key(image_id, category_id);
+    EvaluationGroup& group = groups[key];
+    group.predictions.push_back(predicted_boxes.back());
+    group.grids_stale = true;
+    dirty_groups.insert(key);
+}
+
+std::size_t CppEvaluator::remove_boxes(const std::vector<int>& annotation_ids, std::vector<BoundingBox>& boxes,
+                                       std::vector<BoundingBox> EvaluationGroup::*group_boxes) {
+    std::lock_guard<std::mutex> lock(mtx);
+    std::unordered_set<int> removed_ids(annotation_ids.begin(), annotation_ids.end());
+    auto is_removed = [&removed_ids](const BoundingBox& box) { return removed_ids.count(box.annotation_id) > 0; };
+
+    // Find the groups first: the tail left by remove_if holds unspecified boxes
+    std::unordered_set<long long> touched_groups;
+    for (const auto& box : boxes) {
+        if (is_removed(box)) {
+            touched_groups.insert(group_key(box.image_id, box.category_id));
+        }
+    }
+    auto first_removed = std::remove_if(boxes.begin(), boxes.end(), is_removed);
+    std::size_t num_removed = boxes.end() - first_removed;
+    boxes.erase(first_removed, boxes.end());
+
+    for (long long key : touched_groups) {
+        EvaluationGroup& group = groups[key];
+        auto& members = group.*group_boxes;
+        members.erase(std::remove_if(members.begin(), members.end(), is_removed), members.end());
+        group.grids_stale = true;
+        dirty_groups.insert(key);
+    }
+    return num_removed;
+}
+
+std::size_t CppEvaluator::remove_ground_truths(const std::vector<int>& annotation_ids) {
+    return remove_boxes(annotation_ids, ground_truth_boxes, &EvaluationGroup::ground_truths);
+}
+
+std::size_t CppEvaluator::remove_predictions(const std::vector<int>& annotation_ids) {
+    return remove_boxes(annotation_ids, predicted_boxes, &EvaluationGroup::predictions);
+}
+
+std::size_t CppEvaluator::num_dirty_groups() const {
+    std::lock_guard<std::mutex> lock(mtx);
+    return dirty_groups.size();
+}
+
+// Implementation of evaluate
+std::tuple<std::vector<int>, std::vector<int>, std::vector<int>> CppEvaluator::evaluate() {
+    std::lock_guard<std::mutex> lock(mtx);
+    update_dirty_groups();
+
+    PhaseTimer timer(stats, &EvaluationStats::collect_seconds);
+    std::vector<int> tp_pred_ids, fp_pred_ids, fn_gt_ids;
+    tp_pred_ids.reserve(predicted_boxes.size());
+    fn_gt_ids.reserve(ground_truth_boxes.size());
+    for (const auto& entry : groups) {
+        const EvaluationGroup& group = entry.second;
+        tp_pred_ids.insert(tp_pred_ids.end(), group.tp_pred_ids.begin(), group.tp_pred_ids.end());
+        fp_pred_ids.insert(fp_pred_ids.end(), group.fp_pred_ids.begin(), group.fp_pred_ids.end());
+        fn_gt_ids.insert(fn_gt_ids.end(), group.fn_gt_ids.begin(), group.fn_gt_ids.end());
+    }
 
     return {tp_pred_ids, fp_pred_ids, fn_gt_ids};
 }
+
+// Implementation of evaluate_masks
+std::pair<std::vector<uint8_t>, std::vector<uint8_t>> CppEvaluator::evaluate_masks() {
+    std::lock_guard<std::mutex> lock(mtx);
+    update_dirty_groups();
+
+    PhaseTimer timer(stats, &EvaluationStats::match_seconds);
+    MatchCounters counters;
+    std::vector<uint8_t> pred_is_tp(predicted_boxes.size());
+    std::vector<uint8_t> gt_is_fn(ground_truth_boxes.size());
+
+    counters.queries += predicted_boxes.size() + ground_truth_boxes.size();
+    for (size_t i = 0; i < predicted_boxes.size(); ++i) {
+        const auto& pred_box = predicted_boxes[i];
+        pred_is_tp[i] = groups.at(group_key(pred_box.image_id, pred_box.category_id)).ground_truth_grid.any_match(pred_box, 0.5, counters);
+    }
+
+    for (size_t i = 0; i < ground_truth_boxes.size(); ++i) {
+        const auto& gt_box = ground_truth_boxes[i];
+        gt_is_fn[i] = !groups.at(group_key(gt_box.image_id, gt_box.category_id)).predicted_grid.any_match(gt_box, 0.5, counters);
+    }
+
+    stats.add(counters);
+    return {std::move(pred_is_tp), std::move(gt_is_fn)};
+}
@@ -1,8 +1,17 @@
 #ifndef EVALUATOR_H  // Include guards to prevent double inclusion
 #define EVALUATOR_H
 
+#include <cstddef>
+#include <cstdint>
+#include <mutex>
 #include <string>
+#include <tuple>
+#include <unordered_map>
+#include <unordered_set>
+#include <utility>
 #include <vector>
+#include "evaluation_stats.h"
+#include "spatial_grid.h"
 
 class BoundingBox {
 public:
@@ -23,12 +32,50 @@ public:
 };
 
 
+// Boxes of one (image_id, category_id) group, their grids and the results of their last evaluation
+struct EvaluationGroup {
+    std::vector<BoundingBox> ground_truths;
+    std::vector<BoundingBox> predictions;
+    SpatialGrid ground_truth_grid;
+    SpatialGrid predicted_grid;
+    bool grids_stale = true;
+    std::vector<int> tp_pred_ids, fp_pred_ids, fn_gt_ids;
+};
+
+
+// Thread-safe: evaluations and edits take turns on one mutex, so evaluate() can run with the GIL released
+// (evaluate_async) while other threads evaluate or edit the same evaluator.
 class CppEvaluator {
 public:
-    CppEvaluator(const std::string& ground_truth_json, const std::string& predictions_json);
+    CppEvaluator(const std::string& ground_truth_json, const std::string& predictions_json, bool collect_stats = false);
+    CppEvaluator(const int* ground_truth_rows, std::size_t num_ground_truths, const int* prediction_rows, std::size_t num_predictions,
+                 bool collect_stats = false);
+    // Re-scores the groups changed since the previous call and reuses the results of all the others
     std::tuple<std::vector<int>, std::vector<int>, std::vector<int>> evaluate();
+    // Per-box flags in input order: prediction is a true positive, ground truth is a false negative
+    std::pair<std::vector<uint8_t>, std::vector<uint8_t>> evaluate_masks();
+
+    // Incremental updates: each one only marks the group of the boxes as dirty
+    void add_ground_truth(int annotation_id, int image_id, int category_id, int x, int y, int w, int h);
+    void add_prediction(int annotation_id, int image_id, int category_id, int x, int y, int w, int h);
+    // Remove every box with one of the given annotation ids, returning how many were removed
+    std::size_t remove_ground_truths(const std::vector<int>& annotation_ids);
+    std::size_t remove_predictions(const std::vector<int>& annotation_ids);
+    std::size_t num_dirty_groups() const;
+
     std::vector<BoundingBox> ground_truth_boxes;
     std::vector<BoundingBox> predicted_boxes;
+    EvaluationStats stats;  // Only filled when collect_stats was set
+
+private:
+    std::unordered_map<long long, EvaluationGroup> groups;
+    std::unordered_set<long long> dirty_groups;  // Groups whose results are out of date
+    mutable std::mutex mtx;  // Guards the boxes, the groups and their results
+
+    void build_groups();
+    void update_dirty_groups();
+    std::size_t remove_boxes(const std::vector<int>& annotation_ids, std::vector<BoundingBox>& boxes,
+                             std::vector<BoundingBox> EvaluationGroup::*group_boxes);
 };
 
 #endif  // EVALUATOR_H
\ No newline at end of file
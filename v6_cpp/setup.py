@@ -8,9 +8,9 @@ pybind11_include = pybind11.get_include()
 cpp_evaluator = Extension(
     'cpp_evaluator',  # The name of the module that will be imported in Python
     sources=['cpp_evaluator.cpp', 'cpp_evaluator_wrapper.cpp'],  # Source files
-    include_dirs=[pybind11_include],  # Include directories (pybind11 and your headers)
+    include_dirs=[pybind11_include, '../common'],  # Include directories (pybind11 and the shared headers)
     language='c++',  # Specify that we are using C++
-    extra_compile_args=['-std=c++11'],  # Use C++11 standard
+    extra_compile_args=['-std=c++11', '-fopenmp-simd'],  # Use C++11 standard and the SIMD pragmas of box_columns.h (no OpenMP runtime)
 )
 
 # Set up the module
@@ -1,8 +1,6 @@
 #include "parallel_cpp_evaluator.h"
-#include <fstream>
-#include <nlohmann/json.hpp>
-
-using json = nlohmann::json;
+#include "annotation_reader.h"
+#include <stdexcept>
 
 double BoundingBox::calculate_iou(const BoundingBox& other) const {
     int x1_inter = std::max(x1, other.x1);
@@ -41,95 +39,154 @@ bool BoundingBox::is_false_negative(const std::vector<BoundingBox>& predicted_bo
     return true;
 }
 
-ParallelCppEvaluator::ParallelCppEvaluator(const std::string& ground_truth_json, const std::string& predictions_json) {
-    std::ifstream gt_file(ground_truth_json);
-    std::ifstream pred_file(predictions_json);
-
-    if (!gt_file.is_open() || !pred_file.is_open()) {
-        throw std::runtime_error("Failed to open JSON files.");
+ParallelCppEvaluator::ParallelCppEvaluator(const std::string& ground_truth_json, const std::string& predictions_json, bool collect_stats) {
+    stats.enabled = collect_stats;
+    {
+        PhaseTimer timer(stats, &EvaluationStats::parse_seconds);
+        read_annotation_files(ground_truth_json, predictions_json, [this](const AnnotationRecord& ann) {
+            ground_truth_boxes.emplace_back(
+                ann.annotation_id,
+                ann.image_id,
+                ann.category_id,
+                ann.bbox[0],
+                ann.bbox[1],
+                ann.bbox[2],
+                ann.bbox[3]
+            );
+        }, [this](const AnnotationRecord& ann) {
+            predicted_boxes.emplace_back(
+                ann.annotation_id,
+                ann.image_id,
+                ann.category_id,
+                ann.bbox[0],
+                ann.bbox[1],
+                ann.bbox[2],
+                ann.bbox[3]
+            );
+        });
     }
 
-    json gt_data, pred_data;
-    gt_file >> gt_data;
-    pred_file >> pred_data;
-
-    for (const auto& ann : gt_data["annotations"]) {
-        ground_truth_boxes.emplace_back(
-            ann["annotation_id"],
-            ann["image_id"],
-            ann["category_id"],
-            ann["bbox"][0],
-            ann["bbox"][1],
-            ann["bbox"][2],
-            ann["bbox"][3]
-        );
-    }
-    for (const auto& ann : pred_data["annotations"]) {
-        predicted_boxes.emplace_back(
-            ann["annotation_id"],
-            ann["image_id"],
-            ann["category_id"],
-             ann["bbox"][0],
-             ann["bbox"][1],
-             ann["bbox"][2],
-             ann["bbox"][3]
-        );
+    {
+        PhaseTimer timer(stats, &EvaluationStats::index_seconds);
+        ground_truth_index = SpatialIndex(ground_truth_boxes);
+        predicted_index = SpatialIndex(predicted_boxes);
     }
+    set_num_threads(0);
 }
 
-void ParallelCppEvaluator::evaluate_boxes(int start, int end, std::vector<int>& tp_pred_ids, std::vector<int>& fp_pred_ids) {
-    for (int i = start; i < end; ++i) {
-        const auto& pred_box = predicted_boxes[i];
-        bool is_tp = pred_box.is_true_positive_or_false_positive(ground_truth_boxes, 0.5);
+ParallelCppEvaluator::ParallelCppEvaluator(const int* ground_truth_rows, std::size_t num_ground_truths, const int* prediction_rows, std::size_t num_predictions,
+                                           bool collect_stats) {
+    stats.enabled = collect_stats;
+    {
+        PhaseTimer timer(stats, &EvaluationStats::parse_seconds);
+        ground_truth_boxes.reserve(num_ground_truths);
+        read_annotation_rows(ground_truth_rows, num_ground_truths, [this](const AnnotationRecord& ann) {
+            ground_truth_boxes.emplace_back(
+                ann.annotation_id,
+                ann.image_id,
+                ann.category_id,
+                ann.bbox[0],
+                ann.bbox[1],
+                ann.bbox[2],
+                ann.bbox[3]
+            );
+        });
+
+        predicted_boxes.reserve(num_predictions);
+        read_annotation_rows(prediction_rows, num_predictions, [this](const AnnotationRecord& ann) {
+            predicted_boxes.emplace_back(
+                ann.annotation_id,
+                ann.image_id,
+                ann.category_id,
+                ann.bbox[0],
+                ann.bbox[1],
+                ann.bbox[2],
+                ann.bbox[3]
+            );
+        });
+    }
 
-        std::lock_guard<std::mutex> lock(mtx);
-        if (is_tp) {
-            tp_pred_ids.push_back(pred_box.annotation_id);
-        } else {
-            fp_pred_ids.push_back(pred_box.annotation_id);
-        }
+    {
+        PhaseTimer timer(stats, &EvaluationStats::index_seconds);
+        ground_truth_index = SpatialIndex(ground_truth_boxes);
+        predicted_index = SpatialIndex(predicted_boxes);
     }
+    set_num_threads(0);
 }
 
-void ParallelCppEvaluator::evaluate_ground_truths(int start, int end, std::vector<int>& fn_gt_ids) {
-    for (int i = start; i < end; ++i) {
-        const auto& gt_box = ground_truth_boxes[i];
-        bool is_fn = gt_box.is_false_negative(predicted_boxes, 0.5);
+constexpr std::size_t ParallelCppEvaluator::CHUNKS_PER_THREAD;
+constexpr std::size_t ParallelCppEvaluator::MIN_CHUNK_SIZE;
+constexpr std::size_t ParallelCppEvaluator::MAX_CHUNK_SIZE;
 
-        std::lock_guard<std::mutex> lock(mtx);
-        if (is_fn) {
-            fn_gt_ids.push_back(gt_box.annotation_id);
-        }
+void ParallelCppEvaluator::set_num_threads(int num_threads) {
+    if (num_threads < 0) {
+        throw std::invalid_argument("num_threads must be >= 0 (0 uses every hardware thread)");
+    }
+    if (num_threads == 0) {
+        num_threads = std::max(1u, std::thread::hardware_concurrency());
+    }
+    std::lock_guard<std::mutex> lock(pool_mtx);
+    if (!pool || pool->size() != num_threads) {
+        pool.reset(new WorkStealingPool(num_threads));
     }
 }
 
-std::tuple<std::vector<int>, std::vector<int>, std::vector<int>> ParallelCppEvaluator::evaluate() {
-    std::vector<int> tp_pred_ids, fp_pred_ids, fn_gt_ids;
+int ParallelCppEvaluator::get_num_threads() const {
+    std::lock_guard<std::mutex> lock(pool_mtx);
+    return pool->size();
+}
 
-    int num_threads = std::thread::hardware_concurrency();
-    int num_pred_boxes = predicted_boxes.size();
-    int num_gt_boxes = ground_truth_boxes.size();
+std::size_t ParallelCppEvaluator::chunk_size(std::size_t num_boxes) const {
+    // Enough chunks per thread for stealing to even out skewed images, without making them tiny
+    std::size_t chunk = num_boxes / (static_cast<std::size_t>(pool->size()) * CHUNKS_PER_THREAD);
+    return std::min(MAX_CHUNK_SIZE, std::max(MIN_CHUNK_SIZE, chunk));
+}
 
-    std::vector<std::thread> threads;
+std::tuple<std::vector<int>, std::vector<int>, std::vector<int>> ParallelCppEvaluator::evaluate() {
+    // The pool threads only write the flags of their own chunks; the ids are gathered afterwards
+    auto masks = evaluate_masks();
+    PhaseTimer timer(stats, &EvaluationStats::collect_seconds);
+    const auto& pred_is_tp = masks.first;
+    const auto& gt_is_fn = masks.second;
 
-    // Parallelize evaluation of predicted boxes
-    for (int i = 0; i < num_threads; ++i) {
-        int start = i * (num_pred_boxes / num_threads);
-        int end = (i + 1) * (num_pred_boxes / num_threads);
-        if (i == num_threads - 1) end = num_pred_boxes;
-        threads.emplace_back(&ParallelCppEvaluator::evaluate_boxes, this, start, end, std::ref(tp_pred_ids), std::ref(fp_pred_ids));
+    std::vector<int> tp_pred_ids, fp_pred_ids, fn_gt_ids;
+    for (size_t i = 0; i < predicted_boxes.size(); ++i) {
+        if (pred_is_tp[i]) {
+            tp_pred_ids.push_back(predicted_boxes[i].annotation_id);
+        } else {
+            fp_pred_ids.push_back(predicted_boxes[i].annotation_id);
+        }
     }
-    for (auto& t : threads) t.join();
-    threads.clear();
-
-    // Parallelize evaluation of ground truth boxes
-    for (int i = 0; i < num_threads; ++i) {
-        int start = i * (num_gt_boxes / num_threads);
-        int end = (i + 1) * (num_gt_boxes / num_threads);
-        if (i == num_threads - 1) end = num_gt_boxes;
-        threads.emplace_back(&ParallelCppEvaluator::evaluate_ground_truths, this, start, end, std::ref(fn_gt_ids));
+    for (size_t i = 0; i < ground_truth_boxes.size(); ++i) {
+        if (gt_is_fn[i]) {
+            fn_gt_ids.push_back(ground_truth_boxes[i].annotation_id);
+        }
     }
-    for (auto& t : threads) t.join();
 
     return {tp_pred_ids, fp_pred_ids, fn_gt_ids};
 }
+
+std::pair<std::vector<uint8_t>, std::vector<uint8_t>> ParallelCppEvaluator::evaluate_masks() {
+    std::vector<uint8_t> pred_is_tp(predicted_boxes.size());
+    std::vector<uint8_t> gt_is_fn(ground_truth_boxes.size());
+
+    std::lock_guard<std::mutex> lock(pool_mtx);
+    PhaseTimer timer(stats, &EvaluationStats::match_seconds);
+    pool->parallel_for(predicted_boxes.size(), chunk_size(predicted_boxes.size()), [&](std::size_t start, std::size_t end) {
+        MatchCounters counters;
+        for (std::size_t i = start; i < end; ++i) {
+            pred_is_tp[i] = ground_truth_index.any_match(predicted_boxes[i], 0.5, counters);
+        }
+        stats.add(counters);
+    });
+
+    pool->parallel_for(ground_truth_boxes.size(), chunk_size(ground_truth_boxes.size()), [&](std::size_t start, std::size_t end) {
+        MatchCounters counters;
+        for (std::size_t i = start; i < end; ++i) {
+            gt_is_fn[i] = !predicted_index.any_match(ground_truth_boxes[i], 0.5, counters);
+        }
+        stats.add(counters);
+    });
+
+    return {std::move(pred_is_tp), std::move(gt_is_fn)};
+}
@@ -1,12 +1,19 @@
 #ifndef EVALUATOR_H
 #define EVALUATOR_H
 
+#include <cstddef>
+#include <cstdint>
+#include <utility>
 #include <vector>
+#include <memory>
 #include <mutex>
 #include <thread>
 #include <iostream>
 #include <algorithm>
-#include <nlohmann/json.hpp>
+#include <unordered_map>
+#include "thread_pool.h"
+#include "evaluation_stats.h"
+#include "spatial_grid.h"
 
 class BoundingBox {
 public:
@@ -31,18 +38,35 @@ public:
 
 class ParallelCppEvaluator {
 public:
-    ParallelCppEvaluator(const std::string& ground_truth_json, const std::string& predictions_json);
+    ParallelCppEvaluator(const std::string& ground_truth_json, const std::string& predictions_json, bool collect_stats = false);
+    ParallelCppEvaluator(const int* ground_truth_rows, std::size_t num_ground_truths, const int* prediction_rows, std::size_t num_predictions,
+                         bool collect_stats = false);
 
+    // Threads of the pool kept by the evaluator, the calling thread included; 0 uses every hardware thread
+    void set_num_threads(int num_threads);
+    int get_num_threads() const;
+
+    // Ids in the order of the input files
     std::tuple<std::vector<int>, std::vector<int>, std::vector<int>> evaluate();
+    // Per-box flags in input order; every chunk of boxes is written by one thread, so no lock is taken
+    std::pair<std::vector<uint8_t>, std::vector<uint8_t>> evaluate_masks();
+
+    EvaluationStats stats;  // Only filled when collect_stats was set; every chunk merges its counters once
 
 private:
+    static constexpr std::size_t CHUNKS_PER_THREAD = 16;
+    static constexpr std::size_t MIN_CHUNK_SIZE = 16;
+    static constexpr std::size_t MAX_CHUNK_SIZE = 1024;
+
     std::vector<BoundingBox> ground_truth_boxes;
     std::vector<BoundingBox> predicted_boxes;
+    SpatialIndex ground_truth_index;
+    SpatialIndex predicted_index;
 
-    std::mutex mtx;
+    std::unique_ptr<WorkStealingPool> pool;
+    mutable std::mutex pool_mtx;  // Evaluations from several Python threads take turns on the pool
 
-    void evaluate_boxes(int start, int end, std::vector<int>& tp_pred_ids, std::vector<int>& fp_pred_ids);
-    void evaluate_ground_truths(int start, int end, std::vector<int>& fn_gt_ids);
+    std::size_t chunk_size(std::size_t num_boxes) const;
 };
 
 #endif // EVALUATOR_H
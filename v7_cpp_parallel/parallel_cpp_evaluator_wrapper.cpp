@@ -1,11 +1,48 @@
 #include <pybind11/pybind11.h>
+#include <pybind11/numpy.h>
 #include <pybind11/stl.h>
 #include "parallel_cpp_evaluator.h"  // Include your parallelized evaluator header
+#include "numpy_buffers.h"
+#include "async_evaluation.h"
+#include "evaluation_stats_binding.h"
 
 namespace py = pybind11;
 
 PYBIND11_MODULE(parallel_cpp_evaluator, m) {
     py::class_<ParallelCppEvaluator>(m, "ParallelCppEvaluator")
-        .def(py::init<const std::string&, const std::string&>())
-        .def("evaluate", &ParallelCppEvaluator::evaluate);
+        .def(py::init<const std::string&, const std::string&, bool>(), py::arg("ground_truth_json"), py::arg("predictions_json"),
+             py::arg("collect_stats") = false, py::call_guard<py::gil_scoped_release>())
+        .def(py::init([](const BoxRows& ground_truths, const BoxRows& predictions, bool collect_stats) {  // (N, 7) int32 rows, read in place
+            const int* ground_truth_rows = box_rows_data(ground_truths, "ground_truths");
+            const int* prediction_rows = box_rows_data(predictions, "predictions");
+            std::size_t num_ground_truths = ground_truths.shape(0);
+            std::size_t num_predictions = predictions.shape(0);
+            py::gil_scoped_release release;  // The arrays stay alive as arguments of the call
+            return new ParallelCppEvaluator(ground_truth_rows, num_ground_truths, prediction_rows, num_predictions, collect_stats);
+        }), py::arg("ground_truths"), py::arg("predictions"), py::arg("collect_stats") = false)
+        .def_property("num_threads", &ParallelCppEvaluator::get_num_threads, &ParallelCppEvaluator::set_num_threads)
+        // common.evaluation_stats.EvaluationStats accumulated since construction, None unless collect_stats was set
+        .def_property_readonly("stats", [](const ParallelCppEvaluator& self) { return stats_to_python(self.stats); })
+        .def("evaluate", &ParallelCppEvaluator::evaluate, py::call_guard<py::gil_scoped_release>())
+        .def("evaluate_async", [](py::object self, py::object executor) {  // concurrent.futures.Future of evaluate()
+            return submit_evaluation(self, "evaluate", executor);
+        }, py::arg("executor") = py::none())
+        .def("evaluate_arrays", [](ParallelCppEvaluator& self) {  // Same ids as evaluate, as int32 arrays
+            std::tuple<std::vector<int>, std::vector<int>, std::vector<int>> result;
+            {
+                py::gil_scoped_release release;
+                result = self.evaluate();
+            }
+            return py::make_tuple(to_numpy(std::move(std::get<0>(result))),
+                                  to_numpy(std::move(std::get<1>(result))),
+                                  to_numpy(std::move(std::get<2>(result))));
+        })
+        .def("evaluate_masks", [](ParallelCppEvaluator& self) {  // Boolean masks in input order: pred_is_tp, gt_is_fn
+            std::pair<std::vector<uint8_t>, std::vector<uint8_t>> masks;
+            {
+                py::gil_scoped_release release;
+                masks = self.evaluate_masks();
+            }
+            return py::make_tuple(mask_to_numpy(std::move(masks.first)), mask_to_numpy(std::move(masks.second)));
+        });
 }
@@ -1,11 +1,10 @@
 #include "shared_mutex_parallel_evaluator.h"
-#include <nlohmann/json.hpp>
-#include <fstream>
+#include "annotation_reader.h"
 #include <iostream>
 #include <algorithm>
 #include <vector>
 #include <cmath>
-using json = nlohmann::json;
+#include <unordered_set>
 
 
 BoundingBox::BoundingBox(int ann_id, int img_id, int cat_id, int x1, int y1, int w, int h)
@@ -50,75 +49,214 @@ bool BoundingBox::is_false_negative(const std::vector<BoundingBox>& predicted_bo
 }
 
 
-SharedMutexParallelCppEvaluator::SharedMutexParallelCppEvaluator(const std::string& ground_truth_json, const std::string& predictions_json) {
-    std::ifstream gt_file(ground_truth_json);
-    std::ifstream pred_file(predictions_json);
+static long long group_key(int image_id, int category_id) {
+    return (static_cast<long long>(image_id) << 32) | static_cast<unsigned int>(category_id);
+}
+
+static const std::vector<BoundingBox> no_boxes;
+
+// Whether any box of the group of the query, from the other set, reaches iou_threshold with it
+static bool any_match(const BoundingBox& query, const std::vector<BoundingBox>& group, MatchCounters& counters,
+                      double iou_threshold = 0.5) {
+    counters.queries++;
+    for (const auto& box : group) {
+        counters.candidate_pairs++;
+        counters.iou_computations++;
+        if (query.calculate_iou(box) >= iou_threshold) {
+            counters.early_exits++;
+            return true;
+        }
+    }
+    return false;
+}
+
+SharedMutexParallelCppEvaluator::SharedMutexParallelCppEvaluator(const std::string& ground_truth_json, const std::string& predictions_json,
+                                                                 bool collect_stats) {
+    stats.enabled = collect_stats;
+    {
+        PhaseTimer timer(stats, &EvaluationStats::parse_seconds);
+        read_annotation_files(ground_truth_json, predictions_json, [this](const AnnotationRecord& ann) {
+            ground_truth_boxes.emplace_back(
+                ann.annotation_id,
+                ann.image_id,
+                ann.category_id,
+                ann.bbox[0],
+                ann.bbox[1],
+                ann.bbox[2],
+                ann.bbox[3]
+            );
+        }, [this](const AnnotationRecord& ann) {
+            predicted_boxes.emplace_back(
+                ann.annotation_id,
+                ann.image_id,
+                ann.category_id,
+                ann.bbox[0],
+                ann.bbox[1],
+                ann.bbox[2],
+                ann.bbox[3]
+            );
+        });
+    }
+    build_groups();
+}
+
+SharedMutexParallelCppEvaluator::SharedMutexParallelCppEvaluator(const int* ground_truth_rows, std::size_t num_ground_truths, const int* prediction_rows, std::size_t num_predictions,
+                                                                 bool collect_stats) {
+    stats.enabled = collect_stats;
+    {
+        PhaseTimer timer(stats, &EvaluationStats::parse_seconds);
+        auto read_rows = [](const int* rows, std::size_t num_rows, std::vector<BoundingBox>& boxes) {
+            boxes.reserve(num_rows);
+            read_annotation_rows(rows, num_rows, [&boxes](const AnnotationRecord& ann) {
+                boxes.emplace_back(
+                    ann.annotation_id,
+                    ann.image_id,
+                    ann.category_id,
+                    ann.bbox[0],
+                    ann.bbox[1],
+                    ann.bbox[2],
+                    ann.bbox[3]
+                );
+            });
+        };
+        read_rows(ground_truth_rows, num_ground_truths, ground_truth_boxes);
+        read_rows(prediction_rows, num_predictions, predicted_boxes);
+    }
+    build_groups();
+}
 
-    if (!gt_file.is_open() || !pred_file.is_open()) {
-        throw std::runtime_error("Error opening JSON files.");
+void SharedMutexParallelCppEvaluator::build_groups() {
+    PhaseTimer timer(stats, &EvaluationStats::index_seconds);
+    for (const auto& gt_box : ground_truth_boxes) {
+        ground_truth_groups[group_key(gt_box.image_id, gt_box.category_id)].push_back(gt_box);
+    }
+    for (const auto& pred_box : predicted_boxes) {
+        predicted_groups[group_key(pred_box.image_id, pred_box.category_id)].push_back(pred_box);
     }
+}
+
+std::shared_lock<std::shared_mutex> SharedMutexParallelCppEvaluator::read_lock() {
+    std::lock_guard<std::mutex> gate(writer_gate);
+    return std::shared_lock<std::shared_mutex>(mtx);
+}
+
+std::unique_lock<std::shared_mutex> SharedMutexParallelCppEvaluator::write_lock() {
+    std::lock_guard<std::mutex> gate(writer_gate);
+    return std::unique_lock<std::shared_mutex>(mtx);
+}
+
+void SharedMutexParallelCppEvaluator::insert_prediction(const BoundingBox& pred_box) {
+    predicted_boxes.push_back(pred_box);
+    predicted_groups[group_key(pred_box.image_id, pred_box.category_id)].push_back(pred_box);
+}
+
+void SharedMutexParallelCppEvaluator::add_prediction(int ann_id, int img_id, int cat_id, int x, int y, int w, int h) {
+    auto lock = write_lock();
+    insert_prediction(BoundingBox(ann_id, img_id, cat_id, x, y, w, h));
+}
+
+void SharedMutexParallelCppEvaluator::add_predictions(const int* prediction_rows, std::size_t num_predictions) {
+    auto lock = write_lock();
+    predicted_boxes.reserve(predicted_boxes.size() + num_predictions);
+    read_annotation_rows(prediction_rows, num_predictions, [this](const AnnotationRecord& ann) {
+        insert_prediction(BoundingBox(
+            ann.annotation_id,
+            ann.image_id,
+            ann.category_id,
+            ann.bbox[0],
+            ann.bbox[1],
+            ann.bbox[2],
+            ann.bbox[3]
+        ));
+    });
+}
 
-    json gt_data;
-    json pred_data;
-
-    gt_file >> gt_data;
-    pred_file >> pred_data;
-
-    for (const auto& ann : gt_data["annotations"]) {
-        ground_truth_boxes.emplace_back(
-            ann["annotation_id"],
-            ann["image_id"],
-            ann["category_id"],
-            ann["bbox"][0],
-            ann["bbox"][1],
-            ann["bbox"][2],
-            ann["bbox"][3]
-        );
+std::size_t SharedMutexParallelCppEvaluator::remove_predictions(const std::vector<int>& annotation_ids) {
+    std::unordered_set<int> removed_ids(annotation_ids.begin(), annotation_ids.end());
+    auto is_removed = [&removed_ids](const BoundingBox& box) { return removed_ids.count(box.annotation_id) > 0; };
+
+    auto lock = write_lock();
+
+    // Only the groups of the removed boxes need to be touched. They are collected before remove_if,
+    // which leaves unspecified boxes in the tail it hands back.
+    std::unordered_set<long long> touched_groups;
+    for (const auto& pred_box : predicted_boxes) {
+        if (is_removed(pred_box)) {
+            touched_groups.insert(group_key(pred_box.image_id, pred_box.category_id));
+        }
+    }
+    if (touched_groups.empty()) {
+        return 0;
     }
+    auto first_removed = std::remove_if(predicted_boxes.begin(), predicted_boxes.end(), is_removed);
+    std::size_t num_removed = predicted_boxes.end() - first_removed;
+    predicted_boxes.erase(first_removed, predicted_boxes.end());
 
-    for (const auto& ann : pred_data["annotations"]) {
-        predicted_boxes.emplace_back(
-            ann["annotation_id"],
-            ann["image_id"],
-            ann["category_id"],
-            ann["bbox"][0],
-            ann["bbox"][1],
-            ann["bbox"][2],
-            ann["bbox"][3]
-        );
+    for (long long key : touched_groups) {
+        auto& group = predicted_groups[key];
+        group.erase(std::remove_if(group.begin(), group.end(), is_removed), group.end());
+        if (group.empty()) {
+            predicted_groups.erase(key);
+        }
     }
+    return num_removed;
 }
 
-bool SharedMutexParallelCppEvaluator::is_true_positive_or_false_positive(const BoundingBox& pred_box) {
-    std::unique_lock<std::shared_mutex> lock(mtx);
-    bool is_tp = pred_box.is_true_positive_or_false_positive(ground_truth_boxes);
-    return is_tp;
+std::size_t SharedMutexParallelCppEvaluator::num_predictions() {
+    auto lock = read_lock();
+    return predicted_boxes.size();
 }
 
-bool SharedMutexParallelCppEvaluator::is_false_negative(const BoundingBox& gt_box) {
-    std::unique_lock<std::shared_mutex> lock(mtx);
-    bool is_fn = gt_box.is_false_negative(predicted_boxes);
-    return is_fn;
+bool SharedMutexParallelCppEvaluator::is_true_positive_or_false_positive(const BoundingBox& pred_box, MatchCounters& counters) const {
+    auto it = ground_truth_groups.find(group_key(pred_box.image_id, pred_box.category_id));
+    return any_match(pred_box, it == ground_truth_groups.end() ? no_boxes : it->second, counters);
+}
+
+bool SharedMutexParallelCppEvaluator::is_false_negative(const BoundingBox& gt_box, MatchCounters& counters) const {
+    auto it = predicted_groups.find(group_key(gt_box.image_id, gt_box.category_id));
+    return !any_match(gt_box, it == predicted_groups.end() ? no_boxes : it->second, counters);
 }
 
 std::tuple<std::vector<int>, std::vector<int>, std::vector<int>> SharedMutexParallelCppEvaluator::evaluate() {
+    // One shared lock for the whole evaluation: other evaluations go on, writers wait until it is done
+    auto lock = read_lock();
+    auto masks = match_masks();
+
+    PhaseTimer timer(stats, &EvaluationStats::collect_seconds);
     std::vector<int> tp_pred_ids;
     std::vector<int> fp_pred_ids;
     std::vector<int> fn_gt_ids;
-
-    for (const auto& pred_box : predicted_boxes) {
-        if (this->is_true_positive_or_false_positive(pred_box)) {
-            tp_pred_ids.push_back(pred_box.annotation_id);
-        } else {
-            fp_pred_ids.push_back(pred_box.annotation_id);
+    for (size_t i = 0; i < predicted_boxes.size(); ++i) {
+        (masks.first[i] ? tp_pred_ids : fp_pred_ids).push_back(predicted_boxes[i].annotation_id);
+    }
+    for (size_t i = 0; i < ground_truth_boxes.size(); ++i) {
+        if (masks.second[i]) {
+            fn_gt_ids.push_back(ground_truth_boxes[i].annotation_id);
         }
     }
+    return std::make_tuple(std::move(tp_pred_ids), std::move(fp_pred_ids), std::move(fn_gt_ids));
+}
 
-    for (const auto& gt_box : ground_truth_boxes) {
-        if (this->is_false_negative(gt_box)) {
-            fn_gt_ids.push_back(gt_box.annotation_id);
-        }
+std::pair<std::vector<uint8_t>, std::vector<uint8_t>> SharedMutexParallelCppEvaluator::evaluate_masks() {
+    auto lock = read_lock();
+    return match_masks();
+}
+
+std::pair<std::vector<uint8_t>, std::vector<uint8_t>> SharedMutexParallelCppEvaluator::match_masks() {
+    PhaseTimer timer(stats, &EvaluationStats::match_seconds);
+    MatchCounters counters;
+
+    std::vector<uint8_t> pred_is_tp(predicted_boxes.size());
+    std::vector<uint8_t> gt_is_fn(ground_truth_boxes.size());
+
+    for (size_t i = 0; i < predicted_boxes.size(); ++i) {
+        pred_is_tp[i] = this->is_true_positive_or_false_positive(predicted_boxes[i], counters);
+    }
+
+    for (size_t i = 0; i < ground_truth_boxes.size(); ++i) {
+        gt_is_fn[i] = this->is_false_negative(ground_truth_boxes[i], counters);
     }
 
-    return std::make_tuple(tp_pred_ids, fp_pred_ids, fn_gt_ids);
+    stats.add(counters);
+    return {std::move(pred_is_tp), std::move(gt_is_fn)};
 }
@@ -1,9 +1,16 @@
 #ifndef EVALUATOR_H
 #define EVALUATOR_H
 
+#include <cstddef>
+#include <cstdint>
+#include <mutex>
 #include <string>
+#include <tuple>
+#include <unordered_map>
+#include <utility>
 #include <vector>
 #include <shared_mutex> // For std::shared_mutex
+#include "evaluation_stats.h"
 
 class BoundingBox {
 public:
@@ -20,20 +27,50 @@ public:
 };
 
 
+// Evaluator meant to be shared by many threads. Any number of evaluate() calls run at the same time
+// under a shared lock; adding or removing predictions takes the lock exclusively, so a live stream of
+// detections can be scored against the resident ground truth without copying the evaluator.
 class SharedMutexParallelCppEvaluator {
 public:
-    SharedMutexParallelCppEvaluator(const std::string& ground_truth_json, const std::string& predictions_json);
+    SharedMutexParallelCppEvaluator(const std::string& ground_truth_json, const std::string& predictions_json, bool collect_stats = false);
+    SharedMutexParallelCppEvaluator(const int* ground_truth_rows, std::size_t num_ground_truths, const int* prediction_rows, std::size_t num_predictions,
+                                    bool collect_stats = false);
 
+    // Readers: safe to call from many threads at once
     std::tuple<std::vector<int>, std::vector<int>, std::vector<int>> evaluate();
+    std::pair<std::vector<uint8_t>, std::vector<uint8_t>> evaluate_masks();
+    std::size_t num_predictions();
+
+    // Writers: wait for the running evaluations, then block new ones while they update the predictions
+    void add_prediction(int ann_id, int img_id, int cat_id, int x, int y, int w, int h);
+    void add_predictions(const int* prediction_rows, std::size_t num_predictions);
+    // Removes every prediction with one of the given annotation ids, returns how many were removed
+    std::size_t remove_predictions(const std::vector<int>& annotation_ids);
+
+    // Only filled when collect_stats was set. Concurrent evaluations each merge their counters once.
+    EvaluationStats stats;
 
 private:
     std::vector<BoundingBox> ground_truth_boxes;
     std::vector<BoundingBox> predicted_boxes;
-    std::shared_mutex mtx; // For concurrent access
+    // Boxes of each (image_id, category_id) group, so a box is only compared with its own group
+    std::unordered_map<long long, std::vector<BoundingBox>> ground_truth_groups;
+    std::unordered_map<long long, std::vector<BoundingBox>> predicted_groups;
+    std::shared_mutex mtx; // Shared by the readers, exclusive for the writers
+    std::mutex writer_gate; // Held by a writer while it waits, so a steady flow of readers cannot starve it
+
+    std::shared_lock<std::shared_mutex> read_lock();
+    std::unique_lock<std::shared_mutex> write_lock();
+
+    // Groups the boxes read by a constructor
+    void build_groups();
 
-    // Helper methods
-    bool is_true_positive_or_false_positive(const BoundingBox& pred_box);
-    bool is_false_negative(const BoundingBox& gt_box);
+    // Helper methods, called with mtx held
+    void insert_prediction(const BoundingBox& pred_box);
+    // Whether each prediction is a true positive and each ground truth a false negative
+    std::pair<std::vector<uint8_t>, std::vector<uint8_t>> match_masks();
+    bool is_true_positive_or_false_positive(const BoundingBox& pred_box, MatchCounters& counters) const;
+    bool is_false_negative(const BoundingBox& gt_box, MatchCounters& counters) const;
 };
 
 #endif // EVALUATOR_H
@@ -1,14 +1,12 @@
 #include "openmp_evaluator.h"
-#include <nlohmann/json.hpp>
-#include <fstream>
+#include "annotation_reader.h"
 #include <iostream>
 #include <algorithm>
 #include <vector>
 #include <cmath>
+#include <stdexcept>
 #include <omp.h>  // For OpenMP
 
-using json = nlohmann::json;
-
 // BoundingBox class implementation
 BoundingBox::BoundingBox(int ann_id, int img_id, int cat_id, int x1, int y1, int w, int h)
     : annotation_id(ann_id), image_id(img_id), category_id(cat_id), x1(x1), y1(y1), x2(x1 + w), y2(y1 + h) {}
@@ -52,58 +50,273 @@ bool BoundingBox::is_false_negative(const std::vector<BoundingBox>& predicted_bo
 }
 
 // OpenmpEvaluator class implementation
-OpenmpEvaluator::OpenmpEvaluator(const std::string& ground_truth_json, const std::string& predictions_json) {
-    std::ifstream gt_file(ground_truth_json);
-    std::ifstream pred_file(predictions_json);
+OpenmpEvaluator::OpenmpEvaluator(const std::string& ground_truth_json, const std::string& predictions_json, bool collect_stats) {
+    stats.enabled = collect_stats;
+    {
+        PhaseTimer timer(stats, &EvaluationStats::parse_seconds);
+        read_annotation_files(ground_truth_json, predictions_json, [this](const AnnotationRecord& ann) {
+            ground_truth_boxes.emplace_back(
+                ann.annotation_id, ann.image_id, ann.category_id,
+                ann.bbox[0], ann.bbox[1], ann.bbox[2], ann.bbox[3]);
+        }, [this](const AnnotationRecord& ann) {
+            predicted_boxes.emplace_back(
+                ann.annotation_id, ann.image_id, ann.category_id,
+                ann.bbox[0], ann.bbox[1], ann.bbox[2], ann.bbox[3]);
+        });
+    }
 
-    if (!gt_file.is_open() || !pred_file.is_open()) {
-        throw std::runtime_error("Error opening JSON files.");
+    PhaseTimer timer(stats, &EvaluationStats::index_seconds);
+    ground_truth_index = SpatialIndex(ground_truth_boxes);
+    predicted_index = SpatialIndex(predicted_boxes);
+}
+
+OpenmpEvaluator::OpenmpEvaluator(const std::string& ground_truth_json, bool collect_stats) {
+    stats.enabled = collect_stats;
+    {
+        PhaseTimer timer(stats, &EvaluationStats::parse_seconds);
+        read_annotation_file(ground_truth_json, [this](const AnnotationRecord& ann) {
+            ground_truth_boxes.emplace_back(
+                ann.annotation_id, ann.image_id, ann.category_id,
+                ann.bbox[0], ann.bbox[1], ann.bbox[2], ann.bbox[3]);
+        });
     }
 
-    json gt_data, pred_data;
-    gt_file >> gt_data;
-    pred_file >> pred_data;
+    PhaseTimer timer(stats, &EvaluationStats::index_seconds);
+    ground_truth_index = SpatialIndex(ground_truth_boxes);
+}
 
-    for (const auto& ann : gt_data["annotations"]) {
-        ground_truth_boxes.emplace_back(
-            ann["annotation_id"], ann["image_id"], ann["category_id"],
-            ann["bbox"][0], ann["bbox"][1], ann["bbox"][2], ann["bbox"][3]);
+OpenmpEvaluator::OpenmpEvaluator(const int* ground_truth_rows, std::size_t num_ground_truths, const int* prediction_rows, std::size_t num_predictions,
+                                 bool collect_stats) {
+    stats.enabled = collect_stats;
+    {
+        PhaseTimer timer(stats, &EvaluationStats::parse_seconds);
+        ground_truth_boxes.reserve(num_ground_truths);
+        read_annotation_rows(ground_truth_rows, num_ground_truths, [this](const AnnotationRecord& ann) {
+            ground_truth_boxes.emplace_back(
+                ann.annotation_id, ann.image_id, ann.category_id,
+                ann.bbox[0], ann.bbox[1], ann.bbox[2], ann.bbox[3]);
+        });
+
+        predicted_boxes.reserve(num_predictions);
+        read_annotation_rows(prediction_rows, num_predictions, [this](const AnnotationRecord& ann) {
+            predicted_boxes.emplace_back(
+                ann.annotation_id, ann.image_id, ann.category_id,
+                ann.bbox[0], ann.bbox[1], ann.bbox[2], ann.bbox[3]);
+        });
     }
 
-    for (const auto& ann : pred_data["annotations"]) {
-        predicted_boxes.emplace_back(
-            ann["annotation_id"], ann["image_id"], ann["category_id"],
-            ann["bbox"][0], ann["bbox"][1], ann["bbox"][2], ann["bbox"][3]);
+    PhaseTimer timer(stats, &EvaluationStats::index_seconds);
+    ground_truth_index = SpatialIndex(ground_truth_boxes);
+    predicted_index = SpatialIndex(predicted_boxes);
+}
+
+void OpenmpEvaluator::set_num_threads(int num_threads) {
+    if (num_threads < 0) {
+        throw std::invalid_argument("num_threads must be >= 0 (0 uses the OpenMP default)");
+    }
+    this->num_threads = num_threads;
+}
+
+int OpenmpEvaluator::get_num_threads() const {
+    return num_threads;
+}
+
+void OpenmpEvaluator::set_schedule(const std::string& kind, int chunk_size) {
+    if (kind == "static") {
+        schedule_kind = omp_sched_static;
+    } else if (kind == "dynamic") {
+        schedule_kind = omp_sched_dynamic;
+    } else if (kind == "guided") {
+        schedule_kind = omp_sched_guided;
+    } else if (kind == "auto") {
+        schedule_kind = omp_sched_auto;
+    } else {
+        throw std::invalid_argument("Unknown schedule '" + kind + "', expected static, dynamic, guided or auto");
+    }
+    if (chunk_size < 0) {
+        throw std::invalid_argument("chunk_size must be >= 0 (0 uses the OpenMP default)");
+    }
+    this->chunk_size = chunk_size;
+}
+
+std::pair<std::string, int> OpenmpEvaluator::get_schedule() const {
+    switch (schedule_kind) {
+        case omp_sched_static: return {"static", chunk_size};
+        case omp_sched_guided: return {"guided", chunk_size};
+        case omp_sched_auto: return {"auto", chunk_size};
+        default: return {"dynamic", chunk_size};
     }
 }
 
+int OpenmpEvaluator::team_size() const {
+    // The loops below use schedule(runtime), which reads the schedule set here
+    omp_set_schedule(schedule_kind, chunk_size);
+    return num_threads > 0 ? num_threads : omp_get_max_threads();
+}
+
 std::tuple<std::vector<int>, std::vector<int>, std::vector<int>> OpenmpEvaluator::evaluate() {
+    // The threads only write their own flags; the ids are gathered afterwards, in input order
+    return collect_ids(predicted_boxes, match_masks(predicted_boxes, predicted_index));
+}
+
+std::pair<std::vector<uint8_t>, std::vector<uint8_t>> OpenmpEvaluator::evaluate_masks() {
+    return match_masks(predicted_boxes, predicted_index);
+}
+
+std::tuple<std::vector<int>, std::vector<int>, std::vector<int>> OpenmpEvaluator::evaluate_predictions(const std::string& predictions_json) const {
+    std::vector<BoundingBox> predictions;
+    {
+        PhaseTimer timer(stats, &EvaluationStats::parse_seconds);
+        read_annotation_file(predictions_json, [&predictions](const AnnotationRecord& ann) {
+            predictions.emplace_back(
+                ann.annotation_id, ann.image_id, ann.category_id,
+                ann.bbox[0], ann.bbox[1], ann.bbox[2], ann.bbox[3]);
+        });
+    }
+    return collect_ids(predictions, match_masks(predictions, index_predictions(predictions)));
+}
+
+std::tuple<std::vector<int>, std::vector<int>, std::vector<int>> OpenmpEvaluator::evaluate_prediction_rows(const int* prediction_rows, std::size_t num_predictions) const {
+    std::vector<BoundingBox> predictions;
+    {
+        PhaseTimer timer(stats, &EvaluationStats::parse_seconds);
+        predictions.reserve(num_predictions);
+        read_annotation_rows(prediction_rows, num_predictions, [&predictions](const AnnotationRecord& ann) {
+            predictions.emplace_back(
+                ann.annotation_id, ann.image_id, ann.category_id,
+                ann.bbox[0], ann.bbox[1], ann.bbox[2], ann.bbox[3]);
+        });
+    }
+    return collect_ids(predictions, match_masks(predictions, index_predictions(predictions)));
+}
+
+SpatialIndex OpenmpEvaluator::index_predictions(const std::vector<BoundingBox>& predictions) const {
+    PhaseTimer timer(stats, &EvaluationStats::index_seconds);
+    return SpatialIndex(predictions);
+}
+
+std::pair<std::vector<uint8_t>, std::vector<uint8_t>> OpenmpEvaluator::match_masks(const std::vector<BoundingBox>& predictions, const SpatialIndex& prediction_index) const {
+    PhaseTimer timer(stats, &EvaluationStats::match_seconds);
+    std::vector<uint8_t> pred_is_tp(predictions.size());
+    std::vector<uint8_t> gt_is_fn(ground_truth_boxes.size());
+    int threads = team_size();
+
+    #pragma omp parallel num_threads(threads)
+    {
+        MatchCounters counters;  // Merged once per thread
+
+        #pragma omp for schedule(runtime)
+        for (int i = 0; i < static_cast<int>(predictions.size()); ++i) {
+            pred_is_tp[i] = ground_truth_index.any_match(predictions[i], 0.5, counters);
+        }
+
+        #pragma omp for schedule(runtime)
+        for (int i = 0; i < static_cast<int>(ground_truth_boxes.size()); ++i) {
+            gt_is_fn[i] = !prediction_index.any_match(ground_truth_boxes[i], 0.5, counters);
+        }
+
+        stats.add(counters);
+    }
+
+    return {std::move(pred_is_tp), std::move(gt_is_fn)};
+}
+
+std::tuple<std::vector<int>, std::vector<int>, std::vector<int>> OpenmpEvaluator::collect_ids(
+        const std::vector<BoundingBox>& predictions, const std::pair<std::vector<uint8_t>, std::vector<uint8_t>>& masks) const {
+    PhaseTimer timer(stats, &EvaluationStats::collect_seconds);
+    const auto& pred_is_tp = masks.first;
+    const auto& gt_is_fn = masks.second;
+
     std::vector<int> tp_pred_ids;
     std::vector<int> fp_pred_ids;
     std::vector<int> fn_gt_ids;
 
-    // Parallel loop for predictions
-    #pragma omp parallel for
-    for (int i = 0; i < predicted_boxes.size(); ++i) {
-        const auto& pred_box = predicted_boxes[i];
-        if (pred_box.is_true_positive_or_false_positive(ground_truth_boxes)) {
-            #pragma omp critical
-            tp_pred_ids.push_back(pred_box.annotation_id);
+    size_t num_tp = std::count(pred_is_tp.begin(), pred_is_tp.end(), 1);
+    tp_pred_ids.reserve(num_tp);
+    fp_pred_ids.reserve(predictions.size() - num_tp);
+    for (size_t i = 0; i < predictions.size(); ++i) {
+        if (pred_is_tp[i]) {
+            tp_pred_ids.push_back(predictions[i].annotation_id);
         } else {
-            #pragma omp critical
-            fp_pred_ids.push_back(pred_box.annotation_id);
+            fp_pred_ids.push_back(predictions[i].annotation_id);
         }
     }
 
-    // Parallel loop for ground truth
-    #pragma omp parallel for
-    for (int i = 0; i < ground_truth_boxes.size(); ++i) {
-        const auto& gt_box = ground_truth_boxes[i];
-        if (gt_box.is_false_negative(predicted_boxes)) {
-            #pragma omp critical
-            fn_gt_ids.push_back(gt_box.annotation_id);
+    for (size_t i = 0; i < ground_truth_boxes.size(); ++i) {
+        if (gt_is_fn[i]) {
+            fn_gt_ids.push_back(ground_truth_boxes[i].annotation_id);
+        }
+    }
+
+    return std::make_tuple(std::move(tp_pred_ids), std::move(fp_pred_ids), std::move(fn_gt_ids));
+}
+
+std::pair<std::vector<double>, std::vector<double>> OpenmpEvaluator::best_ious(double min_iou, double enough_iou) {
+    PhaseTimer timer(stats, &EvaluationStats::match_seconds);
+    std::vector<double> pred_best_iou(predicted_boxes.size());
+    std::vector<double> gt_best_iou(ground_truth_boxes.size());
+    int threads = team_size();
+
+    #pragma omp parallel num_threads(threads)
+    {
+        MatchCounters counters;  // Merged once per thread
+
+        #pragma omp for schedule(runtime)
+        for (int i = 0; i < static_cast<int>(predicted_boxes.size()); ++i) {
+            pred_best_iou[i] = ground_truth_index.best_iou(predicted_boxes[i], min_iou, enough_iou, counters);
+        }
+
+        #pragma omp for schedule(runtime)
+        for (int i = 0; i < static_cast<int>(ground_truth_boxes.size()); ++i) {
+            gt_best_iou[i] = predicted_index.best_iou(ground_truth_boxes[i], min_iou, enough_iou, counters);
+        }
+
+        stats.add(counters);
+    }
+
+    return {std::move(pred_best_iou), std::move(gt_best_iou)};
+}
+
+std::vector<std::tuple<std::vector<int>, std::vector<int>, std::vector<int>>> OpenmpEvaluator::evaluate_thresholds(const std::vector<double>& iou_thresholds) {
+    // Boxes without a candidate keep a best IoU of 0, which a threshold <= 0 would count as a match
+    for (double iou_threshold : iou_thresholds) {
+        if (!(iou_threshold > 0 && iou_threshold <= 1)) {
+            throw std::invalid_argument("iou_thresholds must be in (0, 1], got " + std::to_string(iou_threshold));
+        }
+    }
+    std::vector<std::tuple<std::vector<int>, std::vector<int>, std::vector<int>>> results(iou_thresholds.size());
+    if (iou_thresholds.empty()) {
+        return results;
+    }
+
+    // One search at the loosest threshold: its candidate window contains those of all the others.
+    // A box that reaches the strictest threshold is a match everywhere, so its search stops there.
+    auto bounds = std::minmax_element(iou_thresholds.begin(), iou_thresholds.end());
+    auto best = best_ious(*bounds.first, *bounds.second);
+    const auto& pred_best_iou = best.first;
+    const auto& gt_best_iou = best.second;
+    PhaseTimer timer(stats, &EvaluationStats::collect_seconds);
+
+    #pragma omp parallel for num_threads(team_size())
+    for (int t = 0; t < static_cast<int>(iou_thresholds.size()); ++t) {
+        double iou_threshold = iou_thresholds[t];
+        auto& tp_pred_ids = std::get<0>(results[t]);
+        auto& fp_pred_ids = std::get<1>(results[t]);
+        auto& fn_gt_ids = std::get<2>(results[t]);
+
+        for (size_t i = 0; i < predicted_boxes.size(); ++i) {
+            if (pred_best_iou[i] >= iou_threshold) {
+                tp_pred_ids.push_back(predicted_boxes[i].annotation_id);
+            } else {
+                fp_pred_ids.push_back(predicted_boxes[i].annotation_id);
+            }
+        }
+        for (size_t i = 0; i < ground_truth_boxes.size(); ++i) {
+            if (!(gt_best_iou[i] >= iou_threshold)) {
+                fn_gt_ids.push_back(ground_truth_boxes[i].annotation_id);
+            }
         }
     }
 
-    return std::make_tuple(tp_pred_ids, fp_pred_ids, fn_gt_ids);
+    return results;
 }
@@ -1,9 +1,16 @@
 #ifndef OPENMP_EVALUATOR_H
 #define OPENMP_EVALUATOR_H
 
+#include <cstddef>
+#include <cstdint>
+#include <utility>
 #include <vector>
 #include <string>
 #include <tuple>
+#include <unordered_map>
+#include <omp.h>
+#include "evaluation_stats.h"
+#include "spatial_grid.h"
 
 // BoundingBox class declaration
 class BoundingBox {
@@ -31,14 +38,67 @@ public:
 class OpenmpEvaluator {
 public:
     // Constructor that loads ground truth and predicted bounding boxes from JSON files
-    OpenmpEvaluator(const std::string& ground_truth_json, const std::string& predictions_json);
+    OpenmpEvaluator(const std::string& ground_truth_json, const std::string& predictions_json, bool collect_stats = false);
 
-    // Evaluate the predictions, returning true positives, false positives, and false negatives
+    // Constructor that only loads the ground truth, to score prediction sets with evaluate_predictions
+    explicit OpenmpEvaluator(const std::string& ground_truth_json, bool collect_stats = false);
+
+    // Constructor that takes the boxes as rows of annotation_id, image_id, category_id, x, y, w, h
+    OpenmpEvaluator(const int* ground_truth_rows, std::size_t num_ground_truths, const int* prediction_rows, std::size_t num_predictions,
+                    bool collect_stats = false);
+
+    // Threads of the parallel loops; 0 uses the OpenMP default (OMP_NUM_THREADS or all cores)
+    void set_num_threads(int num_threads);
+    int get_num_threads() const;
+
+    // Loop schedule: "static", "dynamic", "guided" or "auto", with a chunk size (0 for the OpenMP default)
+    void set_schedule(const std::string& kind, int chunk_size = 0);
+    std::pair<std::string, int> get_schedule() const;
+
+    // Evaluate the predictions, returning true positives, false positives, and false negatives,
+    // each in the order of the input files
     std::tuple<std::vector<int>, std::vector<int>, std::vector<int>> evaluate();
 
+    // Per-box flags in input order (prediction is a true positive, ground truth is a false negative),
+    // written by the threads without any critical section; evaluate() compacts them into ids
+    std::pair<std::vector<uint8_t>, std::vector<uint8_t>> evaluate_masks();
+
+    // Score another prediction set against the resident ground truth, leaving the evaluator unchanged.
+    // Safe to call from several threads at once; ids in the order of the predictions.
+    std::tuple<std::vector<int>, std::vector<int>, std::vector<int>> evaluate_predictions(const std::string& predictions_json) const;
+    std::tuple<std::vector<int>, std::vector<int>, std::vector<int>> evaluate_prediction_rows(const int* prediction_rows, std::size_t num_predictions) const;
+
+    // Best IoU of every prediction against the ground truths of its group, and of every ground truth
+    // against the predictions of its group, in input order. Values below min_iou are not exact, and
+    // neither are values above enough_iou, which only says that a box reached it.
+    std::pair<std::vector<double>, std::vector<double>> best_ious(double min_iou = 0.5, double enough_iou = 1.0);
+
+    // evaluate() for every threshold in a single search: the best IoU of each box is computed once at
+    // the lowest threshold and then compared with each of them. One (tp, fp, fn) tuple per threshold;
+    // invalid_argument for a threshold outside (0, 1].
+    std::vector<std::tuple<std::vector<int>, std::vector<int>, std::vector<int>>> evaluate_thresholds(const std::vector<double>& iou_thresholds);
+
+    // Only filled when collect_stats was set. Every thread of a parallel loop merges its counters once;
+    // evaluate_predictions also adds to it, from any number of threads.
+    mutable EvaluationStats stats;
+
 private:
     std::vector<BoundingBox> ground_truth_boxes;   // Ground truth bounding boxes
     std::vector<BoundingBox> predicted_boxes;      // Predicted bounding boxes
+    SpatialIndex ground_truth_index;               // Grids over the ground truth boxes of each group
+    SpatialIndex predicted_index;                  // Grids over the predicted boxes of each group
+
+    int num_threads = 0;                           // 0: OpenMP default
+    omp_sched_t schedule_kind = omp_sched_dynamic; // Grid queries vary a lot in cost, so balance them
+    int chunk_size = 64;
+
+    // Applies the schedule to the calling thread and returns the number of threads to use
+    int team_size() const;
+
+    SpatialIndex index_predictions(const std::vector<BoundingBox>& predictions) const;
+    std::pair<std::vector<uint8_t>, std::vector<uint8_t>> match_masks(const std::vector<BoundingBox>& predictions, const SpatialIndex& prediction_index) const;
+    std::tuple<std::vector<int>, std::vector<int>, std::vector<int>> collect_ids(
+        const std::vector<BoundingBox>& predictions, const std::pair<std::vector<uint8_t>, std::vector<uint8_t>>& masks) const;
 };
 
 #endif // OPENMP_EVALUATOR_H
@@ -1,9 +1,21 @@
 #include <pybind11/pybind11.h>
+#include <pybind11/numpy.h>
 #include <pybind11/stl.h>  // This allows automatic conversion of C++ STL types like std::vector to Python lists
 #include "openmp_evaluator.h"
+#include "numpy_buffers.h"
+#include "async_evaluation.h"
+#include "evaluation_stats_binding.h"
 
 namespace py = pybind11;
 
+static std::vector<double> coco_iou_thresholds() {
+    std::vector<double> thresholds;
+    for (int i = 0; i < 10; ++i) {
+        thresholds.push_back(0.5 + 0.05 * i);
+    }
+    return thresholds;
+}
+
 PYBIND11_MODULE(openmp_evaluator, m) {
     py::class_<BoundingBox>(m, "BoundingBox")
         .def(py::init<int, int, int, int, int, int, int>())
@@ -12,6 +24,62 @@ PYBIND11_MODULE(openmp_evaluator, m) {
         .def("is_false_negative", &BoundingBox::is_false_negative);
 
     py::class_<OpenmpEvaluator>(m, "OpenmpEvaluator")
-        .def(py::init<const std::string&, const std::string&>())
-        .def("evaluate", &OpenmpEvaluator::evaluate);
+        .def(py::init<const std::string&, const std::string&, bool>(), py::arg("ground_truth_json"), py::arg("predictions_json"),
+             py::arg("collect_stats") = false, py::call_guard<py::gil_scoped_release>())
+        .def(py::init<const std::string&, bool>(), py::arg("ground_truth_json"), py::arg("collect_stats") = false,
+             py::call_guard<py::gil_scoped_release>())
+        .def(py::init([](const BoxRows& ground_truths, const BoxRows& predictions, bool collect_stats) {  // (N, 7) int32 rows, read in place
+            const int* ground_truth_rows = box_rows_data(ground_truths, "ground_truths");
+            const int* prediction_rows = box_rows_data(predictions, "predictions");
+            std::size_t num_ground_truths = ground_truths.shape(0);
+            std::size_t num_predictions = predictions.shape(0);
+            py::gil_scoped_release release;  // The arrays stay alive as arguments of the call
+            return new OpenmpEvaluator(ground_truth_rows, num_ground_truths, prediction_rows, num_predictions, collect_stats);
+        }), py::arg("ground_truths"), py::arg("predictions"), py::arg("collect_stats") = false)
+        .def_property("num_threads", &OpenmpEvaluator::get_num_threads, &OpenmpEvaluator::set_num_threads)  // 0: OpenMP default
+        .def("set_schedule", &OpenmpEvaluator::set_schedule, py::arg("kind"), py::arg("chunk_size") = 0)
+        .def_property_readonly("schedule", &OpenmpEvaluator::get_schedule)  // (kind, chunk_size)
+        // common.evaluation_stats.EvaluationStats accumulated since construction, None unless collect_stats was set
+        .def_property_readonly("stats", [](const OpenmpEvaluator& self) { return stats_to_python(self.stats); })
+        .def("evaluate", &OpenmpEvaluator::evaluate, py::call_guard<py::gil_scoped_release>())
+        .def("evaluate_async", [](py::object self, py::object executor) {  // concurrent.futures.Future of evaluate()
+            return submit_evaluation(self, "evaluate", executor);
+        }, py::arg("executor") = py::none())
+        .def("evaluate_arrays", [](OpenmpEvaluator& self) {  // Same ids as evaluate, as int32 arrays
+            std::tuple<std::vector<int>, std::vector<int>, std::vector<int>> result;
+            {
+                py::gil_scoped_release release;
+                result = self.evaluate();
+            }
+            return py::make_tuple(to_numpy(std::move(std::get<0>(result))),
+                                  to_numpy(std::move(std::get<1>(result))),
+                                  to_numpy(std::move(std::get<2>(result))));
+        })
+        .def("evaluate_masks", [](OpenmpEvaluator& self) {  // Boolean masks in input order: pred_is_tp, gt_is_fn
+            std::pair<std::vector<uint8_t>, std::vector<uint8_t>> masks;
+            {
+                py::gil_scoped_release release;
+                masks = self.evaluate_masks();
+            }
+            return py::make_tuple(mask_to_numpy(std::move(masks.first)), mask_to_numpy(std::move(masks.second)));
+        })
+        // Other prediction sets against the resident ground truth; see common/batch_evaluation.py for many at once
+        .def("evaluate_predictions", &OpenmpEvaluator::evaluate_predictions,
+             py::arg("predictions_json"), py::call_guard<py::gil_scoped_release>())
+        .def("evaluate_predictions", [](const OpenmpEvaluator& self, const BoxRows& predictions) {  // (N, 7) int32 rows
+            const int* prediction_rows = box_rows_data(predictions, "predictions");
+            std::size_t num_predictions = predictions.shape(0);
+            py::gil_scoped_release release;
+            return self.evaluate_prediction_rows(prediction_rows, num_predictions);
+        }, py::arg("predictions"))
+        .def("evaluate_thresholds", &OpenmpEvaluator::evaluate_thresholds,
+             py::arg("iou_thresholds") = coco_iou_thresholds(), py::call_guard<py::gil_scoped_release>())  // COCO 0.50:0.05:0.95 by default
+        .def("best_ious", [](OpenmpEvaluator& self, double min_iou, double enough_iou) {  // float64 arrays: pred_best_iou, gt_best_iou
+            std::pair<std::vector<double>, std::vector<double>> best;
+            {
+                py::gil_scoped_release release;
+                best = self.best_ious(min_iou, enough_iou);
+            }
+            return py::make_tuple(to_numpy(std::move(best.first)), to_numpy(std::move(best.second)));
+        }, py::arg("min_iou") = 0.5, py::arg("enough_iou") = 1.0);
 }
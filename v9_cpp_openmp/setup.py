@@ -19,7 +19,7 @@ ext_modules = [
     Extension(
         'openmp_evaluator',
         ['openmp_evaluator.cpp', 'openmp_evaluator_wrapper.cpp'],
-        include_dirs=[pybind11_include],
+        include_dirs=[pybind11_include, '../common'],
         extra_compile_args=['-fopenmp'],
         extra_link_args=['-fopenmp'],
         language='c++'